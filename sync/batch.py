@@ -0,0 +1,126 @@
+import concurrent.futures
+import contextlib
+import glob
+import io
+import os
+import re
+import time
+import traceback
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime as dt
+
+from sync.cache import CACHE_DIR
+from sync.formats import DEFAULT_FORMATS
+from sync.matching import DEFAULT_MATCH_KEYS
+from sync.pipeline import NATIONALITY_FILE, load_nationality_mapping, sync_school
+
+OA_FILE_PATTERN = re.compile(r'^OA \((?P<school>.+)\)\.xlsx$')
+
+
+def discover_schools(pattern):
+    """Finds (school name, data directory) pairs from the OA exports matching a glob pattern such as
+    'exports/*/OA (*).xlsx'. A directory finds every OA export directly inside it."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(glob.escape(pattern), 'OA (*).xlsx')
+    schools = []
+    for path in sorted(glob.glob(pattern)):
+        match = OA_FILE_PATTERN.match(os.path.basename(path))
+        if match:
+            schools.append((match['school'], os.path.dirname(path) or '.'))
+    return schools
+
+
+def _sync_school_job(school_name, data_dir, nationality_mapping, output_dir, cache_dir, snapshot_dir, profile, formats=DEFAULT_FORMATS, match_keys=DEFAULT_MATCH_KEYS, summary_only=False, snapshot_by_school=False):
+    """Runs one school in a worker process. Errors are returned rather than raised, so a failing
+    school never stops the others. With summary_only, the result holds the school's conflict
+    counts instead of its output path."""
+    started = time.perf_counter()
+    result = {'school': school_name, 'data_dir': data_dir}
+    try:
+        # The per-stage progress lines of concurrent schools would interleave; the summary replaces them
+        with contextlib.redirect_stdout(io.StringIO()):
+            output = sync_school(
+                school_name, nationality_mapping=nationality_mapping,
+                data_dir=data_dir, output_dir=output_dir, cache_dir=cache_dir, snapshot_dir=snapshot_dir,
+                profile=profile, formats=formats, match_keys=match_keys, summary_only=summary_only,
+                snapshot_by_school=snapshot_by_school,
+            )
+        result['counts' if summary_only else 'output'] = output
+        result['status'] = 'ok'
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f'{type(e).__name__}: {e}'
+        result['traceback'] = traceback.format_exc()
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _failed_result(school, error):
+    school_name, data_dir = school
+    return {'school': school_name, 'data_dir': data_dir, 'status': 'failed', 'error': f'{type(error).__name__}: {error}'}
+
+
+def _run_isolated(job):
+    """Runs one school's _sync_school_job in a process of its own, so that a worker that dies only
+    fails that school."""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
+        try:
+            return pool.submit(_sync_school_job, *job).result()
+        except Exception as e:
+            return _failed_result(job[:2], e)
+
+
+def run_batch(schools, workers=None, nationality_file=NATIONALITY_FILE, output_dir=None, cache_dir=CACHE_DIR, snapshot_dir=None, profile=False, formats=DEFAULT_FORMATS, match_keys=DEFAULT_MATCH_KEYS, summary_only=False, on_result=None):
+    """Runs sync_school for every (school name, data directory) pair across a process pool.
+
+    The nationality mapping is loaded once and handed to every worker. on_result is called with each
+    school's result as soon as it finishes. A worker process that dies only fails its own school: the
+    schools the broken pool had not finished are run again, each in a process of its own. Returns the run summary; with summary_only, every school's
+    result holds its conflict counts (see sync.pipeline.conflict_counts) and no workbook or table is
+    written.
+    """
+    started_at = dt.now()
+    started = time.perf_counter()
+    nationality_mapping = load_nationality_mapping(nationality_file, cache_dir=cache_dir)
+
+    jobs = [
+        (school_name, data_dir, nationality_mapping, output_dir, cache_dir, snapshot_dir, profile, formats, match_keys, summary_only)
+        for school_name, data_dir in schools
+    ]
+    results = [None] * len(schools)
+
+    def finish(k, result):
+        results[k] = result
+        if on_result is not None:
+            on_result(result)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_sync_school_job, *job): k for k, job in enumerate(jobs)}
+        for future in concurrent.futures.as_completed(futures):
+            k = futures[future]
+            try:
+                finish(k, future.result())
+            except BrokenProcessPool:
+                # A worker process died (e.g. killed for running out of memory) and took the pool
+                # down: the schools it had not finished yet are run again below
+                pass
+            except Exception as e:
+                finish(k, _failed_result(schools[k], e))
+
+    # Which school's worker died cannot be told from the pool, so each school left runs in its own
+    # process: only a school that kills its worker again fails
+    unfinished = [k for k, result in enumerate(results) if result is None]
+    if unfinished:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as threads:
+            futures = {threads.submit(_run_isolated, jobs[k]): k for k in unfinished}
+            for future in concurrent.futures.as_completed(futures):
+                finish(futures[future], future.result())
+
+    return {
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'seconds': round(time.perf_counter() - started, 3),
+        'workers': workers or os.cpu_count(),
+        'succeeded': sum(result['status'] == 'ok' for result in results),
+        'failed': sum(result['status'] != 'ok' for result in results),
+        'schools': results,
+    }
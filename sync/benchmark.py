@@ -0,0 +1,166 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime as dt
+
+import pandas as pd
+
+from sync.comparison import add_comparison_columns, add_parents_comparison_columns
+from sync.matching import propose_matches
+from sync.pipeline import (NATIONALITY_FILE, build_conflict_sheets, build_conflict_summary, build_export_frame, build_parent_contacts, load_data,
+                           load_nationality_mapping, merge_students, preprocess_isams, preprocess_oa, write_workbook)
+from sync.synthetic import generate_school
+
+# Stages of the pipeline, in order. Styling happens while the sheets are streamed, so it is part
+# of export.
+STAGES = ['load', 'preprocess', 'merge', 'compare', 'note', 'sheets', 'export']
+SCHOOL_NAME = 'Synthetic School'
+# A stage is reported as a regression when it is this much slower than its baseline
+DEFAULT_TOLERANCE = 1.2
+# Stages faster than this in the baseline are too noisy to compare
+MIN_COMPARED_SECONDS = 0.05
+
+
+def run_stages(school_name, data_dir, output_path, measure):
+    """Runs the pipeline once on the files in data_dir. measure(stage) is a context manager
+    wrapped around every stage."""
+    with measure('load'):
+        nationality_mapping = load_nationality_mapping(os.path.join(data_dir, NATIONALITY_FILE), cache_dir=None)
+        oa_df, isams_df, grade_year_mapping_dict = load_data(school_name, data_dir=data_dir, cache_dir=None)
+    with measure('preprocess'):
+        isams_df_copy, max_i = preprocess_isams(isams_df, nationality_mapping)
+        oa_df_copy = preprocess_oa(oa_df, nationality_mapping, grade_year_mapping_dict)
+        isams_df_copy = isams_df_copy.add_prefix('isams_')
+        oa_df_copy = oa_df_copy.add_prefix('oa_')
+    with measure('merge'):
+        merged_df, leftover_isams, leftover_oa = merge_students(isams_df_copy, oa_df_copy)
+        possible_matches = propose_matches(leftover_isams, leftover_oa)
+    with measure('compare'):
+        merged_df_copy = add_comparison_columns(merged_df)
+        merged_df_copy = add_parents_comparison_columns(merged_df_copy, max_i)
+    with measure('note'):
+        export_df_copy, facts = build_export_frame(merged_df_copy, leftover_isams, leftover_oa, max_i)
+    with measure('sheets'):
+        conflict_sheets = build_conflict_sheets(export_df_copy, facts, max_i)
+        parent_contacts = build_parent_contacts(export_df_copy, facts)
+        summary = build_conflict_summary(export_df_copy)
+    with measure('export'):
+        write_workbook(output_path, export_df_copy, conflict_sheets, max_i, possible_matches, summary, parent_contacts)
+    return {'students': len(isams_df_copy), 'matched': len(merged_df), 'rows': len(export_df_copy)}
+
+
+def time_stages(school_name, data_dir, output_path):
+    seconds = {}
+
+    @contextlib.contextmanager
+    def measure(stage):
+        started = time.perf_counter()
+        yield
+        seconds[stage] = time.perf_counter() - started
+
+    counts = run_stages(school_name, data_dir, output_path, measure)
+    return seconds, counts
+
+
+def trace_stages(school_name, data_dir, output_path):
+    """Peak traced memory (MB) of every stage. tracemalloc slows everything down, so this is a
+    separate run from the timed ones."""
+    peaks = {}
+
+    @contextlib.contextmanager
+    def measure(stage):
+        tracemalloc.reset_peak()
+        yield
+        peaks[stage] = tracemalloc.get_traced_memory()[1] / 2**20
+
+    tracemalloc.start()
+    try:
+        run_stages(school_name, data_dir, output_path, measure)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def benchmark_scenario(data_dir, repeat=3, memory=True, school_name=SCHOOL_NAME):
+    """Benchmarks the school in data_dir: the best of repeat timed runs per stage and, with memory,
+    the peak memory per stage."""
+    with tempfile.TemporaryDirectory() as output_dir:
+        output_path = os.path.join(output_dir, 'analysis.xlsx')
+        # The per-stage progress lines of the pipeline are not part of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            runs = [time_stages(school_name, data_dir, output_path) for _ in range(repeat)]
+            peaks = trace_stages(school_name, data_dir, output_path) if memory else {}
+
+    stages = {}
+    for stage in STAGES:
+        stages[stage] = {'seconds': round(min(seconds[stage] for seconds, _ in runs), 4)}
+        if stage in peaks:
+            stages[stage]['peak_mb'] = round(peaks[stage], 2)
+    return {
+        'counts': runs[0][1],
+        'seconds': round(sum(stage['seconds'] for stage in stages.values()), 4),
+        'stages': stages,
+    }
+
+
+def run_benchmark(student_counts, work_dir=None, repeat=3, memory=True, on_result=None, **generator_options):
+    """Generates a synthetic school per student count and benchmarks it. generator_options are
+    passed to generate_school. Returns the report."""
+    report = {
+        'started_at': dt.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'generator': generator_options,
+        'scenarios': {},
+    }
+    with contextlib.ExitStack() as stack:
+        if work_dir is None:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        for students in student_counts:
+            data_dir = os.path.join(work_dir, f'{students} students')
+            generate_school(data_dir, SCHOOL_NAME, students=students, **generator_options)
+            result = benchmark_scenario(data_dir, repeat=repeat, memory=memory)
+            report['scenarios'][str(students)] = result
+            if on_result is not None:
+                on_result(students, result)
+    return report
+
+
+def compare_to_baseline(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Per scenario and stage, the ratio of the current to the baseline seconds and peak memory.
+    Returns (rows, regressions) where regressions are the rows above tolerance."""
+    rows = []
+    for scenario, result in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if previous is None:
+            continue
+        for stage, current in result['stages'].items():
+            before = previous['stages'].get(stage, {})
+            for metric in ('seconds', 'peak_mb'):
+                if metric not in current or not before.get(metric):
+                    continue
+                if metric == 'seconds' and before[metric] < MIN_COMPARED_SECONDS:
+                    continue
+                rows.append({
+                    'scenario': scenario, 'stage': stage, 'metric': metric,
+                    'baseline': before[metric], 'current': current[metric],
+                    'ratio': round(current[metric] / before[metric], 3),
+                })
+    regressions = [row for row in rows if row['ratio'] > tolerance]
+    return rows, regressions
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_report(path, report):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import time
+
+import pandas as pd
+
+# Content-addressed cache of the parsed input files. Entries are pickled frames: they load in
+# milliseconds and keep the mixed object columns of the Excel exports exactly as read. Bump
+# CACHE_VERSION whenever what a reader returns changes without its name, options or schema changing.
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'isams-oa-sync')
+CACHE_VERSION = 2
+CACHE_SUFFIX = '.pkl'
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_MAX_SIZE_MB = 512
+
+
+def typed_like_excel(values):
+    """Text values (from an API or XML feed) typed the way read_excel types a column: integers when
+    every value is a whole number, floats when some are missing, the text otherwise."""
+    numbers = pd.to_numeric(values, errors='coerce')
+    if numbers.notna().sum() != values.notna().sum():
+        return values
+    if numbers.notna().all() and (numbers % 1 == 0).all():
+        return numbers.astype('int64')
+    return numbers.astype(float)
+
+
+def file_digest(path):
+    """sha256 of a file's content, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(path, reader, kwargs):
+    """The key covers the file content and how it was parsed, so a different reader, different
+    reader options, another pandas version or, for readers that type their frame, another schema
+    (the reader's schema attribute, see sync.schema) never sees a stale frame."""
+    digest = hashlib.sha256(file_digest(path).encode())
+    digest.update(f'{CACHE_VERSION}|{pd.__version__}|{reader.__module__}.{reader.__name__}|{sorted(kwargs.items())!r}'.encode())
+    digest.update(repr(getattr(reader, 'schema', None)).encode())
+    return digest.hexdigest()
+
+
+def cached_read(path, reader, cache_dir=CACHE_DIR, **kwargs):
+    """Reads path with reader (e.g. pd.read_excel), going through the cache unless cache_dir is None."""
+    if cache_dir is None:
+        return reader(path, **kwargs)
+
+    entry = os.path.join(cache_dir, cache_key(path, reader, kwargs) + CACHE_SUFFIX)
+    if os.path.exists(entry):
+        try:
+            df = pd.read_pickle(entry)
+            os.utime(entry)  # Mark as recently used for eviction
+            return df
+        except Exception:
+            # Unreadable entry (interrupted write, incompatible pickle): parse again and replace it
+            pass
+
+    df = reader(path, **kwargs)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f'{entry}.{os.getpid()}.tmp'
+    df.to_pickle(tmp)
+    os.replace(tmp, entry)
+    return df
+
+
+def _entries(cache_dir):
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(CACHE_SUFFIX):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def evict_cache(cache_dir=CACHE_DIR, max_age_days=DEFAULT_MAX_AGE_DAYS, max_size_mb=DEFAULT_MAX_SIZE_MB):
+    """Removes entries unused for more than max_age_days, then the least recently used ones until
+    the cache fits in max_size_mb. Returns the number of removed entries."""
+    removed = 0
+    cutoff = time.time() - max_age_days * 24 * 3600
+    entries = []
+    for mtime, size, path in _entries(cache_dir):
+        if mtime < cutoff:
+            os.remove(path)
+            removed += 1
+        else:
+            entries.append((mtime, size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_size_mb * 1024 * 1024:
+            break
+        os.remove(path)
+        total -= size
+        removed += 1
+    return removed
+
+
+def clear_cache(cache_dir=CACHE_DIR):
+    """Removes every entry. Returns the number of removed entries."""
+    entries = _entries(cache_dir)
+    for _, _, path in entries:
+        os.remove(path)
+    return len(entries)
@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+
+from sync.contacts import FAMILY_COLUMN, combine_codes
+from sync.schema import KEY_SUFFIX
+from sync.sets import set_column, set_contains
+
+# attribute -> (OA column template, iSAMS column template)
+PARENT_ATTRIBUTES = {
+    'first_name': ('oa_Parent/Guardian {i} - First Name', 'isams_Primary Contact Forename {i}'),
+    'last_name': ('oa_Parent/Guardian {i} - Last Name', 'isams_Primary Contact Surname {i}'),
+    'email': ('oa_Parent/Guardian {i} - Email', 'isams_Primary Contact Email {i}'),
+    'relationship': ('oa_Parent/Guardian {i} - Relationship', 'isams_Relation Type {i}'),
+}
+OA_PARENT_SLOTS = 4
+
+
+def grade_year_flags(years, grade_years):
+    """True where the iSAMS year is one of the years of the row's OA grade.
+
+    grade_years is the set column of the years of every OA grade (see sync.sets). Its distinct
+    sets are exploded once into a (set code, year) table, and every row is looked up in it by the
+    pair of its set code and its iSAMS year.
+    """
+    grade_years = grade_years if isinstance(grade_years.dtype, pd.CategoricalDtype) else set_column(grade_years.to_numpy())
+    codes = grade_years.cat.codes.to_numpy()
+    table = pd.DataFrame({'code': np.arange(len(grade_years.cat.categories)), 'year': list(grade_years.cat.categories)}).explode('year').dropna()
+    pairs = pd.MultiIndex.from_arrays([table['code'].to_numpy(dtype=int), table['year'].to_numpy(dtype=object)])
+    found = pd.MultiIndex.from_arrays([codes, years.to_numpy(dtype=object)]).isin(pairs)
+    return (codes >= 0) & found
+
+
+def add_comparison_columns(df):
+    comparison_mappings = {
+        'is_same_id': ('isams_School Code','oa_Student ID'),
+        'is_same_first_name': ('isams_Forename','oa_First Name'),
+        'is_same_last_name': ('isams_Surname','oa_Last Name'),
+        'is_same_middle_name': ('isams_Middle Names','oa_Middle Name(s)'),
+        'is_same_email': ('isams_Pupil Email Address', 'oa_Email'),
+        'is_same_preferred_name': ('isams_Preferred Name','oa_Preferred Names'),
+        'is_same_grade_year': ('isams_Year (NC)','oa_Grade_mapped'),
+        'is_same_date_of_birth': ('isams_Date of Birth','oa_Birth Date')
+    }
+
+    for new_col, (col1, col2) in comparison_mappings.items():
+        if col1 in df.columns and col2 in df.columns:
+            if new_col == 'is_same_grade_year':
+                df[new_col] = grade_year_flags(df[col1], df[col2])
+            elif new_col == 'is_same_id':
+                df[new_col] = df[col1] == df[col2]
+            else:
+                # Text is compared on its lowercased key (see sync.schema), dates as they are
+                left = df.get(col1 + KEY_SUFFIX, df[col1])
+                right = df.get(col2 + KEY_SUFFIX, df[col2])
+                df[new_col] = np.where(
+                    left.isna() & right.isna(),
+                    True,  # Set to True if both are NaN
+                    left == right
+                )
+    # Checking nationalities
+    oa_nationality_cols = [f'oa_Nationality {i}_mapped' for i in range(1, 5)]
+    isams_nationality_cols = [f'isams_Nationality {i}_mapped' for i in range(1, 5)]
+
+    # Check each OA nationality against all iSAMS nationalities
+    for i, oa_nat_col in enumerate(oa_nationality_cols, start=1):
+        df[f'is_same_nationality_{i}_from_oa'] = set_contains(df['isams_Nationality_mapped'], df[oa_nat_col])
+
+    # Check each iSAMS nationality against all OA nationalities
+    for i, isams_nat_col in enumerate(isams_nationality_cols, start=1):
+        df[f'is_same_nationality_{i}_from_isams'] = set_contains(df['oa_Nationality_mapped'], df[isams_nat_col])
+    return df
+
+
+def parent_flag_columns(side, max_i):
+    """Returns the is_same_parent_* column names of one side, in the order they are added."""
+    slots = OA_PARENT_SLOTS if side == 'oa' else max_i
+    return [
+        f'is_same_parent_{attribute}_{i}_from_{side}'
+        for attribute in PARENT_ATTRIBUTES
+        for i in range(1, slots + 1)
+    ]
+
+
+def parent_contacts_long(df, side, slots):
+    """Reshapes one side's parent columns into a long (row, attribute, slot, value) table.
+
+    Rows are positional, so duplicated index labels (e.g. after a concat) are fine.
+    Empty cells are dropped and values are lowercased once.
+    """
+    template_idx = 0 if side == 'oa' else 1
+    frames = []
+    for attribute, templates in PARENT_ATTRIBUTES.items():
+        for i in range(1, slots + 1):
+            values = df[templates[template_idx].format(i=i)].to_numpy(dtype=object)
+            present = pd.notna(values)
+            frames.append(pd.DataFrame({
+                'row': np.flatnonzero(present),
+                'attribute': attribute,
+                'slot': i,
+                'value': values[present],
+            }))
+    long = pd.concat(frames, ignore_index=True)
+    long['value'] = long['value'].astype(str).str.lower()
+    return long
+
+
+def _membership_flags(source, other, n_rows, side, slots):
+    """Flags every (row, attribute, slot) of source whose value is also present for the same
+    row and attribute on the other side, and returns them as the wide is_same_parent_* frame."""
+    columns = parent_flag_columns(side, slots)
+    flags = np.zeros((n_rows, len(columns)), dtype=bool)
+    if len(source) and len(other):
+        lookup = pd.MultiIndex.from_frame(other[['row', 'attribute', 'value']])
+        found = pd.MultiIndex.from_frame(source[['row', 'attribute', 'value']]).isin(lookup)
+        attribute_pos = source['attribute'].map({a: k for k, a in enumerate(PARENT_ATTRIBUTES)}).to_numpy()
+        col_pos = attribute_pos * slots + source['slot'].to_numpy() - 1
+        flags[source['row'].to_numpy()[found], col_pos[found]] = True
+    return pd.DataFrame(flags, columns=columns)
+
+
+def family_pairs(df):
+    """Code of the pair of iSAMS and OA families (see sync.contacts) of every row, and the position
+    of the first row of each pair. Every row is its own pair when df has no family columns."""
+    isams_family, oa_family = f'isams_{FAMILY_COLUMN}', f'oa_{FAMILY_COLUMN}'
+    if isams_family not in df or oa_family not in df:
+        return np.arange(len(df)), np.arange(len(df))
+    codes = combine_codes(df[isams_family].to_numpy(dtype=np.int64), df[oa_family].to_numpy(dtype=np.int64))
+    return codes, np.unique(codes, return_index=True)[1]
+
+
+def add_parents_comparison_columns(df, max_i):
+    """Adds the is_same_parent_{attribute}_{i}_from_oa/_from_isams flags.
+
+    A parent attribute is the same when its lowercased value appears among the other side's
+    values of that attribute for the same student. Students of the same pair of families have the
+    same flags, so the parents are compared on the first student of every pair only and the flags
+    are fanned back out to the others.
+    """
+    pairs, first_rows = family_pairs(df)
+    columns = [
+        template.format(i=i)
+        for templates in PARENT_ATTRIBUTES.values()
+        for template, slots in zip(templates, (OA_PARENT_SLOTS, max_i))
+        for i in range(1, slots + 1)
+    ]
+    representatives = df[columns].iloc[first_rows]
+    oa_long = parent_contacts_long(representatives, 'oa', OA_PARENT_SLOTS)
+    isams_long = parent_contacts_long(representatives, 'isams', max_i)
+
+    oa_flags = _membership_flags(oa_long, isams_long, len(first_rows), 'oa', OA_PARENT_SLOTS)
+    isams_flags = _membership_flags(isams_long, oa_long, len(first_rows), 'isams', max_i)
+
+    # Keep the original column order: per attribute, the OA slots then the iSAMS slots
+    flags = pd.concat([oa_flags, isams_flags], axis=1)
+    ordered = []
+    for attribute in PARENT_ATTRIBUTES:
+        ordered.extend(c for c in oa_flags.columns if c.startswith(f'is_same_parent_{attribute}_'))
+        ordered.extend(c for c in isams_flags.columns if c.startswith(f'is_same_parent_{attribute}_'))
+    flags = flags[ordered].iloc[pairs]
+    flags.index = df.index
+    df = df.drop(columns=[c for c in ordered if c in df.columns])
+    return pd.concat([df, flags], axis=1)
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from sync.schema import comparison_key
+
+# Contact index of one side's parents, built by preprocess_isams and preprocess_oa. A contact is a
+# parent's lowercased (first name, last name, email), the values the parent comparison sees, and
+# every parent slot of a student gets the code of its contact. Students whose contacts and
+# relationships are the same slot by slot, usually siblings, share a FAMILY_COLUMN code. The parents
+# of a pair of iSAMS and OA families only have to be compared once (see
+# sync.comparison.add_parents_comparison_columns). A family is a comparison signature rather than a
+# household: students who only share some contacts, such as half-siblings, or whose contacts sit in
+# other slots or with other relationships, get different codes, since their flags can differ.
+FAMILY_COLUMN = 'Family'
+# side -> (first name, last name, email, relationship) column templates, without the side's prefix
+CONTACT_TEMPLATES = {
+    'oa': ('Parent/Guardian {i} - First Name', 'Parent/Guardian {i} - Last Name', 'Parent/Guardian {i} - Email', 'Parent/Guardian {i} - Relationship'),
+    'isams': ('Primary Contact Forename {i}', 'Primary Contact Surname {i}', 'Primary Contact Email {i}', 'Relation Type {i}'),
+}
+
+
+def _key_codes(values):
+    """Code of the lowercased value of every row, -1 where it is missing."""
+    return pd.factorize(comparison_key(pd.Series(values, dtype=object)))[0]
+
+
+def combine_codes(*codes):
+    """One code per distinct tuple of the codes of a row (codes are >= -1), numbered from 0."""
+    combined = np.zeros(len(codes[0]), dtype=np.int64)
+    for values in codes:
+        values = np.asarray(values, dtype=np.int64)
+        combined = pd.factorize(combined * (int(values.max(initial=-1)) + 2) + values + 1)[0]
+    return combined
+
+
+def contact_codes(first_names, last_names, emails):
+    """Code of the contact of every row, -1 where the first name, last name and email are all
+    missing."""
+    parts = [_key_codes(values) for values in (first_names, last_names, emails)]
+    codes = combine_codes(*parts)
+    empty = (parts[0] < 0) & (parts[1] < 0) & (parts[2] < 0)
+    return np.where(empty, -1, codes)
+
+
+def add_family_index(df, side, slots):
+    """Adds FAMILY_COLUMN to one side's preprocessed students, from the contact and the
+    relationship in each of their parent slots. Slots the side lacks count as empty.
+
+    Only students whose slots are all identical share a code; sharing one contact is not enough
+    (see FAMILY_COLUMN)."""
+    codes = []
+    for i in range(1, slots + 1):
+        first, last, email, relationship = [
+            df[template.format(i=i)].to_numpy(dtype=object) if template.format(i=i) in df else np.full(len(df), np.nan, dtype=object)
+            for template in CONTACT_TEMPLATES[side]
+        ]
+        codes.extend([contact_codes(first, last, email), _key_codes(relationship)])
+    df[FAMILY_COLUMN] = combine_codes(*codes) if codes else np.zeros(len(df), dtype=np.int64)
+    return df
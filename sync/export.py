@@ -0,0 +1,156 @@
+import datetime
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from sync.notes import NOTE_COMPARISONS, PARENT_NOTES
+from sync.profiling import shape, stage
+
+CONFLICT_FONT = openpyxl.styles.Font(color='F40404', bold=True)
+BLUE_FILL = openpyxl.styles.PatternFill(start_color='07AAE2', end_color='07AAE2', fill_type='solid')
+ORANGE_FILL = openpyxl.styles.PatternFill(start_color='FFC000', end_color='FFC000', fill_type='solid')
+
+# Same header style DataFrame.to_excel uses
+HEADER_FONT = openpyxl.styles.Font(bold=True)
+HEADER_BORDER = openpyxl.styles.Border(
+    left=openpyxl.styles.Side(style='thin'), right=openpyxl.styles.Side(style='thin'),
+    top=openpyxl.styles.Side(style='thin'), bottom=openpyxl.styles.Side(style='thin'),
+)
+HEADER_ALIGNMENT = openpyxl.styles.Alignment(horizontal='center', vertical='top')
+
+EXPORT_CHUNK_SIZE = 10000
+# Dates are written as text in this format
+DATE_FORMAT = '%d %B, %Y'
+
+
+def highlight_targets(max_i):
+    """Returns (flag column, highlighted column, missing flag counts as conflict) triples."""
+    targets = []
+    for comparison, (col1, col2) in NOTE_COMPARISONS.items():
+        targets.append((comparison, col1, True))
+        targets.append((comparison, col2, True))
+    for i in range(1, 5):
+        targets.append((f'is_same_nationality_{i}_from_oa', f'OA Nationality {i}', True))
+        targets.append((f'is_same_nationality_{i}_from_isams', f'iSAMS Nationality {i}', True))
+    for flag, oa_suffix, isams_prefix, _ in PARENT_NOTES:
+        for i in range(1, 5):
+            targets.append((f'is_same_{flag}_{i}_from_oa', f'OA Parent/Guardian {i} - {oa_suffix}', False))
+        for i in range(1, max_i + 1):
+            targets.append((f'is_same_{flag}_{i}_from_isams', f'iSAMS {isams_prefix} {i}', False))
+    return targets
+
+
+def conflict_cells(df, max_i):
+    """Boolean (rows x columns) matrix of the cells shown in red.
+
+    Rows of students that exist on one side only are never highlighted.
+    """
+    cells = np.zeros(df.shape, dtype=bool)
+    if 'Note' in df:
+        one_sided = df['Note'].str.contains('not in', regex=False, na=False).to_numpy()
+    else:
+        one_sided = np.zeros(len(df), dtype=bool)
+    for flag, target, missing_is_conflict in highlight_targets(max_i):
+        if flag not in df or target not in df:
+            continue
+        conflict = df[flag] == False  # noqa: E712
+        if missing_is_conflict:
+            conflict |= df[flag].isna()
+        cells[:, df.columns.get_loc(target)] |= conflict.to_numpy(dtype=bool, na_value=False) & ~one_sided
+    return cells
+
+
+def one_sided_rows(df):
+    """Returns the 'Student not in OA' and 'Student not in iSAMS' row masks and the position of the
+    first OA column ('OA Student Status'), where the two sides of the sheet are split."""
+    split = df.columns.get_loc('OA Student ID') - 1
+    not_in_oa = df['Note'].str.contains('Student not in OA', regex=False, na=False).to_numpy()
+    not_in_isams = df['Note'].str.contains('Student not in iSAMS', regex=False, na=False).to_numpy() & ~not_in_oa
+    return not_in_oa, not_in_isams, split
+
+
+def header_fills(orange=(), blue=()):
+    """Maps 1-based column positions to the header fill of their side (iSAMS orange, OA blue)."""
+    fills = {col: ORANGE_FILL for col in orange}
+    fills.update({col: BLUE_FILL for col in blue})
+    return fills
+
+
+def excel_value(value):
+    """Converts a frame value the way DataFrame.to_excel does: missing values are left empty and
+    values openpyxl cannot store (e.g. the *_mapped lists) are written as text."""
+    if isinstance(value, (list, tuple, set, dict)):
+        return str(value)
+    if pd.isna(value):
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value)
+    if isinstance(value, (str, datetime.date, datetime.time, datetime.timedelta)):
+        return value
+    return str(value)
+
+
+def _styled_cell(worksheet, value, font=None, fill=None, border=None, alignment=None):
+    cell = openpyxl.cell.WriteOnlyCell(worksheet, value=value)
+    if font is not None:
+        cell.font = font
+    if fill is not None:
+        cell.fill = fill
+    if border is not None:
+        cell.border = border
+    if alignment is not None:
+        cell.alignment = alignment
+    return cell
+
+
+def write_sheet(workbook, df, sheet_name, max_i, fills=None, hidden_columns=(), fill_rows=False, hide_empty_notes=False, profile=None):
+    """Streams df into a new sheet of a write-only workbook.
+
+    Everything about the layout (hidden columns and rows, header fills, conflict fonts, one-sided
+    row fills) is decided before a row is emitted, and rows are produced EXPORT_CHUNK_SIZE at a
+    time, so memory does not grow with the number of students.
+    """
+    with stage(profile, f'write_sheet: {sheet_name}') as record:
+        record.update(shape(df))
+        return _write_sheet(workbook, df, sheet_name, max_i, fills, hidden_columns, fill_rows, hide_empty_notes)
+
+
+def _write_sheet(workbook, df, sheet_name, max_i, fills, hidden_columns, fill_rows, hide_empty_notes):
+    worksheet = workbook.create_sheet(sheet_name)
+    for col in hidden_columns:
+        worksheet.column_dimensions[openpyxl.utils.get_column_letter(col)].hidden = True
+
+    fills = fills or {}
+    worksheet.append([
+        _styled_cell(worksheet, column, font=HEADER_FONT, fill=fills.get(col), border=HEADER_BORDER, alignment=HEADER_ALIGNMENT)
+        for col, column in enumerate(df.columns, start=1)
+    ])
+
+    date_columns = [column for column, dtype in df.dtypes.items() if pd.api.types.is_datetime64_any_dtype(dtype)]
+    for start in range(0, len(df), EXPORT_CHUNK_SIZE):
+        part = df.iloc[start:start + EXPORT_CHUNK_SIZE]
+        if date_columns:
+            part = part.assign(**{column: part[column].dt.strftime(DATE_FORMAT) for column in date_columns})
+        cells = conflict_cells(part, max_i)
+        if fill_rows:
+            not_in_oa, not_in_isams, split = one_sided_rows(part)
+        if hide_empty_notes:
+            hidden = (part['Note'].isna() | part['Note'].eq('')).to_numpy()
+
+        for offset, values in enumerate(part.itertuples(index=False, name=None)):
+            row = [excel_value(value) for value in values]
+            for col in np.flatnonzero(cells[offset]).tolist():
+                row[col] = _styled_cell(worksheet, row[col], font=CONFLICT_FONT)
+            if fill_rows and not_in_oa[offset]:
+                row[split:] = [_styled_cell(worksheet, value, fill=BLUE_FILL) for value in row[split:]]
+            elif fill_rows and not_in_isams[offset]:
+                row[:split] = [_styled_cell(worksheet, value, fill=ORANGE_FILL) for value in row[:split]]
+            if hide_empty_notes and hidden[offset]:
+                worksheet.row_dimensions[start + offset + 2].hidden = True
+            worksheet.append(row)
+    return worksheet
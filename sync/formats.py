@@ -0,0 +1,67 @@
+import os
+import re
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:  # Optional: only needed for Parquet
+    pyarrow = None
+
+MACHINE_FORMATS = ('parquet', 'csv', 'jsonl')
+FORMATS = ('xlsx',) + MACHINE_FORMATS
+DEFAULT_FORMATS = ('xlsx',)
+
+
+def check_formats(formats):
+    """Raises a ValueError for an unknown format, or for Parquet without pyarrow installed."""
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}.")
+    if 'parquet' in formats and pyarrow is None:
+        raise ValueError('Parquet output needs pyarrow: pip install pyarrow')
+
+
+def table_name(sheet_name):
+    """File name of a sheet: 'All Comparison' -> 'all_comparison'."""
+    return re.sub(r'\W+', '_', sheet_name).strip('_').lower()
+
+
+def _arrow_frame(df):
+    """Parquet needs one type per column. Object columns mixing types (e.g. numeric and text codes
+    in the same ID column) are written as text; lists, booleans and dates keep their type."""
+    df = df.copy(deep=False)
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        kind = pd.api.types.infer_dtype(df[column], skipna=True)
+        if kind.startswith('mixed') and not df[column].map(lambda v: isinstance(v, list) or v is None or v != v).all():
+            df[column] = df[column].map(lambda v: v if v is None or v != v else str(v)).astype(object)
+    return df
+
+
+def write_table(df, path, fmt):
+    if fmt == 'parquet':
+        _arrow_frame(df).to_parquet(path, index=False)
+    elif fmt == 'csv':
+        df.to_csv(path, index=False, date_format='%Y-%m-%d')
+    elif fmt == 'jsonl':
+        df.to_json(path, orient='records', lines=True, date_format='iso', date_unit='s', default_handler=str)
+    else:
+        raise ValueError(f'Unknown machine format {fmt!r}')
+
+
+def write_tables(directory, tables, formats):
+    """Writes every table (sheet name -> frame) once per machine format into directory, as
+    <table>.<format>. Nothing is styled or hidden: every column is written with its dtype. Returns
+    the written paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for fmt in formats:
+        if fmt not in MACHINE_FORMATS:
+            continue
+        for sheet_name, df in tables.items():
+            path = os.path.join(directory, f'{table_name(sheet_name)}.{fmt}')
+            write_table(df, path, fmt)
+            paths.append(path)
+    return paths
@@ -1,799 +1,269 @@
-import pandas as pd
-from collections import defaultdict
-import re
-import openpyxl
-from datetime import datetime as dt
+import contextlib
+import json
+import os
 import sys
-import numpy as np
+from datetime import datetime as dt
 import click
-
-@click.command()
-@click.argument("school", required=True)
-@click.option("--name", "-n", default='Cologne International School', type=str, required=False, help="School Name (please use ' ' to enclose it.)")
-
-def isams_oa_sync(school: str, name:str) -> None:
-  print('Starting iSAMS-OA Sync. . .')
-  def load_data(school_name):
-      oa_file = f'OA ({school_name}).xlsx'
-      isams_file = f'iSAMS ({school_name}).xlsx'
-      nationality_file = f'CrossReferenceMapping - Nationality - Country.csv'
-      grade_year_file = f'grade_year_mapping ({school_name}).csv'
-      
-      oa_df = pd.read_excel(oa_file)
-      isams_df = pd.read_excel(isams_file)
-      nationality_country_mapping_df = pd.read_csv(nationality_file)
-      grade_year_mapping_dict = pd.read_csv(grade_year_file).groupby('Grade')['Year (NC)'].apply(list).to_dict()
-      
-      return oa_df, isams_df, nationality_country_mapping_df, grade_year_mapping_dict
-      
-  school_name = name
-
-  oa_df, isams_df, nationality_country_mapping_df, grade_year_mapping_dict = load_data(school_name)
-  mapping_dict = nationality_country_mapping_df.set_index('Title')['ISO'].to_dict()
-  grade_year_mapping_dict = {k: v[0] if len(v) == 1 else v for k, v in grade_year_mapping_dict.items()}
-  print('Loading all files. . .')
-  
-  def preprocess_isams(isams, nationality_mapping):
-      isams.replace(' ', np.nan, inplace=True)
-      isams['Id'] = isams['Forename'] + isams['Surname']    
-      def flatten_group(group):
-          flattened = {}
-          max_i = 0  # Initialize max_i for this group
-          for column in ['Primary Contact Email', 'Primary Contact Forename', 'Primary Contact Surname', 'Primary Contact Title', 'Relation Type']:
-              unique_values = group[column]
-              for i, value in enumerate(unique_values, start=1):
-                  flattened[f'{column} {i}'] = value
-                  max_i = max(max_i, i)  # Update max_i if this i is larger
-          return pd.Series(flattened), max_i
-      flattened_results = isams.groupby('Id').apply(flatten_group)
-      flattened_df = flattened_results.apply(lambda x: x[0])
-      max_i_per_id = flattened_results.apply(lambda x: x[1])
-      # Find the overall maximum 'i'
-      max_i = max_i_per_id.max()
-      merged_df = isams[['Date of Birth', 'Forename', 'Gender', 'Middle Names', 'Preferred Name',
-        'Surname', 'School Code', 'Year (NC)', 'Address Type', 'Country',
-        'Language', 'Nationality', 'Id']].merge(flattened_df, on='Id', how='inner')
-      merged_df_copy = merged_df.drop_duplicates(subset='Id', keep='first').reset_index(drop=True)
-      merged_df_copy['Date of Birth'] = pd.to_datetime(merged_df_copy['Date of Birth'], format='%B %d,%Y')
-      if not 'Middle Names' in merged_df_copy:
-          merged_df_copy['Middle Names'] = np.nan
-      def generate_column_names(base_name, max_i):
-          """Generates column names up to the maximum index 'i'."""
-          return [f"{base_name} {i}" for i in range(1, max_i + 1)]
-
-      forename_columns = generate_column_names('Primary Contact Forename', max_i)
-      surname_columns = generate_column_names('Primary Contact Surname', max_i)
-      email_columns = generate_column_names('Primary Contact Email', max_i)
-      relation_type_columns = generate_column_names('Relation Type', max_i)
-      
-      merged_df_copy['Parent_first_name_mapped'] = merged_df_copy[forename_columns].apply(
-          lambda row: list(set(x.lower() for x in row if pd.notna(x))), axis=1
-      )
-      merged_df_copy['Parent_last_name_mapped'] = merged_df_copy[surname_columns].apply(
-          lambda row: list(set(x.lower() for x in row if pd.notna(x))), axis=1
-      )
-      merged_df_copy['Parent_email_mapped'] = merged_df_copy[email_columns].apply(
-          lambda row: list(set(x.lower() for x in row if pd.notna(x))), axis=1
-      )
-      merged_df_copy['Parent_relation_mapped'] = merged_df_copy[relation_type_columns].apply(
-          lambda row: list(set(x.lower() for x in row if pd.notna(x))), axis=1
-      )
-
-      nationality_columns = merged_df_copy['Nationality'].str.split(r',\s*', expand=True)
-      nationality_columns = nationality_columns.rename(columns={i: f'Nationality {i+1}' for i in range(nationality_columns.shape[1])})
-
-      for col in [f'Nationality {i}' for i in range(1, 5)]:
-          if col not in nationality_columns.columns:
-              nationality_columns[col] = np.nan
-          nationality_columns[f'{col}_mapped'] = nationality_columns[col].apply(lambda x: nationality_mapping.get(x) if pd.notna(x) else np.nan)
-      merged_df_copy = merged_df_copy.join(nationality_columns)
-      merged_df_copy['Nationality_mapped'] = nationality_columns[['Nationality 1_mapped', 'Nationality 2_mapped', 'Nationality 3_mapped', 'Nationality 4_mapped']].apply(
-          lambda row: list(set(x for x in row if pd.notna(x))), axis=1
-      )
-      if not 'Pupil Email Address' in merged_df_copy:
-          merged_df_copy['Pupil Email Address'] = np.nan
-      return merged_df_copy, max_i
-
-  def preprocess_oa(oa,nationality_mapping, grade_mapping):
-      oa['Birth Date'] = pd.to_datetime(oa['Birth Date'], dayfirst=True, format='%d/%m/%y')
-      oa['Grade_mapped'] = oa['Grade'].apply(lambda x: [grade_mapping.get(x)] if not isinstance(grade_mapping.get(x), list) else grade_mapping.get(x))
-      oa['Parent_first_name_mapped'] = oa[['Parent/Guardian 1 - First Name', 'Parent/Guardian 2 - First Name', 'Parent/Guardian 3 - First Name', 'Parent/Guardian 4 - First Name']].apply(
-          lambda row: list(set(x.lower() for x in row if pd.notna(x))), axis=1
-      )
-      oa['Parent_last_name_mapped'] = oa[['Parent/Guardian 1 - Last Name', 'Parent/Guardian 2 - Last Name', 'Parent/Guardian 3 - Last Name', 'Parent/Guardian 4 - Last Name']].apply(
-          lambda row: list(set(x.lower() for x in row if pd.notna(x))), axis=1
-      )
-      oa['Parent_email_mapped'] = oa[['Parent/Guardian 1 - Email', 'Parent/Guardian 2 - Email', 'Parent/Guardian 3 - Email', 'Parent/Guardian 4 - Email']].apply(
-          lambda row: list(set(x.lower() for x in row if pd.notna(x))), axis=1
-      )
-      oa['Parent_relationship_mapped'] = oa[['Parent/Guardian 1 - Relationship', 'Parent/Guardian 2 - Relationship', 'Parent/Guardian 3 - Relationship', 'Parent/Guardian 4 - Relationship']].apply(
-          lambda row: list(set(x.lower() for x in row if pd.notna(x))), axis=1
-      )
-      oa['Nationality_raw_mapped'] = oa[['Nationality', 'Second Nationality', 'Third Nationality']].apply(
-          lambda row: list(x for x in row if pd.notna(x)), axis=1
-      )
-      nationality_columns = oa['Nationality_raw_mapped'].apply(pd.Series)
-      nationality_columns = nationality_columns.rename(columns={0: 'Nationality 1', 1: 'Nationality 2', 2: 'Nationality 3', 3: 'Nationality 4'})
-      for col in ['Nationality 1', 'Nationality 2', 'Nationality 3', 'Nationality 4']:
-          if col not in nationality_columns.columns:
-              nationality_columns[col] = np.nan
-          nationality_columns[f'{col}_mapped'] = nationality_columns[col].apply(lambda x: nationality_mapping.get(x) if pd.notna(x) else np.nan)
-      oa = oa.join(nationality_columns)
-      oa['Nationality_mapped'] = nationality_columns[['Nationality 1_mapped', 'Nationality 2_mapped', 'Nationality 3_mapped', 'Nationality 4_mapped']].apply(
-          lambda row: list(set(x for x in row if pd.notna(x))), axis=1
-      )
-      if not 'Preferred Name' in oa:
-          oa['Preferred Names'] = np.nan
-      return oa
-
-  isams_df_copy, max_i = preprocess_isams(isams_df.copy(), mapping_dict)
-  oa_df_copy = preprocess_oa(oa_df.copy(),mapping_dict, grade_year_mapping_dict)
-  isams_df_copy = isams_df_copy.add_prefix('isams_')
-  oa_df_copy = oa_df_copy.add_prefix('oa_')
-  oa_df_copy_enrolled = oa_df_copy[oa_df_copy['oa_Student Status'] == 'Enrolled'].reset_index(drop=True)
-  oa_df_copy_others = oa_df_copy.drop(oa_df_copy_enrolled.index).reset_index(drop=True)
-  print('Preprocessing files. . .')
-  print('Starting merge sequence. . .')
-  
-  #first merge (isams with oa_enrolled)
-  merged_df_1st = isams_df_copy[isams_df_copy['isams_School Code'].notna()].merge(oa_df_copy_enrolled[oa_df_copy_enrolled['oa_Student ID'].notna()],left_on='isams_School Code', right_on='oa_Student ID', how='inner')
-  matched_id_isams = merged_df_1st['isams_School Code'].unique()
-  matched_id_oa = merged_df_1st['oa_Student ID'].unique()
-  isams_for_2nd_round = isams_df_copy[(isams_df_copy['isams_School Code'].isna()) | ~(isams_df_copy['isams_School Code'].isin(matched_id_isams))].reset_index(drop=True)
-  leftover_oa = oa_df_copy_enrolled[(oa_df_copy_enrolled['oa_Student ID'].isna() | ~(oa_df_copy_enrolled['oa_Student ID'].isin(matched_id_oa)))].reset_index(drop=True)
-
-  merged_df_2nd = isams_for_2nd_round[isams_for_2nd_round['isams_School Code'].notna()].merge(oa_df_copy_others[oa_df_copy_others['oa_Student ID'].notna()],left_on='isams_School Code', right_on='oa_Student ID', how='inner')
-  matched_id_isams_2nd = merged_df_2nd['isams_School Code'].unique()
-  leftover_isams = isams_for_2nd_round[(isams_for_2nd_round['isams_School Code'].isna()) | ~(isams_for_2nd_round['isams_School Code'].isin(matched_id_isams_2nd))].reset_index(drop=True)
-
-  merged_df_1st['Note'] = ''
-  merged_df_2nd['Note'] = 'Enrolled in iSAMS; Not Enrolled in OA'
-  leftover_oa['Note'] = 'Student not in iSAMS'
-  leftover_isams['Note'] = 'Student not in OA'
-  merged_df = pd.concat([merged_df_1st, merged_df_2nd])
-  print('Merge sequence completed.')
-  
-  def add_comparison_columns(df):
-      comparison_mappings = {
-          'is_same_id': ('isams_School Code','oa_Student ID'),
-          'is_same_first_name': ('isams_Forename','oa_First Name'),
-          'is_same_last_name': ('isams_Surname','oa_Last Name'),
-          'is_same_middle_name': ('isams_Middle Names','oa_Middle Name(s)'),
-          'is_same_email': ('isams_Pupil Email Address', 'oa_Email'),
-          'is_same_preferred_name': ('isams_Preferred Name','oa_Preferred Names'),
-          'is_same_grade_year': ('isams_Year (NC)','oa_Grade_mapped'),
-          'is_same_date_of_birth': ('isams_Date of Birth','oa_Birth Date')
-      }
-
-      for new_col, (col1, col2) in comparison_mappings.items():
-          if col1 in df.columns and col2 in df.columns:
-              if new_col == 'is_same_grade_year':
-                  # Special handling for grade year comparison
-                  df[new_col] = df.apply(lambda row: row[col1] in row[col2], axis=1)
-              elif new_col == 'is_same_id':
-                  df[new_col] = df[col1] == df[col2]
-              else:
-                  # Standard comparison for other columns
-                  df[new_col] = np.where(
-                      df[col1].isna() & df[col2].isna(),
-                      True,  # Set to True if both are NaN
-                      df[col1].astype(str).str.lower() == df[col2].astype(str).str.lower()
-                  )
-      # Checking nationalities
-      oa_nationality_cols = [f'oa_Nationality {i}_mapped' for i in range(1, 5)]
-      isams_nationality_cols = [f'isams_Nationality {i}_mapped' for i in range(1, 5)]
-
-      # Check each OA nationality against all iSAMS nationalities
-      for i, oa_nat_col in enumerate(oa_nationality_cols, start=1):
-          df[f'is_same_nationality_{i}_from_oa'] = df.apply(
-              lambda row: row[oa_nat_col] in row['isams_Nationality_mapped'] if pd.notna(row[oa_nat_col]) else False, 
-              axis=1)
-
-      # Check each iSAMS nationality against all OA nationalities
-      for i, isams_nat_col in enumerate(isams_nationality_cols, start=1):
-          df[f'is_same_nationality_{i}_from_isams'] = df.apply(
-              lambda row: row[isams_nat_col] in row['oa_Nationality_mapped'] if pd.notna(row[isams_nat_col]) else False, 
-              axis=1)
-      return df
-
-  def add_parents_comparison_columns(df,max_i):
-      # Checking Parent First Name
-      oa_parent_first_name_cols = [f'oa_Parent/Guardian {i} - First Name' for i in range(1, 5)]
-      isams_parent_first_name_cols = [f'isams_Primary Contact Forename {i}' for i in range(1, max_i + 1)]
-
-      for i, oa_pfn_col in enumerate(oa_parent_first_name_cols, start=1):
-          df[f'is_same_parent_first_name_{i}_from_oa'] = df.apply(
-              lambda row: row[oa_pfn_col].lower() in row['isams_Parent_first_name_mapped']
-                  if pd.notna(row[oa_pfn_col])
-                      else False, 
-              axis=1)
-
-      for i, isams_pfn_col in enumerate(isams_parent_first_name_cols, start=1):
-          df[f'is_same_parent_first_name_{i}_from_isams'] = df.apply(
-              lambda row: row[isams_pfn_col].lower() in row['oa_Parent_first_name_mapped'] 
-                  if pd.notna(row[isams_pfn_col])
-                  else False, 
-              axis=1)
-      
-      oa_parent_last_name_cols = [f'oa_Parent/Guardian {i} - Last Name' for i in range(1, 5)]
-      isams_parent_last_name_cols = [f'isams_Primary Contact Surname {i}' for i in range(1, max_i + 1)]
-
-      for i, oa_pln_col in enumerate(oa_parent_last_name_cols, start=1):
-          df[f'is_same_parent_last_name_{i}_from_oa'] = df.apply(
-              lambda row: row[oa_pln_col].lower() in row['isams_Parent_last_name_mapped']
-                  if pd.notna(row[oa_pln_col])
-                      else False, 
-              axis=1)
-
-      for i, isams_pln_col in enumerate(isams_parent_last_name_cols, start=1):
-          df[f'is_same_parent_last_name_{i}_from_isams'] = df.apply(
-              lambda row: row[isams_pln_col].lower() in row['oa_Parent_last_name_mapped'] 
-                  if pd.notna(row[isams_pln_col])
-                  else False, 
-              axis=1)
-          
-      oa_parent_email_cols = [f'oa_Parent/Guardian {i} - Email' for i in range(1, 5)]
-      isams_parent_email_cols = [f'isams_Primary Contact Email {i}' for i in range(1, max_i + 1)]
-
-      for i, oa_pe_col in enumerate(oa_parent_email_cols, start=1):
-          df[f'is_same_parent_email_{i}_from_oa'] = df.apply(
-              lambda row: row[oa_pe_col].lower() in row['isams_Parent_email_mapped']
-                  if pd.notna(row[oa_pe_col])
-                      else False, 
-              axis=1)
-
-      for i, isams_pe_col in enumerate(isams_parent_email_cols, start=1):
-          df[f'is_same_parent_email_{i}_from_isams'] = df.apply(
-              lambda row: row[isams_pe_col].lower() in row['oa_Parent_email_mapped'] 
-                  if pd.notna(row[isams_pe_col])
-                  else False, 
-              axis=1)
-          
-      oa_parent_relationship_cols = [f'oa_Parent/Guardian {i} - Relationship' for i in range(1, 5)]
-      isams_parent_relationship_cols = [f'isams_Relation Type {i}' for i in range(1, max_i + 1)]
-
-      for i, oa_pr_col in enumerate(oa_parent_relationship_cols, start=1):
-          df[f'is_same_parent_relationship_{i}_from_oa'] = df.apply(
-              lambda row: row[oa_pr_col].lower() in row['isams_Parent_relation_mapped']
-                  if pd.notna(row[oa_pr_col])
-                      else False, 
-              axis=1)
-
-      for i, isams_pr_col in enumerate(isams_parent_relationship_cols, start=1):
-          df[f'is_same_parent_relationship_{i}_from_isams'] = df.apply(
-              lambda row: row[isams_pr_col].lower() in row['oa_Parent_relationship_mapped'] 
-                  if pd.notna(row[isams_pr_col])
-                  else False, 
-              axis=1)
-      return df
-  print('Comparing. . .')
-  
-  #Analyse merged
-  merged_df_copy = add_comparison_columns(merged_df.copy())
-  merged_df_copy = add_parents_comparison_columns(merged_df_copy, max_i)
-  export_df = pd.concat([merged_df_copy,leftover_isams,leftover_oa], axis=0, ignore_index=True)
-
-  new_order = [
-      'Note',
-      'isams_School Code', 'isams_Pupil Email Address', 'isams_Date of Birth',
-      'isams_Forename', 'isams_Middle Names', 'isams_Surname', 'isams_Preferred Name',
-      'isams_Year (NC)', 'isams_Gender',
-      'isams_Nationality 1', 'isams_Nationality 2',
-      'isams_Nationality 3', 'isams_Nationality 4',
+from sync.batch import discover_schools, run_batch
+from sync.benchmark import DEFAULT_TOLERANCE, STAGES, compare_to_baseline, load_report, run_benchmark, save_report
+from sync.cache import CACHE_DIR, DEFAULT_MAX_AGE_DAYS, DEFAULT_MAX_SIZE_MB, evict_cache
+from sync.cache import clear_cache as clear_ingest_cache
+from sync.formats import DEFAULT_FORMATS, FORMATS, check_formats
+from sync.incremental import SNAPSHOT_DIR
+from sync.matching import DEFAULT_MATCH_KEYS, MATCH_KEYS
+from sync.openapply import DEFAULT_CONNECTIONS
+from sync.pipeline import NATIONALITY_FILE, sync_school
+from sync.service import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_QUEUE_SIZE, serve
+from sync.synthetic import generate_school
+
+def cache_options(command):
+  """Ingest cache options shared by every command."""
+  options = [
+      click.option("--no-cache", is_flag=True, default=False, help="Parse the input files without reading or writing the ingest cache."),
+      click.option("--clear-cache", is_flag=True, default=False, help="Remove every ingest cache entry before running."),
+      click.option("--cache-dir", default=CACHE_DIR, type=click.Path(file_okay=False), show_default=True, help="Directory of the ingest cache."),
+      click.option("--cache-max-age", default=DEFAULT_MAX_AGE_DAYS, type=int, show_default=True, help="Evict cache entries unused for this many days."),
+      click.option("--cache-max-size", default=DEFAULT_MAX_SIZE_MB, type=int, show_default=True, help="Evict least recently used cache entries above this size (MB)."),
   ]
-
-  # Dynamically add 'Primary Contact' entries based on max_i
-  for i in range(1, max_i + 1):
-      new_order.extend([
-          f'isams_Primary Contact Forename {i}', f'isams_Primary Contact Surname {i}',
-          f'isams_Primary Contact Email {i}', f'isams_Relation Type {i}',
-      ])
-  new_order.extend([
-      'oa_Student Status', 'oa_Student ID', 'oa_Email', 'oa_Birth Date',
-      'oa_First Name', 'oa_Middle Name(s)', 'oa_Last Name', 'oa_Preferred Names',
-      'oa_Grade', 'oa_Gender',
-
-      'oa_Nationality 1', 'oa_Nationality 2',
-      'oa_Nationality 3', 'oa_Nationality 4',
-
-      'oa_Parent/Guardian 1 - First Name', 'oa_Parent/Guardian 1 - Last Name',
-      'oa_Parent/Guardian 1 - Email', 'oa_Parent/Guardian 1 - Relationship',
-
-      'oa_Parent/Guardian 2 - First Name', 'oa_Parent/Guardian 2 - Last Name',
-      'oa_Parent/Guardian 2 - Email', 'oa_Parent/Guardian 2 - Relationship',
-
-      'oa_Parent/Guardian 3 - First Name', 'oa_Parent/Guardian 3 - Last Name',
-      'oa_Parent/Guardian 3 - Email', 'oa_Parent/Guardian 3 - Relationship',
-
-      'oa_Parent/Guardian 4 - First Name', 'oa_Parent/Guardian 4 - Last Name',
-      'oa_Parent/Guardian 4 - Email', 'oa_Parent/Guardian 4 - Relationship',
-
-      'isams_Address Type', 'isams_Country', 'isams_Language',
-      'isams_Nationality', 'isams_Id', 
-
-      'isams_Parent_first_name_mapped', 'isams_Parent_last_name_mapped',
-      'isams_Parent_email_mapped', 'isams_Parent_relation_mapped',
-      'isams_Nationality 1_mapped', 'isams_Nationality 2_mapped',
-      'isams_Nationality 3_mapped', 'isams_Nationality 4_mapped',
-      'isams_Nationality_mapped',
-
-      'oa_OpenApply ID', 'oa_OpenApply URL',
-      'oa_Nationality', 'oa_Second Nationality', 'oa_Third Nationality', 
-      'oa_Parent/Guardian 1 - Parent OpenApply ID', 'oa_Parent/Guardian 2 - Parent OpenApply ID',
-      'oa_Parent/Guardian 3 - Parent OpenApply ID', 'oa_Parent/Guardian 4 - Parent OpenApply ID',
-      'oa_Grade_mapped', 'oa_Parent_first_name_mapped', 'oa_Parent_last_name_mapped',
-      'oa_Parent_email_mapped', 'oa_Parent_relationship_mapped', 'oa_Nationality 1_mapped',
-      'oa_Nationality 2_mapped', 'oa_Nationality 3_mapped',
-      'oa_Nationality 4_mapped', 'oa_Nationality_mapped', 
-      'is_same_id', 'is_same_first_name', 'is_same_last_name', 'is_same_preferred_name',
-      'is_same_middle_name', 'is_same_grade_year', 'is_same_date_of_birth', 'is_same_email',
-      'is_same_nationality_1_from_oa', 'is_same_nationality_2_from_oa',
-      'is_same_nationality_3_from_oa', 'is_same_nationality_4_from_oa',
-      'is_same_nationality_1_from_isams', 'is_same_nationality_2_from_isams',
-      'is_same_nationality_3_from_isams', 'is_same_nationality_4_from_isams',
-      'is_same_parent_first_name_1_from_oa', 'is_same_parent_first_name_2_from_oa',
-      'is_same_parent_first_name_3_from_oa', 'is_same_parent_first_name_4_from_oa'
-  ])
-
-  for i in range(1, max_i + 1):
-      new_order.extend([
-          f'is_same_parent_first_name_{i}_from_isams',
-      ])
-
-  new_order.extend([
-      'is_same_parent_last_name_1_from_oa', 'is_same_parent_last_name_2_from_oa',
-      'is_same_parent_last_name_3_from_oa', 'is_same_parent_last_name_4_from_oa',
-  ])
-
-  for i in range(1, max_i + 1):
-      new_order.extend([
-          f'is_same_parent_last_name_{i}_from_isams',
-      ])
-
-  new_order.extend([
-      'is_same_parent_email_1_from_oa', 'is_same_parent_email_2_from_oa',
-      'is_same_parent_email_3_from_oa', 'is_same_parent_email_4_from_oa',
-  ])
-
-  for i in range(1, max_i + 1):
-      new_order.extend([
-          f'is_same_parent_email_{i}_from_isams',
-      ])
-
-  new_order.extend([
-      'is_same_parent_relationship_1_from_oa', 'is_same_parent_relationship_2_from_oa',
-      'is_same_parent_relationship_3_from_oa', 'is_same_parent_relationship_4_from_oa',
-  ])
-
-  for i in range(1, max_i + 1):
-      new_order.extend([
-          f'is_same_parent_relationship_{i}_from_isams',
-      ])
-
-  def update_note(row):
-      if 'Only' in row['Note']:
-          return row
-      
-      if pd.isna(row['Note']) or row['Note'] == '':
-          notes = []
-      else:
-          notes = [row['Note']]
-
-      comparison_mappings = {
-          'is_same_id': ('iSAMS School Code', 'OA Student ID'),
-          'is_same_email': ('iSAMS Pupil Email Address', 'OA Email'),
-          'is_same_first_name': ('iSAMS Forename', 'OA First Name'),
-          'is_same_last_name': ('iSAMS Surname', 'OA Last Name'),
-          'is_same_middle_name': ('iSAMS Middle Names', 'OA Middle Name(s)'),
-          'is_same_preferred_name': ('iSAMS Preferred Name', 'OA Preferred Names'),
-          'is_same_grade_year': ('iSAMS Year (NC)', 'OA Grade_mapped'),
-          'is_same_date_of_birth': ('iSAMS Date of Birth', 'OA Birth Date')
-      }
-      
-      for comparison, (col1, col2) in comparison_mappings.items():
-          if comparison in row and not row[comparison]:
-              # Check if either of the columns is empty
-              if pd.isna(row[col1]) or pd.isna(row[col2]):
-                  missing_column = col1 if pd.isna(row[col1]) else col2
-                  friendly_missing = missing_column.split()[0]
-                  friendly_name = comparison.replace('is_same_', '').replace('_', ' ').title()
-                  notes.append(f'Missing {friendly_name} in {friendly_missing}')
-              else:
-                  friendly_name = comparison.replace('is_same_', '').replace('_', ' ').title()
-                  notes.append(f'Conflict {friendly_name}')
-      
-      for i in range(1, 5):
-          isams_nationality = pd.isna(row.get(f'iSAMS Nationality {i}'))
-          oa_nationality = pd.isna(row.get(f'OA Nationality {i}'))
-          is_same_nationality_isams = row.get(f'is_same_nationality_{i}_from_isams') is False
-          is_same_nationality_oa = row.get(f'is_same_nationality_{i}_from_oa') is False
-
-          if ((is_same_nationality_oa) and (not oa_nationality)) or ((is_same_nationality_isams) and (not isams_nationality)):
-              notes.append(f'Conflict Nationality')
-              break  # Only add the note once
-      
-      attribute_mappings = [
-          ("Email", "Primary Contact Email", "Conflict Parent Email"),
-          ("First Name", "Primary Contact Forename", "Conflict Parent First Name"),
-          ("Last Name", "Primary Contact Surname", "Conflict Parent Last Name"),
-          ("Relationship", "Relation Type", "Conflict Parent Relationship"),
-      ]
-
-      # Iterate over the attribute mappings
-      for i in range(1, 5):
-          for attribute, source_prefix, note_message in attribute_mappings:
-              if attribute == "Email":
-                  isams_parent_emails = row.get('iSAMS Parent_email_mapped')
-                  oa_email = row.get(f'OA Parent/Guardian {i} - {attribute}')
-                  if not isinstance(isams_parent_emails, list):
-                      isams_parent_emails = []
-                  if isinstance(oa_email, str):
-                      if not oa_email in isams_parent_emails:
-                          notes.append(f'Parent {i} from OA is missing in iSAMS')
-                          break
-              oa_parent_attribute = pd.isna(row.get(f'OA Parent/Guardian {i} - {attribute}'))
-              is_same_parent_attribute_oa = row.get(f"is_same_{' '.join(note_message.split()[1:]).lower().replace(' ','_')}_{i}_from_oa") is False
-              if ((is_same_parent_attribute_oa) and (not oa_parent_attribute)):
-                  if not note_message in notes:
-                      notes.append(note_message)
-                  
-      for i in range(1, max_i + 1):    
-          # Check for conflicts in iSAMS range
-          for attribute, source_prefix, note_message in attribute_mappings:
-              if attribute == "Email":
-                  # Initialize OA email list or set to empty if NaN
-                  oa_parent_emails = row.get('OA Parent_email_mapped')
-                  isams_email = row.get(f'iSAMS {source_prefix} {i}')
-                  if not isinstance(oa_parent_emails, list):
-                      oa_parent_emails = []
-                  if isinstance(isams_email, str):
-                      if not isams_email in oa_parent_emails:
-                          notes.append(f'Parent {i} from iSAMS is missing in OA')
-                          break
-              isams_parent_attribute = pd.isna(row.get(f'iSAMS {source_prefix} {i}'))
-              is_same_parent_attribute_isams = row.get(f"is_same_{' '.join(note_message.split()[1:]).lower().replace(' ','_')}_{i}_from_isams") is False
-
-              if is_same_parent_attribute_isams and not isams_parent_attribute:
-                  if not note_message in notes:
-                      notes.append(note_message)
-      if notes:
-          row['Note'] = ', '.join(notes)
-      return row
-  print('Comparison process done.')
-  
-  export_df_copy = export_df[new_order].copy()
-  export_df_copy = export_df_copy.rename(columns=lambda x: x.replace('oa_', 'OA ').replace('isams_', 'iSAMS '))
-  export_df_copy = export_df_copy.apply(update_note, axis=1)
-  export_df_copy['OA Birth Date'] = pd.to_datetime(export_df_copy['OA Birth Date']).dt.strftime('%d %B, %Y')
-  export_df_copy['iSAMS Date of Birth'] = pd.to_datetime(export_df_copy['iSAMS Date of Birth']).dt.strftime('%d %B, %Y')
-  export_df_copy = export_df_copy.sort_index()
-
-  columns_to_hide = [
-          'iSAMS Address Type', 'iSAMS Country', 'iSAMS Language',
-          'iSAMS Nationality', 'iSAMS Id', 
-      
-          'iSAMS Parent_first_name_mapped', 'iSAMS Parent_last_name_mapped',
-          'iSAMS Parent_email_mapped', 'iSAMS Parent_relation_mapped',
-          'iSAMS Nationality 1_mapped', 'iSAMS Nationality 2_mapped',
-          'iSAMS Nationality 3_mapped', 'iSAMS Nationality 4_mapped',
-          'iSAMS Nationality_mapped',
-      
-          'OA OpenApply ID', 'OA OpenApply URL', 
-          'OA Nationality', 'OA Second Nationality', 'OA Third Nationality', 
-          'OA Parent/Guardian 1 - Parent OpenApply ID', 'OA Parent/Guardian 2 - Parent OpenApply ID',
-          'OA Parent/Guardian 3 - Parent OpenApply ID', 'OA Parent/Guardian 4 - Parent OpenApply ID',
-          'OA Grade_mapped', 'OA Parent_first_name_mapped', 'OA Parent_last_name_mapped',
-          'OA Parent_email_mapped', 'OA Parent_relationship_mapped', 'OA Nationality 1_mapped',
-          'OA Nationality 2_mapped', 'OA Nationality 3_mapped',
-          'OA Nationality 4_mapped', 'OA Nationality_mapped', 
-          'is_same_id', 'is_same_first_name', 'is_same_last_name', 'is_same_preferred_name',
-          'is_same_middle_name', 'is_same_grade_year', 'is_same_date_of_birth', 'is_same_email',
-          'is_same_nationality_1_from_oa', 'is_same_nationality_2_from_oa',
-          'is_same_nationality_3_from_oa', 'is_same_nationality_4_from_oa',
-          'is_same_nationality_1_from_isams', 'is_same_nationality_2_from_isams',
-          'is_same_nationality_3_from_isams', 'is_same_nationality_4_from_isams',
-          'is_same_parent_first_name_1_from_oa', 'is_same_parent_first_name_2_from_oa',
-          'is_same_parent_first_name_3_from_oa', 'is_same_parent_first_name_4_from_oa',
-          'is_same_parent_last_name_1_from_oa', 'is_same_parent_last_name_2_from_oa',
-          'is_same_parent_last_name_3_from_oa', 'is_same_parent_last_name_4_from_oa',
-          'is_same_parent_email_1_from_oa', 'is_same_parent_email_2_from_oa',
-          'is_same_parent_email_3_from_oa', 'is_same_parent_email_4_from_oa',
-          'is_same_parent_relationship_1_from_oa', 'is_same_parent_relationship_2_from_oa',
-          'is_same_parent_relationship_3_from_oa', 'is_same_parent_relationship_4_from_oa',
+  for option in reversed(options):
+      command = option(command)
+  return command
+
+def profile_options(command):
+  """Run report options shared by every command."""
+  options = [
+      click.option("--profile", is_flag=True, default=False, help="Write the time, CPU time, peak memory and frame sizes of every stage to <workbook>_profile.json."),
+      click.option("--deep-profile", is_flag=True, default=False, help="Like --profile, and also write cProfile and tracemalloc output of the slowest stage (slower)."),
   ]
-
-  for i in range(1, max_i + 1):
-      columns_to_hide.extend([
-          f'is_same_parent_first_name_{i}_from_isams', f'is_same_parent_last_name_{i}_from_isams',
-          f'is_same_parent_email_{i}_from_isams', f'is_same_parent_relationship_{i}_from_isams',
-      ])
-
-  def highlight_columns(row):
-      if 'not in' in row['Note']:
-          return {col: '' for col in row.index}  # Return default style for all columns
-      # Define the comparison mappings
-      comparison_mappings = {
-          'is_same_id': ('iSAMS School Code', 'OA Student ID'),
-          'is_same_email': ('iSAMS Pupil Email Address', 'OA Email'),
-          'is_same_first_name': ('iSAMS Forename', 'OA First Name'),
-          'is_same_last_name': ('iSAMS Surname', 'OA Last Name'),
-          'is_same_middle_name': ('iSAMS Middle Names', 'OA Middle Name(s)'),
-          'is_same_preferred_name': ('iSAMS Preferred Name', 'OA Preferred Names'),
-          'is_same_grade_year': ('iSAMS Year (NC)', 'OA Grade_mapped'),
-          'is_same_date_of_birth': ('iSAMS Date of Birth', 'OA Birth Date')
-      }
-
-      styles = {}
-      for comparison, (col1, col2) in comparison_mappings.items():
-          if comparison in row and not row[comparison]:
-              styles[col1] = 'color: #f40404; font-weight: bold'
-              styles[col2] = 'color: #f40404; font-weight: bold'
-      for i in range(1, 5):
-          if not row.get(f'is_same_nationality_{i}_from_oa', True):
-              styles[f'OA Nationality {i}'] = 'color: #f40404; font-weight: bold'
-          if not row.get(f'is_same_nationality_{i}_from_isams', True):
-              styles[f'iSAMS Nationality {i}'] = 'color: #f40404; font-weight: bold'
-          if not row.get(f'is_same_parent_first_name_{i}_from_oa', True) and (row[f'is_same_parent_first_name_{i}_from_oa'] != ''):
-              styles[f'OA Parent/Guardian {i} - First Name'] = 'color: #f40404; font-weight: bold'
-          if not row.get(f'is_same_parent_last_name_{i}_from_oa', True) and (row[f'is_same_parent_last_name_{i}_from_oa'] != ''):
-              styles[f'OA Parent/Guardian {i} - Last Name'] = 'color: #f40404; font-weight: bold'
-          if not row.get(f'is_same_parent_relationship_{i}_from_oa', True) and (row[f'is_same_parent_relationship_{i}_from_oa'] != ''):
-              styles[f'OA Parent/Guardian {i} - Relationship'] = 'color: #f40404; font-weight: bold'
-          if not row.get(f'is_same_parent_email_{i}_from_oa', True) and (row[f'is_same_parent_email_{i}_from_oa'] != ''):
-              styles[f'OA Parent/Guardian {i} - Email'] = 'color: #f40404; font-weight: bold'
-      for i in range(1,max_i+1):
-          if not row.get(f'is_same_parent_first_name_{i}_from_isams', True) and (row[f'is_same_parent_first_name_{i}_from_isams'] != ''):
-              styles[f'iSAMS Primary Contact Forename {i}'] = 'color: #f40404; font-weight: bold'
-          if not row.get(f'is_same_parent_last_name_{i}_from_isams', True) and (row[f'is_same_parent_last_name_{i}_from_isams'] != ''):
-              styles[f'iSAMS Primary Contact Surname {i}'] = 'color: #f40404; font-weight: bold'
-          if not row.get(f'is_same_parent_relationship_{i}_from_isams', True) and (row[f'is_same_parent_relationship_{i}_from_isams'] != ''):
-              styles[f'iSAMS Relation Type {i}'] = 'color: #f40404; font-weight: bold'
-          if not row.get(f'is_same_parent_email_{i}_from_isams', True) and (row[f'is_same_parent_email_{i}_from_isams'] != ''):
-              styles[f'iSAMS Primary Contact Email {i}'] = 'color: #f40404; font-weight: bold'
-      for col in row.index:
-          if col not in styles:
-              styles[col] = ''
-      return pd.Series(styles)
-
-  def highlight_rows(row):
-      styles = [''] * len(row)  # Start with default style
-      oa_student_id_idx = row.index.get_loc('OA Student ID') - 1  # Get the index of 'MB Student ID' column
-      if 'Student not in OA' in row['Note']:
-          styles[oa_student_id_idx:] = ['background-color: #07AAE2'] * (len(row) - oa_student_id_idx)
-      elif 'Student not in iSAMS' in row['Note']:
-          styles[:oa_student_id_idx] = ['background-color: #FFC000'] * oa_student_id_idx
-
-      return styles
-
-  export_df_style = (export_df_copy.fillna('').style.apply(highlight_columns, axis=1).apply(highlight_rows, axis=1))
-  export_df_id_conflict = export_df_copy[export_df_copy['is_same_id'] == False].copy().reset_index(drop=True)[['Note', 'iSAMS School Code', 'OA Student ID', 'is_same_id']]
-  export_df_id_conflict['Note'] = export_df_id_conflict['Note'].apply(
-      lambda x: ', '.join(note for note in x.split(', ') if 'ID' in note)
-  )
-  export_df_id_conflict_style = export_df_id_conflict.fillna('').style.apply(highlight_columns, axis=1)
-
-  export_df_email_conflict = export_df_copy[export_df_copy['is_same_email'] == False].copy().reset_index(drop=True)[['Note', 'iSAMS Pupil Email Address', 'OA Email', 'is_same_email']]
-  export_df_email_conflict['Note'] = export_df_email_conflict['Note'].apply(
-      lambda x: ', '.join(note for note in x.split(', ') if 'Email' in note)
-  )
-  export_df_email_conflict_style = export_df_email_conflict.fillna('').style.apply(highlight_columns, axis=1)
-
-  export_df_dob_conflict = export_df_copy[
-      export_df_copy['is_same_date_of_birth'] == False
-  ].copy().reset_index(drop=True)[[
-      'Note', 
-      'iSAMS School Code', 'iSAMS Pupil Email Address', 'iSAMS Date of Birth',
-      'OA Student ID', 'OA Email', 'OA Birth Date', 
-      'is_same_date_of_birth']]
-  export_df_dob_conflict['Note'] = export_df_dob_conflict['Note'].apply(
-      lambda x: ', '.join(note for note in x.split(', ') if 'Birth' in note)
-  )
-  export_df_dob_conflict_style = export_df_dob_conflict.fillna('').style.apply(highlight_columns, axis=1)
-
-  export_df_name_conflict = export_df_copy[
-      (export_df_copy['is_same_first_name'] == False) | 
-      (export_df_copy['is_same_middle_name'] == False) | 
-      (export_df_copy['is_same_last_name'] == False) | 
-      (export_df_copy['is_same_preferred_name'] == False)
-  ].copy().reset_index(drop=True)[[
-      'Note',
-      'iSAMS School Code', 'iSAMS Pupil Email Address',
-      'iSAMS Forename', 'iSAMS Middle Names', 'iSAMS Surname', 'iSAMS Preferred Name',
-      'OA Student ID', 'OA Email',
-      'OA First Name', 'OA Middle Name(s)', 'OA Last Name', 'OA Preferred Names', 
-      'is_same_first_name', 'is_same_middle_name', 'is_same_last_name', 'is_same_preferred_name'
-  ]]
-  export_df_name_conflict['Note'] = export_df_name_conflict['Note'].apply(
-      lambda x: ', '.join(note for note in x.split(', ') if 'Name' in note)
-  )
-  export_df_name_conflict_style = export_df_name_conflict.fillna('').style.apply(highlight_columns, axis=1)
-
-  export_df_nationality_conflict = export_df_copy[
-      ((export_df_copy['is_same_nationality_1_from_isams'] == False) & export_df_copy['iSAMS Nationality 1'].notna()) |
-      ((export_df_copy['is_same_nationality_2_from_isams'] == False) & export_df_copy['iSAMS Nationality 2'].notna()) |
-      ((export_df_copy['is_same_nationality_3_from_isams'] == False) & export_df_copy['iSAMS Nationality 3'].notna()) |
-      ((export_df_copy['is_same_nationality_4_from_isams'] == False) & export_df_copy['iSAMS Nationality 4'].notna()) |
-      ((export_df_copy['is_same_nationality_1_from_oa'] == False) & export_df_copy['OA Nationality 1'].notna()) |
-      ((export_df_copy['is_same_nationality_2_from_oa'] == False) & export_df_copy['OA Nationality 2'].notna()) |
-      ((export_df_copy['is_same_nationality_3_from_oa'] == False) & export_df_copy['OA Nationality 3'].notna()) |
-      ((export_df_copy['is_same_nationality_4_from_oa'] == False) & export_df_copy['OA Nationality 4'].notna())
-  ].copy().reset_index(drop=True)[
-      ['Note',
-      'iSAMS School Code', 'iSAMS Pupil Email Address',
-      'iSAMS Nationality 1', 'iSAMS Nationality 2', 'iSAMS Nationality 3', 'iSAMS Nationality 4',
-      'OA Student ID', 'OA Email',
-      'OA Nationality 1', 'OA Nationality 2', 'OA Nationality 3', 'OA Nationality 4',
-      'is_same_nationality_1_from_isams', 'is_same_nationality_2_from_isams',
-      'is_same_nationality_3_from_isams', 'is_same_nationality_4_from_isams',
-      'is_same_nationality_1_from_oa', 'is_same_nationality_2_from_oa', 
-      'is_same_nationality_3_from_oa', 'is_same_nationality_4_from_oa', 
-      ]]
-  export_df_nationality_conflict['Note'] = export_df_nationality_conflict['Note'].apply(
-      lambda x: ', '.join(note for note in x.split(', ') if 'Nationality' in note)
-  )
-  export_df_nationality_conflict_style = export_df_nationality_conflict.fillna('').style.apply(highlight_columns, axis=1)
-
-  conditions = []
-
-  # Generate conditions for each 'is_same_parent' column dynamically based on max_i
-  for i in range(1, max_i + 1):
-      conditions.append((export_df_copy[f'is_same_parent_first_name_{i}_from_isams'] == False) & export_df_copy[f'iSAMS Primary Contact Forename {i}'].notna())
-      conditions.append((export_df_copy[f'is_same_parent_last_name_{i}_from_isams'] == False) & export_df_copy[f'iSAMS Primary Contact Surname {i}'].notna())
-      conditions.append((export_df_copy[f'is_same_parent_relationship_{i}_from_isams'] == False) & export_df_copy[f'iSAMS Relation Type {i}'].notna()) 
-      conditions.append((export_df_copy[f'is_same_parent_email_{i}_from_isams'] == False) & export_df_copy[f'iSAMS Primary Contact Email {i}'].notna())
-
-  for i in range(1, 5):
-      conditions.append((export_df_copy[f'is_same_parent_first_name_{i}_from_oa'] == False) & export_df_copy[f'OA Parent/Guardian {i} - First Name'].notna())
-      conditions.append((export_df_copy[f'is_same_parent_last_name_{i}_from_oa'] == False) & export_df_copy[f'OA Parent/Guardian {i} - Last Name'].notna())
-      conditions.append((export_df_copy[f'is_same_parent_relationship_{i}_from_oa'] == False) & export_df_copy[f'OA Parent/Guardian {i} - Relationship'].notna()) 
-      conditions.append((export_df_copy[f'is_same_parent_email_{i}_from_oa'] == False) & export_df_copy[f'OA Parent/Guardian {i} - Email'].notna())
-      
-  # Combine all conditions using 'or'
-  combined_condition = conditions[0]
-  for condition in conditions[1:]:
-      combined_condition |= condition
-
-  columns_parent_conflict = ['Note', 'iSAMS School Code', 'iSAMS Pupil Email Address',]
-  for i in range(1, max_i + 1):
-      columns_parent_conflict.extend([
-          f'iSAMS Primary Contact Forename {i}', f'iSAMS Primary Contact Surname {i}',
-          f'iSAMS Primary Contact Email {i}', f'iSAMS Relation Type {i}',
-      ])
-  columns_parent_conflict.extend(['OA Student ID', 'OA Email',])
-  for i in range(1, 5):
-      columns_parent_conflict.extend([
-          f'OA Parent/Guardian {i} - First Name', f'OA Parent/Guardian {i} - Last Name',
-          f'OA Parent/Guardian {i} - Email', f'OA Parent/Guardian {i} - Relationship',
-      ])
-  for i in range(1, max_i + 1):
-      columns_parent_conflict.extend([
-          f'is_same_parent_first_name_{i}_from_isams',
-          f'is_same_parent_last_name_{i}_from_isams',
-          f'is_same_parent_email_{i}_from_isams',
-          f'is_same_parent_relationship_{i}_from_isams',
-      ])
-  for i in range(1, 5):
-      columns_parent_conflict.extend([
-          f'is_same_parent_first_name_{i}_from_oa',
-          f'is_same_parent_last_name_{i}_from_oa',
-          f'is_same_parent_email_{i}_from_oa',
-          f'is_same_parent_relationship_{i}_from_oa',
-      ])
-  export_df_parent_conflict = export_df_copy[combined_condition].copy().reset_index(drop=True)[
-      columns_parent_conflict
+  for option in reversed(options):
+      command = option(command)
+  return command
+
+def incremental_options(command):
+  """Incremental mode options shared by every command."""
+  options = [
+      click.option("--incremental", is_flag=True, default=False, help="Only compare students that changed since the previous incremental run."),
+      click.option("--snapshot-dir", default=SNAPSHOT_DIR, type=click.Path(file_okay=False), show_default=True, help="Directory of the incremental snapshots."),
+  ]
+  for option in reversed(options):
+      command = option(command)
+  return command
+
+def format_options(command):
+  """Output format option shared by every command."""
+  return click.option("--format", "-f", "formats", multiple=True, default=DEFAULT_FORMATS, type=click.Choice(FORMATS), show_default=True,
+                      help="Output format; repeat for several. Parquet, CSV and JSON Lines write one unstyled table per sheet into a directory named like the workbook.")(command)
+
+def match_key_options(command):
+  """Match key option shared by every command."""
+  return click.option("--match-key", "match_keys", multiple=True, default=DEFAULT_MATCH_KEYS, type=click.Choice(list(MATCH_KEYS)), show_default=True,
+                      help="Key students are matched on: Student ID, or name and date of birth. Repeat for several, in order of priority.")(command)
+
+def prepare_formats(formats):
+  """Fails early, before any work, when a format cannot be written."""
+  try:
+      check_formats(formats)
+  except ValueError as e:
+      raise click.UsageError(str(e))
+  return tuple(dict.fromkeys(formats))
+
+def openapply_options(command):
+  """OpenApply API options, used instead of the OA export."""
+  options = [
+      click.option("--oa-url", default=None, type=str, help="Read OA students from the OpenApply API of this site (e.g. https://<school>.openapply.com) instead of 'OA (<school>).xlsx'."),
+      click.option("--oa-token", default=None, type=str, envvar="OPENAPPLY_TOKEN", help="OpenApply API token.  [env: OPENAPPLY_TOKEN]"),
+      click.option("--oa-client-id", default=None, type=str, envvar="OPENAPPLY_CLIENT_ID", help="OpenApply API client ID, used with --oa-client-secret instead of a token.  [env: OPENAPPLY_CLIENT_ID]"),
+      click.option("--oa-client-secret", default=None, type=str, envvar="OPENAPPLY_CLIENT_SECRET", help="OpenApply API client secret.  [env: OPENAPPLY_CLIENT_SECRET]"),
+      click.option("--oa-connections", default=DEFAULT_CONNECTIONS, type=click.IntRange(min=1), show_default=True, help="Concurrent requests to the OpenApply API."),
   ]
-  export_df_parent_conflict['Note'] = export_df_parent_conflict['Note'].apply(
-      lambda x: ', '.join(note for note in x.split(', ') if 'Parent' in note)
+  for option in reversed(options):
+      command = option(command)
+  return command
+
+def prepare_openapply(oa_url, oa_token, oa_client_id, oa_client_secret, oa_connections):
+  """The OpenApply API settings of load_data, or None to read the OA export."""
+  if oa_url is None:
+      return None
+  if oa_token is None and not (oa_client_id and oa_client_secret):
+      raise click.UsageError('--oa-url needs --oa-token, or --oa-client-id and --oa-client-secret.')
+  return {'base_url': oa_url, 'token': oa_token, 'client_id': oa_client_id, 'client_secret': oa_client_secret, 'connections': oa_connections}
+
+def prepare_cache(no_cache, clear_cache, cache_dir):
+  """Applies --clear-cache and returns the cache directory to use (None when caching is off)."""
+  if clear_cache:
+      print(f'Removed {clear_ingest_cache(cache_dir)} ingest cache entries.')
+  return None if no_cache else cache_dir
+
+@click.group()
+def isams_oa_sync() -> None:
+  """Compare iSAMS and OpenApply (OA) student exports."""
+
+@isams_oa_sync.command()
+@click.option("--name", "-n", default='Cologne International School', type=str, required=False, help="School Name (please use ' ' to enclose it.)")
+@cache_options
+@incremental_options
+@profile_options
+@format_options
+@match_key_options
+@openapply_options
+@click.option("--isams-feed", default=None, type=str, help="Read iSAMS pupils from an iSAMS XML feed (a saved file or the batch API URL) instead of 'iSAMS (<school>).xlsx'.")
+@click.option("--summary-only", is_flag=True, default=False, help="Only print the number of matched, one-sided and conflicting students as JSON on stdout; no workbook or tables are written.")
+
+def school(name:str, no_cache: bool, clear_cache: bool, cache_dir: str, cache_max_age: int, cache_max_size: int, incremental: bool, snapshot_dir: str, profile: bool, deep_profile: bool, formats, match_keys, oa_url, oa_token, oa_client_id, oa_client_secret, oa_connections, isams_feed, summary_only) -> None:
+  """Analyse one school from the files in the current directory."""
+  formats = prepare_formats(formats)
+  oa_api = prepare_openapply(oa_url, oa_token, oa_client_id, oa_client_secret, oa_connections)
+  # With --summary-only, stdout only gets the JSON counts; the progress lines go to stderr
+  with contextlib.redirect_stdout(sys.stderr) if summary_only else contextlib.nullcontext():
+      cache_dir = prepare_cache(no_cache, clear_cache, cache_dir)
+      result = sync_school(name, cache_dir=cache_dir, snapshot_dir=snapshot_dir if incremental else None, profile=profile, deep_profile=deep_profile, formats=formats, match_keys=tuple(dict.fromkeys(match_keys)), oa_api=oa_api, isams_feed=isams_feed, summary_only=summary_only)
+      if cache_dir is not None:
+          evict_cache(cache_dir, max_age_days=cache_max_age, max_size_mb=cache_max_size)
+  if summary_only:
+      click.echo(json.dumps(result, indent=2))
+
+@isams_oa_sync.command()
+@click.argument("names", nargs=-1)
+@click.option("--glob", "-g", "patterns", multiple=True, help="Directory or glob of 'OA (<school>).xlsx' exports; each match is a school whose files are in that directory. Can be repeated.")
+@click.option("--workers", "-w", default=None, type=click.IntRange(min=1), help="Number of worker processes.  [default: number of CPUs]")
+@click.option("--nationality-file", default=NATIONALITY_FILE, type=click.Path(dir_okay=False, exists=True), show_default=True, help="Nationality mapping shared by every school.")
+@click.option("--output-dir", "-o", default=None, type=click.Path(file_okay=False), help="Directory of the analysis workbooks and run summary.  [default: next to each school's files]")
+@cache_options
+@incremental_options
+@click.option("--profile", is_flag=True, default=False, help="Write the time, CPU time, peak memory and frame sizes of every stage next to each workbook.")
+@format_options
+@match_key_options
+@click.option("--summary-only", is_flag=True, default=False, help="Only print the run summary, with every school's number of matched, one-sided and conflicting students, as JSON on stdout; no workbooks or tables are written.")
+
+def batch(names, patterns, workers, nationality_file, output_dir, no_cache, clear_cache, cache_dir, cache_max_age, cache_max_size, incremental, snapshot_dir, profile, formats, match_keys, summary_only) -> None:
+  """Analyse several schools in parallel.
+
+  NAMES are schools whose files are in the current directory.
+  """
+  schools = [(name, '.') for name in names]
+  for pattern in patterns:
+      schools.extend(discover_schools(pattern))
+  schools = list(dict.fromkeys(schools))
+  if not schools:
+      raise click.UsageError('No schools given. Pass school names or --glob.')
+
+  formats = prepare_formats(formats)
+  # With --summary-only, stdout only gets the JSON summary; the progress lines go to stderr
+  with contextlib.redirect_stdout(sys.stderr) if summary_only else contextlib.nullcontext():
+      cache_dir = prepare_cache(no_cache, clear_cache, cache_dir)
+      if output_dir is not None:
+          os.makedirs(output_dir, exist_ok=True)
+      print(f'Starting iSAMS-OA Sync for {len(schools)} schools. . .')
+
+      def report(result):
+          if result['status'] != 'ok':
+              print(f"[failed] {result['school']}: {result['error']}")
+          elif summary_only:
+              print(f"[ok]     {result['school']} ({result['seconds']:.1f}s): {result['counts']['with_conflicts']} students with conflicts")
+          else:
+              print(f"[ok]     {result['school']} ({result['seconds']:.1f}s) -> {result['output']}")
+
+      summary = run_batch(schools, workers=workers, nationality_file=nationality_file, output_dir=output_dir, cache_dir=cache_dir, snapshot_dir=snapshot_dir if incremental else None, profile=profile, formats=formats, match_keys=tuple(dict.fromkeys(match_keys)), summary_only=summary_only, on_result=report)
+      if cache_dir is not None:
+          evict_cache(cache_dir, max_age_days=cache_max_age, max_size_mb=cache_max_size)
+
+      if summary_only:
+          print(f"Done: {summary['succeeded']} succeeded, {summary['failed']} failed in {summary['seconds']:.1f}s.")
+      else:
+          summary_file = os.path.join(output_dir or '.', f"isams_oa_batch_summary_{dt.now().strftime('%Y-%m-%d_%H-%M-%S')}.json")
+          with open(summary_file, 'w') as f:
+              json.dump(summary, f, indent=2)
+          print(f"Done: {summary['succeeded']} succeeded, {summary['failed']} failed in {summary['seconds']:.1f}s. Summary: {summary_file}")
+  if summary_only:
+      click.echo(json.dumps(summary, indent=2))
+  if summary['failed']:
+      raise SystemExit(1)
+
+@isams_oa_sync.command()
+@click.option("--host", default=DEFAULT_HOST, show_default=True, help="Address to listen on.")
+@click.option("--port", "-p", default=DEFAULT_PORT, type=int, show_default=True, help="Port to listen on.")
+@click.option("--workers", "-w", default=None, type=click.IntRange(min=1), help="Number of worker processes.  [default: number of CPUs]")
+@click.option("--queue-size", default=DEFAULT_QUEUE_SIZE, type=click.IntRange(min=0), show_default=True, help="Requests that can wait for a worker; more are refused with 503.")
+@click.option("--nationality-file", default=NATIONALITY_FILE, type=click.Path(dir_okay=False, exists=True), show_default=True, help="Nationality mapping shared by every request.")
+@click.option("--output-dir", "-o", default=None, type=click.Path(file_okay=False), help="Directory of the analysis workbooks.  [default: next to each school's files]")
+@cache_options
+@incremental_options
+
+def service(host, port, workers, queue_size, nationality_file, output_dir, no_cache, clear_cache, cache_dir, cache_max_age, cache_max_size, incremental, snapshot_dir) -> None:
+  """Serve analyses over HTTP from warm worker processes.
+
+  POST /sync with a JSON body {"school": ..., "data_dir": ...}, or {"school": ..., "files": {"isams", "oa",
+  "grade_mapping"}} with base64 file contents. Add "response": "workbook" to get the workbook back
+  instead of the JSON summary. GET /health reports the workers.
+  """
+  cache_dir = prepare_cache(no_cache, clear_cache, cache_dir)
+  if output_dir is not None:
+      os.makedirs(output_dir, exist_ok=True)
+  serve(host, port, workers=workers, queue_size=queue_size, nationality_file=nationality_file, output_dir=output_dir,
+        cache_dir=cache_dir, snapshot_dir=snapshot_dir if incremental else None)
+  if cache_dir is not None:
+      evict_cache(cache_dir, max_age_days=cache_max_age, max_size_mb=cache_max_size)
+
+def generator_options(command):
+  """Synthetic data options shared by generate and benchmark."""
+  options = [
+      click.option("--contacts", default=2, type=click.IntRange(min=1), show_default=True, help="Most contacts (iSAMS rows) per student."),
+      click.option("--nationalities", default=2, type=click.IntRange(1, 3), show_default=True, help="Most nationalities per student."),
+      click.option("--id-mismatch-rate", default=0.02, type=click.FloatRange(0, 1), show_default=True, help="Share of students that cannot be matched by ID."),
+      click.option("--conflict-rate", default=0.05, type=click.FloatRange(0, 1), show_default=True, help="Share of students with a conflict in each compared field."),
+      click.option("--seed", default=0, type=int, show_default=True, help="Random seed."),
+  ]
+  for option in reversed(options):
+      command = option(command)
+  return command
+
+@isams_oa_sync.command()
+@click.option("--students", "-s", default=1000, type=click.IntRange(min=1), show_default=True, help="Number of students.")
+@click.option("--name", "-n", default='Synthetic School', show_default=True, help="School Name used in the file names.")
+@click.option("--output-dir", "-o", default='.', type=click.Path(file_okay=False), show_default=True, help="Directory of the generated files.")
+@generator_options
+
+def generate(students, name, output_dir, contacts, nationalities, id_mismatch_rate, conflict_rate, seed) -> None:
+  """Write synthetic iSAMS and OA exports with their mapping files."""
+  paths = generate_school(output_dir, name, students=students, contacts=contacts, nationalities=nationalities,
+                          id_mismatch_rate=id_mismatch_rate, conflict_rate=conflict_rate, seed=seed)
+  for path in paths.values():
+      print(path)
+
+@isams_oa_sync.command()
+@click.option("--students", "-s", "student_counts", multiple=True, default=[1000, 10000], type=click.IntRange(min=1), show_default=True, help="Number of students of a scenario. Can be repeated.")
+@click.option("--repeat", "-r", default=3, type=click.IntRange(min=1), show_default=True, help="Timed runs per scenario; the fastest is kept.")
+@click.option("--no-memory", is_flag=True, default=False, help="Skip the memory-profiled run.")
+@click.option("--work-dir", default=None, type=click.Path(file_okay=False), help="Keep the generated files in this directory.  [default: a temporary directory]")
+@click.option("--output", "-o", default=None, type=click.Path(dir_okay=False), help="Report file.  [default: isams_oa_benchmark_<datetime>.json]")
+@click.option("--baseline", "-b", default=None, type=click.Path(dir_okay=False, exists=True), help="Report to compare against; exits with an error on regressions.")
+@click.option("--tolerance", default=DEFAULT_TOLERANCE, type=float, show_default=True, help="Slowdown / memory growth ratio reported as a regression.")
+@generator_options
+
+def benchmark(student_counts, repeat, no_memory, work_dir, output, baseline, tolerance, contacts, nationalities, id_mismatch_rate, conflict_rate, seed) -> None:
+  """Time and memory-profile every pipeline stage on synthetic schools."""
+  def report(students, result):
+      print(f"{students} students: {result['seconds']:.2f}s")
+      for stage in STAGES:
+          measured = result['stages'][stage]
+          memory = f"  {measured['peak_mb']:9.1f} MB" if 'peak_mb' in measured else ''
+          print(f"  {stage:<12}{measured['seconds']:9.3f}s{memory}")
+
+  results = run_benchmark(
+      student_counts, work_dir=work_dir, repeat=repeat, memory=not no_memory, on_result=report,
+      contacts=contacts, nationalities=nationalities, id_mismatch_rate=id_mismatch_rate, conflict_rate=conflict_rate, seed=seed,
   )
-  export_df_parent_conflict_style = export_df_parent_conflict.fillna('').style.apply(highlight_columns, axis=1)
-
-  oa_student_id_idx = export_df_copy.loc[0].index.get_loc('OA Student ID')  # Get the index of 'MB Student ID' column
-  print('Exporting. . .')
-  
-  with pd.ExcelWriter(f"isams_oa_analysis_{school_name}_{dt.now().strftime('%Y-%m-%d_%H-%M-%S')}.xlsx", engine='openpyxl') as writer:
-      export_df_style.to_excel(writer, index=False, sheet_name='All Comparison')
-      # Get the openpyxl objects
-      worksheet = writer.sheets['All Comparison']
-      # Coloring headers
-      blue_fill = openpyxl.styles.PatternFill(start_color='07AAE2', end_color='07AAE2', fill_type='solid')
-      orange_fill = openpyxl.styles.PatternFill(start_color='FFC000', end_color='FFC000', fill_type='solid')
-      
-      for col in range(2, worksheet.max_column + 1):
-          cell = worksheet.cell(row=1, column=col)
-          if (col > 1) & (col < oa_student_id_idx):  # adjust according to where 'Student ID' is now
-              cell.fill = orange_fill
-          elif (col >= oa_student_id_idx):
-              cell.fill = blue_fill
-
-      for row in worksheet.iter_rows(min_row=2, max_col=1, max_row=worksheet.max_row):
-          for cell in row:
-              if cell.value == '':
-                  worksheet.row_dimensions[cell.row].hidden = True
-
-      for column in columns_to_hide:
-          # print(final_df_copy.columns)
-          col_idx = export_df_copy.columns.get_loc(column) + 1  # +1 because Excel is 1-indexed
-          worksheet.column_dimensions[openpyxl.utils.get_column_letter(col_idx)].hidden = True
-          
-      export_df_id_conflict_style.to_excel(writer, index=False, sheet_name='ID Conflict')
-      worksheet = writer.sheets['ID Conflict']
-      worksheet.cell(row=1, column=2).fill = orange_fill
-      worksheet.cell(row=1, column=3).fill = blue_fill
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(4)].hidden = True
-      
-      export_df_email_conflict_style.to_excel(writer, index=False, sheet_name='Email Conflict')
-      worksheet = writer.sheets['Email Conflict']
-      worksheet.cell(row=1, column=2).fill = orange_fill
-      worksheet.cell(row=1, column=3).fill = blue_fill
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(4)].hidden = True
-      
-      export_df_dob_conflict_style.to_excel(writer, index=False, sheet_name='DOB Conflict')
-      worksheet = writer.sheets['DOB Conflict']
-      worksheet.cell(row=1, column=2).fill = orange_fill
-      worksheet.cell(row=1, column=3).fill = orange_fill
-      worksheet.cell(row=1, column=4).fill = orange_fill
-      worksheet.cell(row=1, column=5).fill = blue_fill
-      worksheet.cell(row=1, column=6).fill = blue_fill
-      worksheet.cell(row=1, column=7).fill = blue_fill
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(8)].hidden = True
-      
-      export_df_name_conflict_style.to_excel(writer, index=False, sheet_name='Name Conflict')
-      worksheet = writer.sheets['Name Conflict']
-      worksheet.cell(row=1, column=2).fill = orange_fill
-      worksheet.cell(row=1, column=3).fill = orange_fill
-      worksheet.cell(row=1, column=4).fill = orange_fill
-      worksheet.cell(row=1, column=5).fill = orange_fill
-      worksheet.cell(row=1, column=6).fill = orange_fill
-      worksheet.cell(row=1, column=7).fill = orange_fill
-      worksheet.cell(row=1, column=8).fill = blue_fill
-      worksheet.cell(row=1, column=9).fill = blue_fill
-      worksheet.cell(row=1, column=10).fill = blue_fill
-      worksheet.cell(row=1, column=11).fill = blue_fill
-      worksheet.cell(row=1, column=12).fill = blue_fill
-      worksheet.cell(row=1, column=13).fill = blue_fill
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(14)].hidden = True
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(15)].hidden = True
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(16)].hidden = True
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(17)].hidden = True
-      
-      export_df_nationality_conflict_style.to_excel(writer, index=False, sheet_name='Nationality Conflict')
-      worksheet = writer.sheets['Nationality Conflict']
-      worksheet.cell(row=1, column=2).fill = orange_fill
-      worksheet.cell(row=1, column=3).fill = orange_fill
-      worksheet.cell(row=1, column=4).fill = orange_fill
-      worksheet.cell(row=1, column=5).fill = orange_fill
-      worksheet.cell(row=1, column=6).fill = orange_fill
-      worksheet.cell(row=1, column=7).fill = orange_fill
-      worksheet.cell(row=1, column=8).fill = blue_fill
-      worksheet.cell(row=1, column=9).fill = blue_fill
-      worksheet.cell(row=1, column=10).fill = blue_fill
-      worksheet.cell(row=1, column=11).fill = blue_fill
-      worksheet.cell(row=1, column=12).fill = blue_fill
-      worksheet.cell(row=1, column=13).fill = blue_fill
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(14)].hidden = True
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(15)].hidden = True
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(16)].hidden = True
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(17)].hidden = True
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(18)].hidden = True
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(19)].hidden = True
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(20)].hidden = True
-      worksheet.column_dimensions[openpyxl.utils.get_column_letter(21)].hidden = True
-      
-      export_df_parent_conflict_style.to_excel(writer, index=False, sheet_name='Parent Conflict')
-      worksheet = writer.sheets['Parent Conflict']
+  output = output or f"isams_oa_benchmark_{dt.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+  save_report(output, results)
+  print(f'Report: {output}')
+
+  if baseline is not None:
+      rows, regressions = compare_to_baseline(results, load_report(baseline), tolerance)
+      for row in rows:
+          flag = '  REGRESSION' if row in regressions else ''
+          print(f"{row['scenario']:>8} {row['stage']:<12}{row['metric']:<9}{row['baseline']:>10} -> {row['current']:<10} x{row['ratio']}{flag}")
+      if regressions:
+          raise SystemExit(1)
 
-      # Calculate the number of columns to fill based on the formula and fill them
-      num_columns_to_fill = 2 + (max_i * 4) + 1
-      for col_index in range(2, num_columns_to_fill + 1):
-          worksheet.cell(row=1, column=col_index).fill = orange_fill
-      
-      num_columns_to_fill1 = 2 + (4 * 4) + 1
-      for col_index in range(num_columns_to_fill + 1, num_columns_to_fill + num_columns_to_fill1):
-          worksheet.cell(row=1, column=col_index).fill = blue_fill
-      for col_index in range(num_columns_to_fill + num_columns_to_fill1,60):
-          worksheet.column_dimensions[openpyxl.utils.get_column_letter(col_index)].hidden = True
-  print('iSAMS-OA Synchronizing process is done.')
-  
-      
 if __name__ == "__main__":
-  isams_oa_sync()
\ No newline at end of file
+  isams_oa_sync()
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from sync.cache import CACHE_DIR
+from sync.comparison import add_comparison_columns, add_parents_comparison_columns
+from sync.contacts import FAMILY_COLUMN
+
+# Snapshot of the previous run's matched students: per-row content hash, comparison flags and Note.
+# A snapshot is only reused when everything else the flags depend on is unchanged (see snapshot_context).
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, 'snapshots')
+SNAPSHOT_VERSION = 1
+KEY_COLUMNS = ['isams_School Code', 'oa_Student ID']
+HASH_COLUMN = '_row_hash'
+
+
+def snapshot_path(snapshot_dir, school_name, data_dir='.'):
+    """One snapshot per school and data directory, or per school alone when data_dir is None (for
+    data directories that only live for one run, such as uploads)."""
+    if data_dir is None:
+        return os.path.join(snapshot_dir, f'{school_name}.pkl')
+    digest = hashlib.sha256(os.path.abspath(data_dir).encode()).hexdigest()[:12]
+    return os.path.join(snapshot_dir, f'{school_name} ({digest}).pkl')
+
+
+def snapshot_context(merged_df, max_i, nationality_mapping, grade_mapping):
+    """Hash of what the comparison depends on besides the row content: the mappings, the number of
+    iSAMS contact slots and the merged columns."""
+    context = {
+        'version': SNAPSHOT_VERSION,
+        'max_i': int(max_i),
+        'columns': list(merged_df.columns),
+        'nationality_mapping': sorted(nationality_mapping.items(), key=str),
+        'grade_mapping': sorted(((str(k), str(v)) for k, v in grade_mapping.items())),
+    }
+    return hashlib.sha256(json.dumps(context, default=str).encode()).hexdigest()
+
+
+def row_keys(df):
+    """(School Code, Student ID, occurrence) per row; the occurrence keeps duplicated IDs apart."""
+    keys = df[KEY_COLUMNS].reset_index(drop=True)
+    keys['occurrence'] = keys.groupby(KEY_COLUMNS, dropna=False).cumcount()
+    return pd.MultiIndex.from_frame(keys)
+
+
+def row_hashes(df):
+    """Content hash of every row. The *_mapped list columns are derived from the other columns and
+    the mappings, which are covered by the snapshot context, so they are left out, as are the
+    comparison flags themselves and the family codes, which are numbered anew by every run."""
+    columns = [c for c in df.columns if not c.endswith(('_mapped', f'_{FAMILY_COLUMN}')) and not c.startswith('is_same_')]
+    return pd.util.hash_pandas_object(df[columns].reset_index(drop=True), index=False).to_numpy()
+
+
+def load_snapshot(path, context):
+    """Returns the previous rows, or None when there is no usable snapshot."""
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = pd.read_pickle(path)
+    except Exception:
+        return None
+    if snapshot.get('context') != context:
+        return None
+    return snapshot['rows']
+
+
+def save_snapshot(path, context, merged_df_copy, notes):
+    """Stores the key, content hash, comparison flags and Note of every matched row."""
+    flag_columns = [c for c in merged_df_copy.columns if c.startswith('is_same_')]
+    rows = merged_df_copy[flag_columns].reset_index(drop=True)
+    rows.insert(0, HASH_COLUMN, row_hashes(merged_df_copy))
+    rows['Note'] = np.asarray(notes, dtype=object)
+    rows.index = row_keys(merged_df_copy)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    pd.to_pickle({'context': context, 'rows': rows}, tmp)
+    os.replace(tmp, path)
+
+
+def compare_incrementally(merged_df, max_i, previous):
+    """Adds the comparison flags, recomputing them only for inserted and modified students.
+
+    Returns the compared frame, the Note of every reused row (None where it has to be rebuilt) and
+    the inserted/modified/unchanged/deleted counts.
+    """
+    n = len(merged_df)
+    keys = row_keys(merged_df)
+    hashes = row_hashes(merged_df)
+
+    positions = np.full(n, -1) if previous is None else previous.index.get_indexer(keys)
+    found = positions >= 0
+    reuse = np.zeros(n, dtype=bool)
+    if previous is not None:
+        reuse[found] = previous[HASH_COLUMN].to_numpy()[positions[found]] == hashes[found]
+    stats = {
+        'inserted': int((~found).sum()),
+        'modified': int((found & ~reuse).sum()),
+        'unchanged': int(reuse.sum()),
+        'deleted': 0 if previous is None else int(len(previous) - len(np.unique(positions[found]))),
+    }
+
+    if not reuse.any():
+        merged_df_copy = add_comparison_columns(merged_df.copy())
+        merged_df_copy = add_parents_comparison_columns(merged_df_copy, max_i)
+        return merged_df_copy, np.full(n, None, dtype=object), stats
+
+    flag_columns = [c for c in previous.columns if c.startswith('is_same_')]
+    flags = {c: np.empty(n, dtype=previous[c].dtype) for c in flag_columns}
+    for c in flag_columns:
+        flags[c][reuse] = previous[c].to_numpy()[positions[reuse]]
+    if not reuse.all():
+        changed = add_comparison_columns(merged_df[~reuse].copy())
+        changed = add_parents_comparison_columns(changed, max_i)
+        for c in flag_columns:
+            flags[c][~reuse] = changed[c].to_numpy()
+
+    merged_df_copy = pd.concat([merged_df, pd.DataFrame(flags, index=merged_df.index)], axis=1)
+    notes = np.full(n, None, dtype=object)
+    notes[reuse] = previous['Note'].to_numpy()[positions[reuse]]
+    return merged_df_copy, notes, stats
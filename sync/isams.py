@@ -0,0 +1,162 @@
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+from sync.cache import CACHE_DIR, cached_read, typed_like_excel
+from sync.sets import sets_from_long
+
+# Reads pupils and their contacts from the iSAMS batch API's XML feed (or a saved copy of it)
+# straight into one row per pupil, the layout preprocess_isams builds from the manual export:
+#
+#   <iSAMS><PupilManager><CurrentPupils>
+#     <Pupil Id="...">
+#       <SchoolCode>448</SchoolCode><Forename>...</Forename><Surname>...</Surname><DOB>2006-09-12T00:00:00</DOB>
+#       <Nationalities><Nationality>British</Nationality></Nationalities>
+#       <Contacts><Contact Id="..."><Forename>...</Forename><EmailAddress>...</EmailAddress>...</Contact></Contacts>
+#     </Pupil>
+#   </CurrentPupils></PupilManager></iSAMS>
+#
+# The feed is parsed incrementally and every pupil is dropped from the tree once read, so memory
+# grows with the number of pupils kept, not with the size of the feed.
+PUPIL_TAG = 'Pupil'
+CONTACT_TAG = 'Contact'
+# Export column -> child element of a Pupil, for the columns preprocess_isams keeps from the
+# export. Elements holding several values (Nationalities, Languages) are joined with ', ' as the
+# export does.
+PUPIL_FIELDS = {
+    'Date of Birth': 'DOB',
+    'Forename': 'Forename',
+    'Gender': 'Gender',
+    'Middle Names': 'MiddleNames',
+    'Preferred Name': 'Preferredname',
+    'Surname': 'Surname',
+    'School Code': 'SchoolCode',
+    'Year (NC)': 'NCYear',
+    'Address Type': 'AddressType',
+    'Country': 'Country',
+    'Language': 'Languages',
+    'Nationality': 'Nationalities',
+}
+# Export column (numbered per contact in the result) -> child element of a Contact
+CONTACT_FIELDS = {
+    'Primary Contact Email': 'EmailAddress',
+    'Primary Contact Forename': 'Forename',
+    'Primary Contact Surname': 'Surname',
+    'Primary Contact Title': 'Title',
+    'Relation Type': 'RelationType',
+}
+# Set column of the distinct lowercased values of every pupil -> contact column
+PARENT_SET_COLUMNS = {
+    'Parent_first_name_mapped': 'Primary Contact Forename',
+    'Parent_last_name_mapped': 'Primary Contact Surname',
+    'Parent_email_mapped': 'Primary Contact Email',
+    'Parent_relation_mapped': 'Relation Type',
+}
+NUMERIC_COLUMNS = ['School Code', 'Year (NC)']
+
+
+def _text(element):
+    """Text of an element, the texts of its children joined for a list element; None when blank.
+    Texts are kept as they are, like the cells of the export, so trailing spaces still show."""
+    if element is None:
+        return None
+    if len(element):
+        values = [child.text for child in element if child.text and child.text.strip()]
+        return ', '.join(values) or None
+    text = element.text
+    return text if text and text.strip() else None
+
+
+def iter_pupils(source):
+    """Yields (pupil values, [contact values]) in feed order, values being in the order of
+    PUPIL_FIELDS and CONTACT_FIELDS. source is a path or a binary file object."""
+    parents = []
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag != PUPIL_TAG:
+            continue
+        contacts = [
+            tuple(_text(contact.find(tag)) for tag in CONTACT_FIELDS.values())
+            for contact in element.iter(CONTACT_TAG)
+        ]
+        yield tuple(_text(element.find(tag)) for tag in PUPIL_FIELDS.values()), contacts
+        # Drop the pupil from the tree so that the parsed part of the feed is not kept
+        if parents:
+            parents[-1].remove(element)
+
+
+def pupils_frame(pupils):
+    """One row per pupil from (pupil values, [contact values]) pairs, like preprocess_isams builds
+    it from the export: pupils share a row when their Id (Forename + Surname) is the same, the
+    first one's values are kept, and their contacts are numbered 1, 2, ... in feed order.
+    """
+    rows = {}
+    students = []
+    contact_rows, contact_slots, contact_values = [], [], []
+    slots = []
+    forename, surname = list(PUPIL_FIELDS).index('Forename'), list(PUPIL_FIELDS).index('Surname')
+    for values, contacts in pupils:
+        if values[forename] is None or values[surname] is None:
+            continue
+        key = values[forename] + values[surname]
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = len(students)
+            students.append(values + (key,))
+            slots.append(0)
+        for contact in contacts:
+            slots[row] += 1
+            contact_rows.append(row)
+            contact_slots.append(slots[row])
+            contact_values.append(contact)
+
+    # Missing values are NaN, as empty cells of the export are (None would compare as 'none')
+    df = pd.DataFrame.from_records(students, columns=[*PUPIL_FIELDS, 'Id']).fillna(np.nan)
+    df['Date of Birth'] = pd.to_datetime(df['Date of Birth'], errors='coerce').dt.normalize()
+    for column in NUMERIC_COLUMNS:
+        df[column] = typed_like_excel(df[column])
+
+    contacts = pd.DataFrame.from_records(contact_values, columns=list(CONTACT_FIELDS)).fillna(np.nan)
+    contact_rows = np.asarray(contact_rows, dtype=int)
+    contact_slots = np.asarray(contact_slots, dtype=int)
+    max_i = max(int(contact_slots.max()) if len(contact_slots) else 0, 1)
+    wide = {}
+    for column in CONTACT_FIELDS:
+        values = contacts[column].to_numpy(dtype=object)
+        for i in range(1, max_i + 1):
+            slot = np.full(len(df), np.nan, dtype=object)
+            in_slot = contact_slots == i
+            slot[contact_rows[in_slot]] = values[in_slot]
+            wide[f'{column} {i}'] = slot
+    df = pd.concat([df, pd.DataFrame(wide, index=df.index)], axis=1)
+
+    for mapped_column, column in PARENT_SET_COLUMNS.items():
+        present = contacts[column].notna().to_numpy()
+        values = contacts[column].to_numpy(dtype=object)[present].astype(str)
+        df[mapped_column] = sets_from_long(contact_rows[present], np.char.lower(values).astype(object) if len(values) else values, len(df), index=df.index)
+    return df
+
+
+def _open(source):
+    if urllib.parse.urlsplit(source).scheme in ('http', 'https'):
+        return urllib.request.urlopen(source)
+    return open(source, 'rb')
+
+
+def _read_feed(source):
+    with _open(source) as f:
+        return pupils_frame(iter_pupils(f))
+
+
+def read_isams_feed(source, cache_dir=CACHE_DIR):
+    """Pupils of an iSAMS XML feed, given as a file path or an http(s) URL of the batch API (with
+    its apiKey parameter), as one row per pupil. Saved feeds go through the ingest cache."""
+    if urllib.parse.urlsplit(source).scheme in ('http', 'https'):
+        return _read_feed(source)
+    return cached_read(source, _read_feed, cache_dir=cache_dir)
@@ -0,0 +1,241 @@
+import difflib
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# Third matching round: proposes pairs between the students left over after the key matching
+# (see MatchIndex).
+# Students are only compared within blocks that share one of these keys, so the number of
+# candidate pairs follows the block sizes instead of |iSAMS leftovers| x |OA leftovers|.
+BLOCKING_KEYS = [
+    ['dob'],
+    ['surname_key', 'grade'],
+    ['forename_key', 'grade'],
+    ['surname_key', 'birth_year'],
+]
+# Blocks producing more pairs than this are too unspecific to be useful and are skipped
+MAX_BLOCK_PAIRS = 5000
+NAME_WEIGHT = 0.6
+DOB_WEIGHT = 0.3
+GRADE_WEIGHT = 0.1
+MIN_SCORE = 0.6
+MAX_PROPOSALS = 3
+
+SOUNDEX_CODES = str.maketrans('bfpvcgjkqsxzdtlmnr', '111122222222334556')
+
+MATCH_COLUMNS = [
+    'Note', 'Score', 'Name Score',
+    'iSAMS School Code', 'iSAMS Forename', 'iSAMS Surname', 'iSAMS Date of Birth', 'iSAMS Year (NC)',
+    'OA Student ID', 'OA First Name', 'OA Last Name', 'OA Birth Date', 'OA Grade', 'OA Student Status',
+]
+
+
+def normalise_name(name):
+    """Lowercase ASCII letters and single spaces only, so accents and punctuation do not count."""
+    if not isinstance(name, str):
+        return ''
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+    return ' '.join(re.sub(r'[^a-z]+', ' ', name).split())
+
+
+def soundex(name):
+    """American Soundex code of a name (e.g. 'Robert' -> 'r163'), NaN for an empty name."""
+    letters = normalise_name(name).replace(' ', '')
+    if not letters:
+        return np.nan
+    codes = letters.translate(SOUNDEX_CODES)
+    key, last = letters[0], codes[0]
+    for letter, code in zip(letters[1:], codes[1:]):
+        if code.isdigit() and code != last:
+            key += code
+        if letter not in 'hw':
+            last = code
+    return (key + '000')[:4]
+
+
+def _keys(forenames, surnames, dobs):
+    dobs = pd.to_datetime(pd.Series(dobs).reset_index(drop=True))
+    return pd.DataFrame({
+        'row': np.arange(len(dobs)),
+        'forename_key': pd.Series(forenames).reset_index(drop=True).map(soundex),
+        'surname_key': pd.Series(surnames).reset_index(drop=True).map(soundex),
+        'dob': dobs,
+        'birth_year': dobs.dt.year,
+    })
+
+
+def blocking_frames(leftover_isams, leftover_oa):
+    """Blocking keys of every leftover row (row = position in its frame). OA rows appear once per
+    mapped grade, since one OA grade can map to several iSAMS years."""
+    isams_keys = _keys(leftover_isams['isams_Forename'], leftover_isams['isams_Surname'], leftover_isams['isams_Date of Birth'])
+    isams_keys['grade'] = leftover_isams['isams_Year (NC)'].to_numpy()
+
+    oa_keys = _keys(leftover_oa['oa_First Name'], leftover_oa['oa_Last Name'], leftover_oa['oa_Birth Date'])
+    oa_keys['grade'] = leftover_oa['oa_Grade_mapped'].to_numpy()
+    oa_keys = oa_keys.explode('grade', ignore_index=True).infer_objects()
+    return isams_keys, oa_keys
+
+
+def candidate_pairs(isams_keys, oa_keys):
+    """Distinct (row_isams, row_oa) pairs sharing at least one blocking key."""
+    pairs = [pd.DataFrame({'row_isams': [], 'row_oa': []}, dtype=int)]
+    for key in BLOCKING_KEYS:
+        left = isams_keys.dropna(subset=key)[['row'] + key].drop_duplicates()
+        right = oa_keys.dropna(subset=key)[['row'] + key].drop_duplicates()
+        sizes = left.groupby(key).size().rename('isams').reset_index().merge(
+            right.groupby(key).size().rename('oa').reset_index(), on=key)
+        usable = sizes.loc[sizes['isams'] * sizes['oa'] <= MAX_BLOCK_PAIRS, key]
+        block = left.merge(usable, on=key).merge(right, on=key, suffixes=('_isams', '_oa'))
+        pairs.append(block[['row_isams', 'row_oa']])
+    return pd.concat(pairs, ignore_index=True).drop_duplicates(ignore_index=True)
+
+
+def name_similarity(isams_names, oa_names, needed):
+    """difflib ratio of the normalised full names, also trying the OA name with first and last
+    name swapped. Pairs that cannot reach the needed ratio are left at 0 after difflib's cheap
+    upper bounds, and the iSAMS name is only indexed once for all its candidates."""
+    scores = np.zeros(len(isams_names))
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    current = None
+    for k in np.argsort(isams_names, kind='stable'):
+        if isams_names[k] != current:
+            current = isams_names[k]
+            matcher.set_seq2(current)
+        first, last = oa_names[k]
+        for candidate in (f'{first} {last}', f'{last} {first}'):
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() >= needed[k] and matcher.quick_ratio() >= needed[k]:
+                scores[k] = max(scores[k], matcher.ratio())
+    return scores
+
+
+def propose_matches(leftover_isams, leftover_oa):
+    """Proposes OA students for the students found in iSAMS only, scored by name similarity, date
+    of birth and grade. Returns the Possible Matches sheet, best proposals first."""
+    if leftover_isams.empty or leftover_oa.empty:
+        return pd.DataFrame(columns=MATCH_COLUMNS)
+
+    isams_keys, oa_keys = blocking_frames(leftover_isams, leftover_oa)
+    pairs = candidate_pairs(isams_keys, oa_keys)
+    i, o = pairs['row_isams'].to_numpy(), pairs['row_oa'].to_numpy()
+
+    isams_dob = isams_keys['dob'].to_numpy()[i]
+    oa_dob = leftover_oa['oa_Birth Date'].pipe(pd.to_datetime).to_numpy()[o]
+    isams_dates, oa_dates = pd.DatetimeIndex(isams_dob), pd.DatetimeIndex(oa_dob)
+    same_dob = isams_dob == oa_dob
+    # Day and month swapped is a common data entry mistake
+    swapped_dob = (isams_dates.year == oa_dates.year) & (isams_dates.month == oa_dates.day) & (isams_dates.day == oa_dates.month) & ~same_dob
+    dob_score = np.where(same_dob, 1.0, np.where(swapped_dob, 0.5, 0.0))
+
+    grades = pairs.assign(grade=isams_keys['grade'].to_numpy()[i]).merge(
+        oa_keys[['row', 'grade']].dropna().drop_duplicates().rename(columns={'row': 'row_oa'}),
+        on=['row_oa', 'grade'], how='left', indicator=True,
+    )
+    same_grade = (grades['_merge'] == 'both').to_numpy()
+
+    isams_names = (leftover_isams['isams_Forename'].map(normalise_name) + ' ' + leftover_isams['isams_Surname'].map(normalise_name)).to_numpy()[i]
+    oa_first = leftover_oa['oa_First Name'].map(normalise_name).to_numpy()[o]
+    oa_last = leftover_oa['oa_Last Name'].map(normalise_name).to_numpy()[o]
+    needed = (MIN_SCORE - DOB_WEIGHT * dob_score - GRADE_WEIGHT * same_grade) / NAME_WEIGHT
+    name_score = name_similarity(isams_names, list(zip(oa_first, oa_last)), needed)
+
+    score = NAME_WEIGHT * name_score + DOB_WEIGHT * dob_score + GRADE_WEIGHT * same_grade
+    proposals = pd.DataFrame({
+        'row_isams': i, 'row_oa': o, 'score': score, 'Score': score.round(2), 'Name Score': name_score.round(2),
+        'same_dob': same_dob, 'swapped_dob': swapped_dob, 'same_grade': same_grade,
+    })
+    proposals = proposals[proposals['score'] >= MIN_SCORE]
+    proposals = proposals.sort_values(['score', 'row_isams', 'row_oa'], ascending=[False, True, True], kind='stable')
+    proposals = proposals[proposals.groupby('row_isams').cumcount() < MAX_PROPOSALS].reset_index(drop=True)
+
+    note = pd.Series('Possible match', index=proposals.index)
+    note = note.str.cat(np.where(proposals['same_dob'], ', Same date of birth', ''))
+    note = note.str.cat(np.where(proposals['swapped_dob'], ', Day and month of birth swapped', ''))
+    note = note.str.cat(np.where(proposals['same_grade'], ', Same grade', ''))
+
+    isams_rows = leftover_isams.iloc[proposals['row_isams']].reset_index(drop=True)
+    oa_rows = leftover_oa.iloc[proposals['row_oa']].reset_index(drop=True)
+    matches = pd.DataFrame({
+        'Note': note,
+        'Score': proposals['Score'],
+        'Name Score': proposals['Name Score'],
+        'iSAMS School Code': isams_rows['isams_School Code'],
+        'iSAMS Forename': isams_rows['isams_Forename'],
+        'iSAMS Surname': isams_rows['isams_Surname'],
+        'iSAMS Date of Birth': pd.to_datetime(isams_rows['isams_Date of Birth']),
+        'iSAMS Year (NC)': isams_rows['isams_Year (NC)'],
+        'OA Student ID': oa_rows['oa_Student ID'],
+        'OA First Name': oa_rows['oa_First Name'],
+        'OA Last Name': oa_rows['oa_Last Name'],
+        'OA Birth Date': pd.to_datetime(oa_rows['oa_Birth Date']),
+        'OA Grade': oa_rows['oa_Grade'],
+        'OA Student Status': oa_rows['oa_Student Status'],
+    })
+    return matches[MATCH_COLUMNS]
+
+
+# First and second matching rounds: iSAMS students are paired with the OA students sharing a match
+# key, tier of OA students by tier (see MATCH_TIERS). Key -> (iSAMS columns, OA columns); names
+# are compared normalised and dates by day. There is no email key: iSAMS pupil emails are not read
+# (see sync.schema).
+MATCH_KEYS = {
+    'id': (['isams_School Code'], ['oa_Student ID']),
+    'name_dob': (['isams_Forename', 'isams_Surname', 'isams_Date of Birth'], ['oa_First Name', 'oa_Last Name', 'oa_Birth Date']),
+}
+DEFAULT_MATCH_KEYS = ('id',)
+# (tier, OA statuses of the tier or None for every student left, Note of its pairs), matched in
+# order. The unmatched students of the first tier are the ones reported as not in iSAMS.
+MATCH_TIERS = (
+    ('enrolled', ('Enrolled',), ''),
+    ('others', None, 'Enrolled in iSAMS; Not Enrolled in OA'),
+)
+MATCH_KEY_COLUMN = 'Match Key'
+
+
+def match_key_values(frame, columns):
+    """The value of a key for every row, NaN where a part of it is missing."""
+    if len(columns) == 1:
+        return frame[columns[0]].to_numpy(dtype=object)
+    parts = []
+    for column in columns:
+        values = frame[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            parts.append(values.dt.strftime('%Y-%m-%d'))
+        else:
+            parts.append(values.map(normalise_name).replace('', np.nan))
+    return parts[0].str.cat(parts[1:], sep='|').to_numpy(dtype=object)
+
+
+class MatchIndex:
+    """Hash index of the match keys over both sides. Every key is factorised once over the iSAMS
+    and the OA values together, so matching a tier is a join of integer codes restricted to the
+    students still unmatched, and a student paired once is never paired again."""
+
+    def __init__(self, isams, oa, keys=DEFAULT_MATCH_KEYS):
+        self.keys = tuple(keys)
+        self.codes = {}
+        for key in self.keys:
+            isams_columns, oa_columns = MATCH_KEYS[key]
+            codes, _ = pd.factorize(np.concatenate([match_key_values(isams, isams_columns), match_key_values(oa, oa_columns)]))
+            self.codes[key] = (codes[:len(isams)], codes[len(isams):])
+        self.isams_matched = np.zeros(len(isams), dtype=bool)
+        self.oa_matched = np.zeros(len(oa), dtype=bool)
+
+    def match(self, oa_rows):
+        """Pairs the unmatched iSAMS students with the unmatched OA students of oa_rows (a boolean
+        mask), trying the keys in order. Students sharing a key value are all paired with each
+        other, as a merge pairs them. Returns the (isams, oa, key) positions in iSAMS order."""
+        pairs = [pd.DataFrame({'isams': [], 'oa': [], 'key': []}).astype({'isams': int, 'oa': int, 'key': object})]
+        for key in self.keys:
+            isams_codes, oa_codes = self.codes[key]
+            isams_rows = np.flatnonzero(~self.isams_matched & (isams_codes >= 0))
+            oa_candidates = np.flatnonzero(oa_rows & ~self.oa_matched & (oa_codes >= 0))
+            found = pd.DataFrame({'code': isams_codes[isams_rows], 'isams': isams_rows}).merge(
+                pd.DataFrame({'code': oa_codes[oa_candidates], 'oa': oa_candidates}), on='code')
+            self.isams_matched[found['isams'].to_numpy()] = True
+            self.oa_matched[found['oa'].to_numpy()] = True
+            pairs.append(found[['isams', 'oa']].assign(key=key))
+        pairs = pd.concat(pairs, ignore_index=True)
+        return pairs.iloc[np.argsort(pairs['isams'].to_numpy(), kind='stable')].reset_index(drop=True)
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from sync.sets import sets_from_long
+
+NATIONALITY_SLOTS = 4
+
+
+def normalise_nationality(values):
+    """Casefolds and collapses the whitespace of nationality titles, so that ' british', 'British'
+    and 'BRITISH ' look the same."""
+    return pd.Series(values, dtype=object).str.strip().str.replace(r'\s+', ' ', regex=True).str.casefold()
+
+
+def nationality_lookup(mapping_df):
+    """Normalised nationality -> ISO code, from the Title and ISO columns of the mapping file.
+
+    The ISO codes themselves, and the ';'-separated names of an optional Aliases column, are accepted
+    as well; a title always wins over an alias that normalises to the same text. A title whose code
+    is missing (e.g. Namibia's 'NA', read as NaN) stays unmapped, as before.
+    """
+    aliases = pd.DataFrame({'name': mapping_df['ISO'], 'ISO': mapping_df['ISO']}).dropna()
+    if 'Aliases' in mapping_df:
+        extra = mapping_df[['Aliases', 'ISO']].dropna()
+        extra = extra.assign(name=extra['Aliases'].str.split(';')).explode('name')[['name', 'ISO']]
+        aliases = pd.concat([aliases, extra], ignore_index=True)
+    titles = mapping_df[['Title', 'ISO']].rename(columns={'Title': 'name'})
+    lookup = pd.concat([aliases, titles], ignore_index=True)
+    lookup['name'] = normalise_nationality(lookup['name'])
+    # Later rows win, as with set_index(...).to_dict(): titles override aliases, the last title
+    # overrides earlier duplicates
+    lookup = lookup[lookup['name'].notna() & (lookup['name'] != '')].drop_duplicates('name', keep='last')
+    return dict(zip(lookup['name'], lookup['ISO']))
+
+
+def pack_nationalities(frame):
+    """Moves the non-empty values of every row of frame to the left, in the 'Nationality <i>'
+    columns (at least NATIONALITY_SLOTS of them)."""
+    values = frame.set_axis(range(frame.shape[1]), axis=1).stack()
+    values = values.droplevel(1).to_frame('value')
+    values['slot'] = values.groupby(level=0).cumcount() + 1
+    packed = values.set_index('slot', append=True)['value'].unstack('slot').reindex(frame.index)
+    packed = packed.reindex(columns=range(1, max(NATIONALITY_SLOTS, packed.shape[1]) + 1))
+    packed.columns = [f'Nationality {i}' for i in packed.columns]
+    return packed.astype(object)
+
+
+def map_nationalities(nationality_columns, nationality_mapping):
+    """Maps the 'Nationality <i>' columns through the lookup in one pass over their distinct values.
+
+    Adds 'Nationality <i>_mapped' for the first NATIONALITY_SLOTS columns and returns them with
+    Nationality_mapped, the distinct codes of each row as a set column (see sync.sets).
+    """
+    columns = [f'Nationality {i}' for i in range(1, NATIONALITY_SLOTS + 1)]
+    for column in columns:
+        if column not in nationality_columns.columns:
+            nationality_columns[column] = np.nan
+    codes, uniques = pd.factorize(nationality_columns[columns].to_numpy().ravel())
+    # The trailing NaN is what the code -1 of empty cells picks
+    mapped_uniques = np.append(normalise_nationality(uniques).map(nationality_mapping).to_numpy(dtype=object), np.nan)
+    mapped = mapped_uniques[codes].reshape(len(nationality_columns), len(columns))
+    for k, column in enumerate(columns):
+        nationality_columns[f'{column}_mapped'] = pd.Series(mapped[:, k], index=nationality_columns.index, dtype=object)
+
+    rows = np.repeat(np.arange(len(nationality_columns)), len(columns))
+    present = pd.notna(mapped.ravel())
+    sets = sets_from_long(rows[present], mapped.ravel()[present], len(nationality_columns), index=nationality_columns.index)
+    return nationality_columns, sets
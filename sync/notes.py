@@ -0,0 +1,218 @@
+import numpy as np
+import pandas as pd
+
+# Checked in this order, which is also the order of the fragments in the Note
+NOTE_COMPARISONS = {
+    'is_same_id': ('iSAMS School Code', 'OA Student ID'),
+    'is_same_email': ('iSAMS Pupil Email Address', 'OA Email'),
+    'is_same_first_name': ('iSAMS Forename', 'OA First Name'),
+    'is_same_last_name': ('iSAMS Surname', 'OA Last Name'),
+    'is_same_middle_name': ('iSAMS Middle Names', 'OA Middle Name(s)'),
+    'is_same_preferred_name': ('iSAMS Preferred Name', 'OA Preferred Names'),
+    'is_same_grade_year': ('iSAMS Year (NC)', 'OA Grade_mapped'),
+    'is_same_date_of_birth': ('iSAMS Date of Birth', 'OA Birth Date'),
+}
+
+# Conflict category of each comparison; the grade has no conflict sheet of its own
+COMPARISON_CATEGORIES = {
+    'is_same_id': 'ID',
+    'is_same_email': 'Email',
+    'is_same_first_name': 'Name',
+    'is_same_last_name': 'Name',
+    'is_same_middle_name': 'Name',
+    'is_same_preferred_name': 'Name',
+    'is_same_grade_year': 'Grade',
+    'is_same_date_of_birth': 'DOB',
+}
+
+# (attribute flag, OA column suffix, iSAMS column prefix, note)
+PARENT_NOTES = [
+    ('parent_email', 'Email', 'Primary Contact Email', 'Conflict Parent Email'),
+    ('parent_first_name', 'First Name', 'Primary Contact Forename', 'Conflict Parent First Name'),
+    ('parent_last_name', 'Last Name', 'Primary Contact Surname', 'Conflict Parent Last Name'),
+    ('parent_relationship', 'Relationship', 'Relation Type', 'Conflict Parent Relationship'),
+]
+
+# Check of each parent attribute flag; first and last names are one check
+PARENT_CHECKS = {
+    'parent_email': 'parent_email',
+    'parent_first_name': 'parent_name',
+    'parent_last_name': 'parent_name',
+    'parent_relationship': 'parent_relationship',
+}
+
+# Bit of every check in the Conflicts mask of a student. not_in_isams and not_in_oa mark the
+# students found on one side only; they are set by the merge, not by a conflict fact
+CONFLICT_BITS = {check: 1 << bit for bit, check in enumerate([
+    'id', 'email', 'first_name', 'middle_name', 'last_name', 'preferred_name', 'grade_year',
+    'date_of_birth', 'nationality', 'parent_name', 'parent_email', 'parent_relationship',
+    'parent_missing_in_isams', 'parent_missing_in_oa', 'not_in_isams', 'not_in_oa',
+])}
+
+FACT_COLUMNS = ['row', 'check', 'category', 'field', 'side', 'iSAMS value', 'OA value', 'note', 'listed']
+
+
+def friendly_name(comparison):
+    return comparison.replace('is_same_', '').replace('_', ' ').title()
+
+
+def _is_false(df, column):
+    """True where the flag is exactly False; missing flags (rows without a match) are never False."""
+    if column not in df:
+        return np.zeros(len(df), dtype=bool)
+    return (df[column] == False).to_numpy(dtype=bool, na_value=False)  # noqa: E712
+
+
+def _is_missing(df, column):
+    """Like pd.isna, but a list cell (e.g. OA Grade_mapped) is missing when it only holds empty values."""
+    if column not in df:
+        return np.ones(len(df), dtype=bool)
+    values = df[column].reset_index(drop=True)
+    is_list = values.map(type).eq(list).to_numpy()
+    missing = values.isna().to_numpy()
+    if is_list.any():
+        exploded = values[is_list].explode()
+        missing[is_list] = ~exploded.notna().groupby(level=0).any().reindex(values.index[is_list]).to_numpy()
+    return missing
+
+
+def _not_in(df, value_column, list_column):
+    """True where value_column holds a string that is not an element of the list in list_column."""
+    values = df[value_column].reset_index(drop=True)
+    is_str = values.map(type).eq(str).to_numpy()
+    lists = df[list_column].reset_index(drop=True)
+    lists = lists.where(lists.map(type).eq(list), None).explode().dropna()
+    pairs = pd.MultiIndex.from_arrays([lists.index, lists.to_numpy()])
+    found = pd.MultiIndex.from_arrays([values.index, values.to_numpy()]).isin(pairs)
+    return is_str & ~found
+
+
+def _fact_masks(df, max_i):
+    """Yields (mask, check, category, field, side, iSAMS column, OA column, note, listed) for every
+    kind of conflict, in the order their notes appear in the Note."""
+    for comparison, (col1, col2) in NOTE_COMPARISONS.items():
+        failed = _is_false(df, comparison)
+        missing1 = _is_missing(df, col1)
+        missing2 = _is_missing(df, col2) & ~missing1
+        name = friendly_name(comparison)
+        category = COMPARISON_CATEGORIES[comparison]
+        check = comparison.replace('is_same_', '')
+        yield failed & missing1, check, category, name, 'iSAMS', col1, col2, f'Missing {name} in {col1.split()[0]}', True
+        yield failed & missing2, check, category, name, 'OA', col1, col2, f'Missing {name} in {col2.split()[0]}', True
+        yield failed & ~missing1 & ~missing2, check, category, name, 'both', col1, col2, f'Conflict {name}', True
+
+    for i in range(1, 5):
+        oa_column, isams_column = f'OA Nationality {i}', f'iSAMS Nationality {i}'
+        conflict = _is_false(df, f'is_same_nationality_{i}_from_oa') & ~_is_missing(df, oa_column)
+        yield conflict, 'nationality', 'Nationality', f'Nationality {i}', 'OA', None, oa_column, 'Conflict Nationality', True
+        conflict = _is_false(df, f'is_same_nationality_{i}_from_isams') & ~_is_missing(df, isams_column)
+        yield conflict, 'nationality', 'Nationality', f'Nationality {i}', 'iSAMS', isams_column, None, 'Conflict Nationality', True
+
+    # A parent whose email is missing on the other side only gets the missing note; its other
+    # conflicts are still listed on the Parent sheet
+    for i in range(1, 5):
+        email_column = f'OA Parent/Guardian {i} - Email'
+        missing_parent = _not_in(df, email_column, 'iSAMS Parent_email_mapped')
+        yield missing_parent, 'parent_missing_in_isams', 'Parent', f'Parent {i}', 'OA', None, email_column, f'Parent {i} from OA is missing in iSAMS', False
+        for flag, oa_suffix, _, note in PARENT_NOTES:
+            oa_column = f'OA Parent/Guardian {i} - {oa_suffix}'
+            conflict = _is_false(df, f'is_same_{flag}_{i}_from_oa') & ~_is_missing(df, oa_column)
+            yield conflict & ~missing_parent, PARENT_CHECKS[flag], 'Parent', f'Parent {i} {oa_suffix}', 'OA', None, oa_column, note, True
+            yield conflict & missing_parent, PARENT_CHECKS[flag], 'Parent', f'Parent {i} {oa_suffix}', 'OA', None, oa_column, None, True
+
+    for i in range(1, max_i + 1):
+        email_column = f'iSAMS Primary Contact Email {i}'
+        missing_parent = _not_in(df, email_column, 'OA Parent_email_mapped')
+        yield missing_parent, 'parent_missing_in_oa', 'Parent', f'Parent {i}', 'iSAMS', email_column, None, f'Parent {i} from iSAMS is missing in OA', False
+        for flag, oa_suffix, isams_prefix, note in PARENT_NOTES:
+            isams_column = f'iSAMS {isams_prefix} {i}'
+            conflict = _is_false(df, f'is_same_{flag}_{i}_from_isams') & ~_is_missing(df, isams_column)
+            yield conflict & ~missing_parent, PARENT_CHECKS[flag], 'Parent', f'Parent {i} {oa_suffix}', 'iSAMS', isams_column, None, note, True
+            yield conflict & missing_parent, PARENT_CHECKS[flag], 'Parent', f'Parent {i} {oa_suffix}', 'iSAMS', isams_column, None, None, True
+
+
+def conflict_facts(df, max_i):
+    """Long table of every conflict the comparison flags of df describe, one row per student row
+    and conflicting field, in the order of the Note:
+
+    - row: position of the student row in df
+    - check: the check that failed, one of CONFLICT_BITS
+    - category: ID, Email, Name, Grade, DOB, Nationality or Parent
+    - field: the compared field, e.g. 'First Name', 'Nationality 2' or 'Parent 1 Email'
+    - side: where the value is missing ('iSAMS' or 'OA') or 'both' when the two differ; for
+      nationalities and parents, the side whose value was not found on the other
+    - iSAMS value, OA value: the compared values
+    - note: the Note fragment of the fact (missing when the fragment is left out, see below)
+    - listed: whether the fact lists its row on the conflict sheet of its category
+
+    The flags and columns of df are read once here; the Note and the conflict sheets are built
+    from this table.
+    """
+    parts = []
+    for mask, check, category, field, side, isams_column, oa_column, note, listed in _fact_masks(df, max_i):
+        rows = np.flatnonzero(mask)
+        if not len(rows):
+            continue
+        parts.append(pd.DataFrame({
+            'row': rows, 'check': check, 'category': category, 'field': field, 'side': side,
+            'iSAMS value': df[isams_column].to_numpy(dtype=object)[rows] if isams_column else None,
+            'OA value': df[oa_column].to_numpy(dtype=object)[rows] if oa_column else None,
+            'note': note, 'listed': listed,
+        }))
+    if not parts:
+        facts = pd.DataFrame({column: pd.Series(dtype=object) for column in FACT_COLUMNS})
+        facts = facts.astype({'row': int, 'listed': bool})
+    else:
+        facts = pd.concat(parts, ignore_index=True)
+    return facts.astype({column: 'category' for column in ('check', 'category', 'field', 'side', 'note')})
+
+
+def conflict_mask(facts, n_rows):
+    """Conflicts bitmask (see CONFLICT_BITS) of each of the n_rows rows the facts describe; 0 for
+    rows without conflicts."""
+    mask = np.zeros(n_rows, dtype=np.int32)
+    bits = facts['check'].map(CONFLICT_BITS).to_numpy(dtype=np.int32)
+    np.bitwise_or.at(mask, facts['row'].to_numpy(dtype=int), bits)
+    return mask
+
+
+def note_fragments(facts, rows=None):
+    """The Note fragments of the facts as a (row, note) table, ordered by row and by their place in
+    the Note, each fragment once per row. rows limits it to those row positions."""
+    fragments = facts.loc[facts['note'].notna(), ['row', 'note']]
+    if rows is not None:
+        fragments = fragments[np.isin(fragments['row'].to_numpy(), rows)]
+    # The sort is stable, so the fragments of a row keep the order of the facts
+    fragments = fragments.iloc[np.argsort(fragments['row'].to_numpy(), kind='stable')]
+    return fragments.drop_duplicates().reset_index(drop=True)
+
+
+def join_fragments(fragments, rows):
+    """', '-joined fragments of each of the row positions ('' for rows without any). The fragments
+    have to be ordered by row, as note_fragments returns them."""
+    positions = fragments['row'].to_numpy(dtype=int)
+    texts = fragments['note'].astype(object).tolist()
+    starts = np.flatnonzero(np.r_[True, positions[1:] != positions[:-1]]) if len(positions) else np.array([], dtype=int)
+    bounds = np.r_[starts, len(positions)].tolist()
+    joined = pd.Series([', '.join(texts[a:b]) for a, b in zip(bounds[:-1], bounds[1:])], index=positions[starts], dtype=object)
+    return joined.reindex(rows, fill_value='').to_numpy(dtype=object)
+
+
+def build_notes(df, facts, rows=None):
+    """Builds the Note column of df from its conflict facts: the Note df already has (how the
+    student was merged), followed by the note of every fact of the row. rows limits the work to
+    those row positions; the other rows keep their Note.
+    """
+    notes = df['Note'].reset_index(drop=True)
+    rows = np.arange(len(df)) if rows is None else np.asarray(rows, dtype=int)
+    merge_notes = notes.iloc[rows]
+    merge_notes = pd.DataFrame({'row': rows, 'note': merge_notes.to_numpy()})[merge_notes.notna().to_numpy() & merge_notes.ne('').to_numpy()]
+    fragments = pd.concat([merge_notes, note_fragments(facts, rows)], ignore_index=True)
+    fragments = fragments.iloc[np.argsort(fragments['row'].to_numpy(), kind='stable')].drop_duplicates()
+
+    built = notes.to_numpy(dtype=object).copy()
+    built[rows] = join_fragments(fragments, rows)
+    built = pd.Series(built, index=df.index)
+    # Notes flagged with 'Only' are final and kept as they are
+    keep = df['Note'].str.contains('Only', na=False, regex=False)
+    return built.where(~keep, df['Note'])
@@ -0,0 +1,216 @@
+import asyncio
+import concurrent.futures
+import http.client
+import json
+import threading
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+from sync.cache import typed_like_excel
+
+# Reads students and their parents from the OpenApply v3 REST API into the layout of the manual
+# OA export, so that preprocess_oa takes either. Pages are fetched concurrently over a small pool
+# of keep-alive connections.
+API_PATH = '/api/v3'
+TOKEN_PATH = '/oauth/token'
+DEFAULT_CONNECTIONS = 8
+DEFAULT_PER_PAGE = 100
+TIMEOUT_SECONDS = 60
+MAX_RETRIES = 4
+# Seconds before the first retry; doubled for every further one unless the server sends Retry-After
+BACKOFF_SECONDS = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# OA export column -> field of an OpenApply student record
+STUDENT_FIELDS = {
+    'Student Status': 'status',
+    'OpenApply ID': 'id',
+    'Student ID': 'student_id',
+    'Email': 'email',
+    'First Name': 'first_name',
+    'Middle Name(s)': 'other_name',
+    'Last Name': 'last_name',
+    'Gender': 'gender',
+    'Birth Date': 'birth_date',
+    'Language': 'language',
+    'Nationality': 'nationality',
+    'Second Nationality': 'second_nationality',
+    'Third Nationality': 'third_nationality',
+    'Home Address - Country': 'country',
+    'Grade': 'grade',
+}
+# 'Parent/Guardian <i> - <field>' column -> field of an OpenApply parent record
+PARENT_FIELDS = {
+    'Parent ID': 'parent_id',
+    'Parent OpenApply ID': 'id',
+    'First Name': 'first_name',
+    'Last Name': 'last_name',
+    'Email': 'email',
+    'Relationship': 'relationship',
+}
+PARENT_SLOTS = 4
+# IDs are numbers in the Excel export unless a school uses text codes
+NUMERIC_COLUMNS = ['Student ID', 'OpenApply ID', 'Parent ID', 'Parent OpenApply ID']
+
+
+class OpenApplyError(Exception):
+    pass
+
+
+class OpenApplyClient:
+    """Pages through /api/v3/students with at most `connections` requests in flight, each thread of
+    the pool keeping its own keep-alive connection. Failed requests (connection errors, 429 and
+    5xx) are retried MAX_RETRIES times with exponential backoff.
+
+    Authenticates with a bearer token, or with client credentials exchanged for one.
+    """
+
+    def __init__(self, base_url, token=None, client_id=None, client_secret=None, connections=DEFAULT_CONNECTIONS, per_page=DEFAULT_PER_PAGE):
+        self.url = urllib.parse.urlsplit(base_url.rstrip('/'))
+        if self.url.scheme not in ('http', 'https') or not self.url.netloc:
+            raise ValueError(f'Not an OpenApply URL: {base_url!r}')
+        if token is None and not (client_id and client_secret):
+            raise ValueError('OpenApply needs a token or a client ID and secret')
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.connections = connections
+        self.per_page = per_page
+        self._local = threading.local()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            cls = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+            connection = cls(self.url.netloc, timeout=TIMEOUT_SECONDS)
+            self._local.connection = connection
+            with self._lock:
+                self._opened.append(connection)
+        return connection
+
+    def _send(self, method, target, body=None, headers=None):
+        """One blocking request on the calling thread's connection: (status, Retry-After, body)."""
+        connection = self._connection()
+        try:
+            connection.request(method, target, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.getheader('Retry-After'), response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnect on the next request of this thread
+            connection.close()
+            raise
+
+    async def _request(self, executor, method, path, params=None, body=None, headers=None):
+        loop = asyncio.get_running_loop()
+        target = self.url.path + path + (f'?{urllib.parse.urlencode(params)}' if params else '')
+        for attempt in range(MAX_RETRIES + 1):
+            retry_after = None
+            try:
+                status, retry_after, content = await loop.run_in_executor(executor, self._send, method, target, body, headers)
+            except (OSError, http.client.HTTPException) as e:
+                error = OpenApplyError(f'{method} {target}: {e}')
+            else:
+                if status == 200:
+                    return json.loads(content)
+                error = OpenApplyError(f'{method} {target}: HTTP {status}')
+                if status not in RETRY_STATUSES:
+                    raise error
+            if attempt < MAX_RETRIES:
+                await asyncio.sleep(_retry_delay(retry_after, attempt))
+        raise error
+
+    async def _authorize(self, executor):
+        if self.token is None:
+            body = urllib.parse.urlencode({
+                'grant_type': 'client_credentials', 'client_id': self.client_id, 'client_secret': self.client_secret,
+            })
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+            self.token = (await self._request(executor, 'POST', TOKEN_PATH, body=body, headers=headers))['access_token']
+        return {'Authorization': f'Bearer {self.token}', 'Accept': 'application/json'}
+
+    async def _fetch(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.connections) as executor:
+            headers = await self._authorize(executor)
+
+            def page(number):
+                params = {'page': number, 'per_page': self.per_page}
+                return self._request(executor, 'GET', f'{API_PATH}/students', params=params, headers=headers)
+
+            # The first page tells how many there are; the others are fetched together
+            first = await page(1)
+            pages = [first] + list(await asyncio.gather(*(page(n) for n in range(2, _page_count(first) + 1))))
+        students = [student for response in pages for student in response.get('students', [])]
+        parents = [parent for response in pages for parent in response.get('linked', {}).get('parents', [])]
+        return students, parents
+
+    def fetch(self):
+        """(student records, parent records) of every page."""
+        try:
+            return asyncio.run(self._fetch())
+        finally:
+            for connection in self._opened:
+                connection.close()
+            self._opened.clear()
+
+
+def _retry_delay(retry_after, attempt):
+    try:
+        return max(float(retry_after), 0.0)
+    except (TypeError, ValueError):
+        return BACKOFF_SECONDS * 2 ** attempt
+
+
+def _page_count(response):
+    meta = response.get('meta') or {}
+    return int(meta.get('pages') or 1)
+
+
+def oa_frame(students, parents, base_url=''):
+    """One row per student in the columns of the OA export (see STUDENT_FIELDS), the first
+    PARENT_SLOTS parents of each student (in the order of its parent_ids) side by side."""
+    records = pd.DataFrame.from_records(students, columns=[*STUDENT_FIELDS.values(), 'parent_ids'])
+    oa = pd.DataFrame({column: records[field].to_numpy(dtype=object) for column, field in STUDENT_FIELDS.items()})
+    oa.insert(oa.columns.get_loc('OpenApply ID') + 1, 'OpenApply URL', [
+        f'{base_url}/admin/students/{openapply_id}' if pd.notna(openapply_id) else np.nan for openapply_id in oa['OpenApply ID']
+    ])
+
+    # A link is a parent ID, or {'id': ..., 'relationship': ...} when the relationship depends on
+    # the student (the same parent can be 'Father' of one child and 'Stepfather' of another)
+    links = records['parent_ids'].explode().dropna()
+    is_link = links.map(type).eq(dict).to_numpy()
+    links = pd.DataFrame({
+        'parent': [link.get('id') if is_dict else link for link, is_dict in zip(links, is_link)],
+        'link_relationship': [link.get('relationship') if is_dict else None for link, is_dict in zip(links, is_link)],
+    }, index=links.index)
+    links['slot'] = links.groupby(level=0).cumcount() + 1
+    links = links[links['slot'] <= PARENT_SLOTS]
+    parents = pd.DataFrame.from_records(parents, columns=list(PARENT_FIELDS.values())).drop_duplicates('id')
+    links = links.reset_index().merge(parents, left_on='parent', right_on='id', how='inner')
+    links['relationship'] = links['link_relationship'].where(links['link_relationship'].notna(), links['relationship'])
+    for i in range(1, PARENT_SLOTS + 1):
+        slot = links[links['slot'] == i].set_index('index')
+        for column, field in PARENT_FIELDS.items():
+            oa[f'Parent/Guardian {i} - {column}'] = slot[field].reindex(oa.index).to_numpy(dtype=object)
+
+    # Empty fields are missing, as blank cells of the export are
+    oa = oa.replace('', np.nan)
+    # The API sends statuses in lower case ('enrolled'); the export capitalises them
+    oa['Student Status'] = oa['Student Status'].map(lambda status: status.replace('_', ' ').capitalize() if isinstance(status, str) else status)
+    oa['Birth Date'] = pd.to_datetime(oa['Birth Date'], format='%Y-%m-%d', errors='coerce')
+    for column in oa.columns:
+        if column in NUMERIC_COLUMNS or column.rsplit(' - ', 1)[-1] in NUMERIC_COLUMNS:
+            oa[column] = typed_like_excel(oa[column])
+    return oa
+
+
+def fetch_oa(base_url, token=None, client_id=None, client_secret=None, connections=DEFAULT_CONNECTIONS, per_page=DEFAULT_PER_PAGE):
+    """The school's students as the OA export frame, read from the OpenApply API at base_url
+    (e.g. https://<school>.openapply.com)."""
+    client = OpenApplyClient(base_url, token=token, client_id=client_id, client_secret=client_secret, connections=connections, per_page=per_page)
+    students, parents = client.fetch()
+    return oa_frame(students, parents, base_url=client.base_url)
@@ -0,0 +1,744 @@
+import os
+import re
+from datetime import datetime as dt
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from sync.cache import CACHE_DIR, cached_read
+from sync.comparison import OA_PARENT_SLOTS, add_comparison_columns, add_parents_comparison_columns
+from sync.contacts import CONTACT_TEMPLATES, add_family_index, combine_codes, contact_codes
+from sync.export import header_fills, write_sheet
+from sync.formats import DEFAULT_FORMATS, MACHINE_FORMATS, check_formats, write_tables
+from sync.incremental import compare_incrementally, load_snapshot, save_snapshot, snapshot_context, snapshot_path
+from sync.isams import CONTACT_FIELDS, PARENT_SET_COLUMNS, read_isams_feed
+from sync.matching import DEFAULT_MATCH_KEYS, MATCH_KEY_COLUMN, MATCH_TIERS, MatchIndex, propose_matches
+from sync.nationality import map_nationalities, nationality_lookup, pack_nationalities
+from sync.notes import CONFLICT_BITS, build_notes, conflict_facts, conflict_mask, join_fragments, note_fragments
+from sync.openapply import fetch_oa
+from sync.profiling import RunProfile, shape, stage
+from sync.schema import read_isams_export, read_oa_export, typed_isams, typed_oa
+from sync.sets import set_column, set_lists, sets_from_long
+
+NATIONALITY_FILE = 'CrossReferenceMapping - Nationality - Country.csv'
+
+
+def load_nationality_mapping(nationality_file=NATIONALITY_FILE, cache_dir=CACHE_DIR):
+    """Normalised nationality title -> ISO code (see sync.nationality). Shared by every school."""
+    nationality_country_mapping_df = cached_read(nationality_file, pd.read_csv, cache_dir=cache_dir)
+    return nationality_lookup(nationality_country_mapping_df)
+
+
+def load_data(school_name, data_dir='.', cache_dir=CACHE_DIR, oa_api=None, isams_feed=None):
+    """Reads the OA and iSAMS exports and the grade mapping of a school from data_dir. With oa_api,
+    the keyword arguments of sync.openapply.fetch_oa, OA students come from the OpenApply API
+    instead of the OA export. With isams_feed, a path or URL of an iSAMS XML feed, iSAMS pupils
+    come from the feed instead of the iSAMS export."""
+    oa_file = os.path.join(data_dir, f'OA ({school_name}).xlsx')
+    isams_file = os.path.join(data_dir, f'iSAMS ({school_name}).xlsx')
+    grade_year_file = os.path.join(data_dir, f'grade_year_mapping ({school_name}).csv')
+
+    # Every source is typed by sync.schema; the exports are cached typed, with only the columns read
+    oa_df = cached_read(oa_file, read_oa_export, cache_dir=cache_dir) if oa_api is None else typed_oa(fetch_oa(**oa_api))
+    isams_df = cached_read(isams_file, read_isams_export, cache_dir=cache_dir) if isams_feed is None else typed_isams(read_isams_feed(isams_feed, cache_dir=cache_dir))
+    grade_year_mapping_dict = cached_read(grade_year_file, pd.read_csv, cache_dir=cache_dir).groupby('Grade')['Year (NC)'].apply(list).to_dict()
+    grade_year_mapping_dict = {k: v[0] if len(v) == 1 else v for k, v in grade_year_mapping_dict.items()}
+
+    return oa_df, isams_df, grade_year_mapping_dict
+
+
+CONTACT_COLUMNS = list(CONTACT_FIELDS)
+
+
+def flatten_contacts(isams):
+    """Puts the contacts of every student's iSAMS rows side by side: one row per Id with the columns
+    '<contact column> <i>', i being the position of the row within the student. Returns the wide
+    frame (indexed by Id) and the largest i."""
+    rows = isams[isams['Id'].notna()]
+    slot = rows.groupby('Id').cumcount().add(1).rename('slot')
+    flattened_df = rows.set_index(['Id', slot])[CONTACT_COLUMNS].astype(object).unstack('slot')
+    flattened_df.columns = [f'{column} {i}' for column, i in flattened_df.columns]
+    return flattened_df, slot.max()
+
+
+def contact_sets(isams, column, ids):
+    """The distinct lowercased values of one contact column per student, as a set column (see
+    sync.sets) aligned with ids."""
+    values = isams[['Id', column]].dropna()
+    rows = pd.Index(ids).get_indexer(values['Id'])
+    return sets_from_long(rows[rows >= 0], values[column].astype(str).str.lower().to_numpy()[rows >= 0], len(ids), index=ids.index)
+
+
+def slot_sets(df, columns):
+    """The distinct lowercased values of several columns per row, as a set column."""
+    rows, values = [], []
+    for column in columns:
+        present = df[column].notna().to_numpy()
+        rows.append(np.flatnonzero(present))
+        values.append(df[column].to_numpy()[present])
+    values = pd.Series(np.concatenate(values), dtype=object).astype(str).str.lower().to_numpy()
+    return sets_from_long(np.concatenate(rows), values, len(df), index=df.index)
+
+
+def grade_years(grade, grade_mapping):
+    years = grade_mapping.get(grade)
+    return tuple(years) if isinstance(years, list) else (years,)
+
+
+def preprocess_isams(isams, nationality_mapping):
+    """isams is the export, one row per contact, or the pupils of the iSAMS feed, which
+    sync.isams already reads as one row per pupil with their contacts numbered."""
+    if 'Id' in isams:
+        merged_df_copy = isams
+        max_i = sum(column.startswith(f'{CONTACT_COLUMNS[0]} ') for column in isams.columns)
+    else:
+        isams['Id'] = isams['Forename'] + isams['Surname']    
+        flattened_df, max_i = flatten_contacts(isams)
+        pupil_columns = [c for c in isams.columns if c not in CONTACT_COLUMNS]
+        merged_df_copy = isams[pupil_columns].drop_duplicates(subset='Id', keep='first')
+        merged_df_copy = merged_df_copy.merge(flattened_df, on='Id', how='inner').reset_index(drop=True)
+        for mapped_col, column in PARENT_SET_COLUMNS.items():
+            merged_df_copy[mapped_col] = contact_sets(isams, column, merged_df_copy['Id'])
+
+    nationality_columns = merged_df_copy['Nationality'].str.split(r',\s*', expand=True)
+    nationality_columns = nationality_columns.rename(columns={i: f'Nationality {i+1}' for i in range(nationality_columns.shape[1])})
+    nationality_columns, nationality_sets = map_nationalities(nationality_columns, nationality_mapping)
+    merged_df_copy = merged_df_copy.join(nationality_columns)
+    merged_df_copy['Nationality_mapped'] = nationality_sets
+    add_family_index(merged_df_copy, 'isams', max_i)
+    return merged_df_copy, max_i
+
+
+def preprocess_oa(oa,nationality_mapping, grade_mapping):
+    oa['Grade_mapped'] = set_column(oa['Grade'].map(lambda x: grade_years(x, grade_mapping)).to_numpy(), index=oa.index)
+    oa['Parent_first_name_mapped'] = slot_sets(oa, ['Parent/Guardian 1 - First Name', 'Parent/Guardian 2 - First Name', 'Parent/Guardian 3 - First Name', 'Parent/Guardian 4 - First Name'])
+    oa['Parent_last_name_mapped'] = slot_sets(oa, ['Parent/Guardian 1 - Last Name', 'Parent/Guardian 2 - Last Name', 'Parent/Guardian 3 - Last Name', 'Parent/Guardian 4 - Last Name'])
+    oa['Parent_email_mapped'] = slot_sets(oa, ['Parent/Guardian 1 - Email', 'Parent/Guardian 2 - Email', 'Parent/Guardian 3 - Email', 'Parent/Guardian 4 - Email'])
+    oa['Parent_relationship_mapped'] = slot_sets(oa, ['Parent/Guardian 1 - Relationship', 'Parent/Guardian 2 - Relationship', 'Parent/Guardian 3 - Relationship', 'Parent/Guardian 4 - Relationship'])
+    nationality_columns = pack_nationalities(oa[['Nationality', 'Second Nationality', 'Third Nationality']])
+    nationality_columns, nationality_sets = map_nationalities(nationality_columns, nationality_mapping)
+    oa = oa.join(nationality_columns)
+    oa['Nationality_mapped'] = nationality_sets
+    add_family_index(oa, 'oa', OA_PARENT_SLOTS)
+    return oa
+
+
+def merge_students(isams_df_copy, oa_df_copy, profile=None, match_keys=DEFAULT_MATCH_KEYS):
+    """Matches iSAMS students with OA's enrolled students first, then with the remaining OA students
+    (see sync.matching.MATCH_TIERS), on the match keys in order of priority. The key that paired
+    each matched student is kept in MATCH_KEY_COLUMN."""
+    index = MatchIndex(isams_df_copy, oa_df_copy, match_keys)
+    statuses = oa_df_copy['oa_Student Status']
+    left = np.ones(len(oa_df_copy), dtype=bool)
+    parts = []
+    for tier, tier_statuses, note in MATCH_TIERS:
+        with stage(profile, f'merge_{tier}') as record:
+            in_tier = left & (statuses.isin(tier_statuses).to_numpy() if tier_statuses is not None else True)
+            left &= ~in_tier
+            pairs = index.match(in_tier)
+            part = pd.concat([
+                isams_df_copy.iloc[pairs['isams']].reset_index(drop=True),
+                oa_df_copy.iloc[pairs['oa']].reset_index(drop=True),
+            ], axis=1)
+            part['Note'] = note
+            part[MATCH_KEY_COLUMN] = pairs['key'].to_numpy()
+            record.update(shape(part))
+        if not parts:
+            first_tier = in_tier
+        parts.append(part)
+
+    merged_df = pd.concat(parts, ignore_index=True)
+    leftover_isams = isams_df_copy[~index.isams_matched].reset_index(drop=True)
+    leftover_oa = oa_df_copy[first_tier & ~index.oa_matched].reset_index(drop=True)
+    leftover_oa['Note'] = 'Student not in iSAMS'
+    leftover_isams['Note'] = 'Student not in OA'
+    return merged_df, leftover_isams, leftover_oa
+
+
+def export_columns(max_i):
+    """Column order of the All Comparison sheet (before the oa_/isams_ prefixes are renamed)."""
+    new_order = [
+        'Note',
+        'isams_School Code', 'isams_Pupil Email Address', 'isams_Date of Birth',
+        'isams_Forename', 'isams_Middle Names', 'isams_Surname', 'isams_Preferred Name',
+        'isams_Year (NC)', 'isams_Gender',
+        'isams_Nationality 1', 'isams_Nationality 2',
+        'isams_Nationality 3', 'isams_Nationality 4',
+    ]
+
+    # Dynamically add 'Primary Contact' entries based on max_i
+    for i in range(1, max_i + 1):
+        new_order.extend([
+            f'isams_Primary Contact Forename {i}', f'isams_Primary Contact Surname {i}',
+            f'isams_Primary Contact Email {i}', f'isams_Relation Type {i}',
+        ])
+    new_order.extend([
+        'oa_Student Status', 'oa_Student ID', 'oa_Email', 'oa_Birth Date',
+        'oa_First Name', 'oa_Middle Name(s)', 'oa_Last Name', 'oa_Preferred Names',
+        'oa_Grade', 'oa_Gender',
+
+        'oa_Nationality 1', 'oa_Nationality 2',
+        'oa_Nationality 3', 'oa_Nationality 4',
+
+        'oa_Parent/Guardian 1 - First Name', 'oa_Parent/Guardian 1 - Last Name',
+        'oa_Parent/Guardian 1 - Email', 'oa_Parent/Guardian 1 - Relationship',
+
+        'oa_Parent/Guardian 2 - First Name', 'oa_Parent/Guardian 2 - Last Name',
+        'oa_Parent/Guardian 2 - Email', 'oa_Parent/Guardian 2 - Relationship',
+
+        'oa_Parent/Guardian 3 - First Name', 'oa_Parent/Guardian 3 - Last Name',
+        'oa_Parent/Guardian 3 - Email', 'oa_Parent/Guardian 3 - Relationship',
+
+        'oa_Parent/Guardian 4 - First Name', 'oa_Parent/Guardian 4 - Last Name',
+        'oa_Parent/Guardian 4 - Email', 'oa_Parent/Guardian 4 - Relationship',
+
+        'isams_Address Type', 'isams_Country', 'isams_Language',
+        'isams_Nationality', 'isams_Id', 
+
+        'isams_Parent_first_name_mapped', 'isams_Parent_last_name_mapped',
+        'isams_Parent_email_mapped', 'isams_Parent_relation_mapped',
+        'isams_Nationality 1_mapped', 'isams_Nationality 2_mapped',
+        'isams_Nationality 3_mapped', 'isams_Nationality 4_mapped',
+        'isams_Nationality_mapped',
+
+        'oa_OpenApply ID', 'oa_OpenApply URL',
+        'oa_Nationality', 'oa_Second Nationality', 'oa_Third Nationality', 
+        'oa_Parent/Guardian 1 - Parent OpenApply ID', 'oa_Parent/Guardian 2 - Parent OpenApply ID',
+        'oa_Parent/Guardian 3 - Parent OpenApply ID', 'oa_Parent/Guardian 4 - Parent OpenApply ID',
+        'oa_Grade_mapped', 'oa_Parent_first_name_mapped', 'oa_Parent_last_name_mapped',
+        'oa_Parent_email_mapped', 'oa_Parent_relationship_mapped', 'oa_Nationality 1_mapped',
+        'oa_Nationality 2_mapped', 'oa_Nationality 3_mapped',
+        'oa_Nationality 4_mapped', 'oa_Nationality_mapped', 
+        'is_same_id', 'is_same_first_name', 'is_same_last_name', 'is_same_preferred_name',
+        'is_same_middle_name', 'is_same_grade_year', 'is_same_date_of_birth', 'is_same_email',
+        'is_same_nationality_1_from_oa', 'is_same_nationality_2_from_oa',
+        'is_same_nationality_3_from_oa', 'is_same_nationality_4_from_oa',
+        'is_same_nationality_1_from_isams', 'is_same_nationality_2_from_isams',
+        'is_same_nationality_3_from_isams', 'is_same_nationality_4_from_isams',
+        'is_same_parent_first_name_1_from_oa', 'is_same_parent_first_name_2_from_oa',
+        'is_same_parent_first_name_3_from_oa', 'is_same_parent_first_name_4_from_oa'
+    ])
+
+    for i in range(1, max_i + 1):
+        new_order.extend([
+            f'is_same_parent_first_name_{i}_from_isams',
+        ])
+
+    new_order.extend([
+        'is_same_parent_last_name_1_from_oa', 'is_same_parent_last_name_2_from_oa',
+        'is_same_parent_last_name_3_from_oa', 'is_same_parent_last_name_4_from_oa',
+    ])
+
+    for i in range(1, max_i + 1):
+        new_order.extend([
+            f'is_same_parent_last_name_{i}_from_isams',
+        ])
+
+    new_order.extend([
+        'is_same_parent_email_1_from_oa', 'is_same_parent_email_2_from_oa',
+        'is_same_parent_email_3_from_oa', 'is_same_parent_email_4_from_oa',
+    ])
+
+    for i in range(1, max_i + 1):
+        new_order.extend([
+            f'is_same_parent_email_{i}_from_isams',
+        ])
+
+    new_order.extend([
+        'is_same_parent_relationship_1_from_oa', 'is_same_parent_relationship_2_from_oa',
+        'is_same_parent_relationship_3_from_oa', 'is_same_parent_relationship_4_from_oa',
+    ])
+
+    for i in range(1, max_i + 1):
+        new_order.extend([
+            f'is_same_parent_relationship_{i}_from_isams',
+        ])
+    new_order.append(MATCH_KEY_COLUMN)
+    return new_order
+
+
+def hidden_export_columns(max_i):
+    """Columns of the All Comparison sheet that are written but hidden."""
+    columns_to_hide = [
+            'iSAMS Address Type', 'iSAMS Country', 'iSAMS Language',
+            'iSAMS Nationality', 'iSAMS Id', 
+
+            'iSAMS Parent_first_name_mapped', 'iSAMS Parent_last_name_mapped',
+            'iSAMS Parent_email_mapped', 'iSAMS Parent_relation_mapped',
+            'iSAMS Nationality 1_mapped', 'iSAMS Nationality 2_mapped',
+            'iSAMS Nationality 3_mapped', 'iSAMS Nationality 4_mapped',
+            'iSAMS Nationality_mapped',
+
+            'OA OpenApply ID', 'OA OpenApply URL', 
+            'OA Nationality', 'OA Second Nationality', 'OA Third Nationality', 
+            'OA Parent/Guardian 1 - Parent OpenApply ID', 'OA Parent/Guardian 2 - Parent OpenApply ID',
+            'OA Parent/Guardian 3 - Parent OpenApply ID', 'OA Parent/Guardian 4 - Parent OpenApply ID',
+            'OA Grade_mapped', 'OA Parent_first_name_mapped', 'OA Parent_last_name_mapped',
+            'OA Parent_email_mapped', 'OA Parent_relationship_mapped', 'OA Nationality 1_mapped',
+            'OA Nationality 2_mapped', 'OA Nationality 3_mapped',
+            'OA Nationality 4_mapped', 'OA Nationality_mapped', 
+            'is_same_id', 'is_same_first_name', 'is_same_last_name', 'is_same_preferred_name',
+            'is_same_middle_name', 'is_same_grade_year', 'is_same_date_of_birth', 'is_same_email',
+            'is_same_nationality_1_from_oa', 'is_same_nationality_2_from_oa',
+            'is_same_nationality_3_from_oa', 'is_same_nationality_4_from_oa',
+            'is_same_nationality_1_from_isams', 'is_same_nationality_2_from_isams',
+            'is_same_nationality_3_from_isams', 'is_same_nationality_4_from_isams',
+            'is_same_parent_first_name_1_from_oa', 'is_same_parent_first_name_2_from_oa',
+            'is_same_parent_first_name_3_from_oa', 'is_same_parent_first_name_4_from_oa',
+            'is_same_parent_last_name_1_from_oa', 'is_same_parent_last_name_2_from_oa',
+            'is_same_parent_last_name_3_from_oa', 'is_same_parent_last_name_4_from_oa',
+            'is_same_parent_email_1_from_oa', 'is_same_parent_email_2_from_oa',
+            'is_same_parent_email_3_from_oa', 'is_same_parent_email_4_from_oa',
+            'is_same_parent_relationship_1_from_oa', 'is_same_parent_relationship_2_from_oa',
+            'is_same_parent_relationship_3_from_oa', 'is_same_parent_relationship_4_from_oa',
+    ]
+
+    for i in range(1, max_i + 1):
+        columns_to_hide.extend([
+            f'is_same_parent_first_name_{i}_from_isams', f'is_same_parent_last_name_{i}_from_isams',
+            f'is_same_parent_email_{i}_from_isams', f'is_same_parent_relationship_{i}_from_isams',
+        ])
+    columns_to_hide.extend([MATCH_KEY_COLUMN, 'Conflicts'])
+    return columns_to_hide
+
+
+# Low-cardinality text columns of the export frame, held as categoricals (without the iSAMS/OA prefix)
+CATEGORY_COLUMNS = {
+    'Gender', 'Grade', 'Student Status', 'Nationality', 'Second Nationality', 'Third Nationality',
+    'Nationality 1', 'Nationality 2', 'Nationality 3', 'Nationality 4', 'Language', 'Country',
+    'Address Type', 'Home Address - Country', 'Language at Home',
+}
+CATEGORY_PATTERN = re.compile(r'^(Relation Type \d+|Parent/Guardian \d+ - Relationship)$')
+# Set columns (see sync.sets), written as lists
+SET_COLUMNS = {*PARENT_SET_COLUMNS, 'Parent_relationship_mapped', 'Grade_mapped', 'Nationality_mapped'}
+
+
+def compact_dtypes(df):
+    """Shrinks the export frame in place: repetitive text columns become categoricals and the
+    comparison flags nullable booleans (NA where a side is missing). The written values do not
+    change."""
+    for column in df.columns:
+        name = re.sub(r'^(iSAMS|OA) ', '', column)
+        if column.startswith('is_same_'):
+            df[column] = df[column].astype('boolean')
+        elif (name in CATEGORY_COLUMNS or CATEGORY_PATTERN.match(name)) and df[column].dtype == object:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def build_export_frame(merged_df_copy, leftover_isams, leftover_oa, max_i, known_notes=None, notes=True):
+    """Returns the export frame and its conflict facts (see sync.notes.conflict_facts). The last
+    column, Conflicts, holds the bitmask of the failed checks of every row (see
+    sync.notes.CONFLICT_BITS).
+
+    known_notes holds the Note of matched rows carried over from an incremental snapshot (None
+    where it has to be built); only the other rows go through build_notes. Without notes, the Note
+    only tells how each student was merged, for runs that just count the conflicts."""
+    columns = export_columns(max_i)
+    # Only the exported columns of each part are concatenated; the result is not copied again
+    parts = [df[[c for c in columns if c in df.columns]] for df in (merged_df_copy, leftover_isams, leftover_oa)]
+    export_df_copy = pd.concat(parts, axis=0, ignore_index=True).reindex(columns=columns, copy=False)
+    export_df_copy.columns = [c.replace('oa_', 'OA ').replace('isams_', 'iSAMS ') for c in columns]
+    for column in export_df_copy.columns:
+        if re.sub(r'^(iSAMS|OA) ', '', column) in SET_COLUMNS:
+            export_df_copy[column] = set_lists(export_df_copy[column])
+    compact_dtypes(export_df_copy)
+    # Dates stay typed; the workbook shows them as text (see sync.export)
+    export_df_copy['OA Birth Date'] = pd.to_datetime(export_df_copy['OA Birth Date'])
+    export_df_copy['iSAMS Date of Birth'] = pd.to_datetime(export_df_copy['iSAMS Date of Birth'])
+    facts = conflict_facts(export_df_copy, max_i)
+    if notes and known_notes is None:
+        export_df_copy['Note'] = build_notes(export_df_copy, facts)
+    elif notes:
+        # Matched rows come first in export_df
+        known = np.full(len(export_df_copy), None, dtype=object)
+        known[:len(known_notes)] = known_notes
+        rebuild = pd.isna(known)
+        built = build_notes(export_df_copy, facts, rows=np.flatnonzero(rebuild))
+        export_df_copy['Note'] = built.where(rebuild, known)
+    conflicts = conflict_mask(facts, len(export_df_copy))
+    # A student found on one side only has no parents on the other side either: the Note still
+    # says so, but the parent-missing checks only count for matched students
+    conflicts[len(merged_df_copy):] &= ~(CONFLICT_BITS['parent_missing_in_isams'] | CONFLICT_BITS['parent_missing_in_oa'])
+    # Students of leftover_isams follow the matched ones, then those of leftover_oa
+    one_sided = len(merged_df_copy) + len(leftover_isams)
+    conflicts[len(merged_df_copy):one_sided] |= CONFLICT_BITS['not_in_oa']
+    conflicts[one_sided:] |= CONFLICT_BITS['not_in_isams']
+    export_df_copy['Conflicts'] = conflicts
+    return export_df_copy, facts
+
+
+# Conflict sheets: (category of the facts that list a row on the sheet, word a Note fragment has to
+# contain to be shown on the sheet)
+CONFLICT_SHEETS = {
+    'ID Conflict': ('ID', 'ID'),
+    'Email Conflict': ('Email', 'Email'),
+    'DOB Conflict': ('DOB', 'Birth'),
+    'Name Conflict': ('Name', 'Name'),
+    'Nationality Conflict': ('Nationality', 'Nationality'),
+    'Parent Conflict': ('Parent', 'Parent'),
+}
+
+
+def conflict_sheet_columns(max_i):
+    """Columns of every conflict sheet, keyed by sheet name."""
+    columns_parent_conflict = ['Note', 'iSAMS School Code', 'iSAMS Pupil Email Address',]
+    for i in range(1, max_i + 1):
+        columns_parent_conflict.extend([
+            f'iSAMS Primary Contact Forename {i}', f'iSAMS Primary Contact Surname {i}',
+            f'iSAMS Primary Contact Email {i}', f'iSAMS Relation Type {i}',
+        ])
+    columns_parent_conflict.extend(['OA Student ID', 'OA Email',])
+    for i in range(1, 5):
+        columns_parent_conflict.extend([
+            f'OA Parent/Guardian {i} - First Name', f'OA Parent/Guardian {i} - Last Name',
+            f'OA Parent/Guardian {i} - Email', f'OA Parent/Guardian {i} - Relationship',
+        ])
+    for i in range(1, max_i + 1):
+        columns_parent_conflict.extend([
+            f'is_same_parent_first_name_{i}_from_isams',
+            f'is_same_parent_last_name_{i}_from_isams',
+            f'is_same_parent_email_{i}_from_isams',
+            f'is_same_parent_relationship_{i}_from_isams',
+        ])
+    for i in range(1, 5):
+        columns_parent_conflict.extend([
+            f'is_same_parent_first_name_{i}_from_oa',
+            f'is_same_parent_last_name_{i}_from_oa',
+            f'is_same_parent_email_{i}_from_oa',
+            f'is_same_parent_relationship_{i}_from_oa',
+        ])
+    return {
+        'ID Conflict': ['Note', 'iSAMS School Code', 'OA Student ID', 'is_same_id'],
+        'Email Conflict': ['Note', 'iSAMS Pupil Email Address', 'OA Email', 'is_same_email'],
+        'DOB Conflict': [
+            'Note',
+            'iSAMS School Code', 'iSAMS Pupil Email Address', 'iSAMS Date of Birth',
+            'OA Student ID', 'OA Email', 'OA Birth Date',
+            'is_same_date_of_birth'],
+        'Name Conflict': [
+            'Note',
+            'iSAMS School Code', 'iSAMS Pupil Email Address',
+            'iSAMS Forename', 'iSAMS Middle Names', 'iSAMS Surname', 'iSAMS Preferred Name',
+            'OA Student ID', 'OA Email',
+            'OA First Name', 'OA Middle Name(s)', 'OA Last Name', 'OA Preferred Names',
+            'is_same_first_name', 'is_same_middle_name', 'is_same_last_name', 'is_same_preferred_name'],
+        'Nationality Conflict': [
+            'Note',
+            'iSAMS School Code', 'iSAMS Pupil Email Address',
+            'iSAMS Nationality 1', 'iSAMS Nationality 2', 'iSAMS Nationality 3', 'iSAMS Nationality 4',
+            'OA Student ID', 'OA Email',
+            'OA Nationality 1', 'OA Nationality 2', 'OA Nationality 3', 'OA Nationality 4',
+            'is_same_nationality_1_from_isams', 'is_same_nationality_2_from_isams',
+            'is_same_nationality_3_from_isams', 'is_same_nationality_4_from_isams',
+            'is_same_nationality_1_from_oa', 'is_same_nationality_2_from_oa',
+            'is_same_nationality_3_from_oa', 'is_same_nationality_4_from_oa'],
+        'Parent Conflict': columns_parent_conflict,
+    }
+
+
+def build_conflict_sheets(export_df_copy, facts, max_i):
+    """Builds the frames of the per-category conflict sheets, keyed by sheet name, from the conflict
+    facts of export_df_copy (see sync.notes.conflict_facts).
+
+    A sheet lists the rows with a listed fact of its category, and its Note keeps the fragments of
+    the row's Note that contain the sheet's word (e.g. 'Conflict Parent Email' is shown on both
+    the Email and the Parent sheet). Only the listed rows of export_df_copy are read.
+    """
+    listed = facts.loc[facts['listed'].to_numpy(dtype=bool), ['category', 'row']]
+    rows = {category: np.unique(group['row'].to_numpy()) for category, group in listed.groupby('category', observed=True)}
+    fragments = note_fragments(facts)
+    texts = fragments['note'].cat.categories
+    codes = fragments['note'].cat.codes.to_numpy()
+
+    sheets = {}
+    for sheet_name, columns in conflict_sheet_columns(max_i).items():
+        category, word = CONFLICT_SHEETS[sheet_name]
+        sheet_rows = rows.get(category, np.array([], dtype=int))
+        sheet = export_df_copy.iloc[sheet_rows, export_df_copy.columns.get_indexer(columns)].reset_index(drop=True)
+        shown = np.array([word in text for text in texts], dtype=bool)[codes]
+        sheet['Note'] = join_fragments(fragments[shown & np.isin(fragments['row'].to_numpy(), sheet_rows)], sheet_rows)
+        sheets[sheet_name] = sheet
+    return sheets
+
+
+# Columns of the conflict summary: the label of every check of the Conflicts bitmask
+CONFLICT_SUMMARY_COLUMNS = {
+    'not_in_isams': 'Not in iSAMS',
+    'not_in_oa': 'Not in OA',
+    'id': 'ID',
+    'email': 'Email',
+    'first_name': 'First Name',
+    'middle_name': 'Middle Name',
+    'last_name': 'Last Name',
+    'preferred_name': 'Preferred Name',
+    'grade_year': 'Grade Year',
+    'date_of_birth': 'DOB',
+    'nationality': 'Nationality',
+    'parent_name': 'Parent Name',
+    'parent_email': 'Parent Email',
+    'parent_relationship': 'Parent Relationship',
+    'parent_missing_in_isams': 'Parent Missing in iSAMS',
+    'parent_missing_in_oa': 'Parent Missing in OA',
+}
+
+
+def build_conflict_summary(export_df_copy):
+    """Number of students, of students with any conflict and of students failing each check, by
+    OA grade and student status. Students found in iSAMS only have neither and are counted
+    together."""
+    conflicts = export_df_copy['Conflicts'].to_numpy()
+    counts = pd.DataFrame({
+        'Students': np.ones(len(conflicts), dtype=int),
+        'With Conflicts': conflicts != 0,
+        **{label: (conflicts & CONFLICT_BITS[check]) != 0 for check, label in CONFLICT_SUMMARY_COLUMNS.items()},
+    })
+    keys = [
+        export_df_copy['OA Grade'].astype(object).rename('Grade').reset_index(drop=True),
+        export_df_copy['OA Student Status'].astype(object).rename('Student Status').reset_index(drop=True),
+    ]
+    summary = counts.groupby(keys, dropna=False, sort=False).sum().reset_index()
+    return summary.sort_values(['Grade', 'Student Status'], na_position='last', ignore_index=True)
+
+
+def conflict_counts(export_df_copy, matched):
+    """Totals of the conflict summary as a JSON-ready dict: the students, the matched ones (the
+    first matched rows of export_df_copy), those found on one side only, those with any conflict
+    and the matched students failing each check."""
+    conflicts = export_df_copy['Conflicts'].to_numpy()
+    # Only matched students are compared, so only they can fail a check
+    compared = conflicts[:matched]
+    return {
+        'students': len(conflicts),
+        'matched': int(matched),
+        'not_in_oa': int(((conflicts & CONFLICT_BITS['not_in_oa']) != 0).sum()),
+        'not_in_isams': int(((conflicts & CONFLICT_BITS['not_in_isams']) != 0).sum()),
+        'with_conflicts': int((conflicts != 0).sum()),
+        'conflicts': {
+            check: int(((compared & CONFLICT_BITS[check]) != 0).sum())
+            for check in CONFLICT_SUMMARY_COLUMNS if check not in ('not_in_isams', 'not_in_oa')
+        },
+    }
+
+
+# Columns of the Parent Contacts sheet: the parent's values, then their students
+PARENT_CONTACT_FIELDS = ['First Name', 'Last Name', 'Email', 'Relationship']
+
+
+def _student_id(isams_code, oa_id):
+    value = oa_id if pd.notna(oa_id) else isams_code
+    return str(int(value)) if isinstance(value, float) and value.is_integer() else str(value)
+
+
+def build_parent_contacts(export_df_copy, facts):
+    """One row per parent with a conflict, from the parent facts of the matched students (see
+    sync.notes.conflict_facts): the side the parent was read from, their values, the number and
+    the IDs of the students they conflict for, and the checks that failed. Parents are the
+    contacts of sync.contacts, so the parents siblings share are listed once."""
+    columns = ['Side', *PARENT_CONTACT_FIELDS, 'Students', 'Student IDs', 'Conflicts']
+    one_sided = CONFLICT_BITS['not_in_isams'] | CONFLICT_BITS['not_in_oa']
+    matched = (export_df_copy['Conflicts'].to_numpy() & one_sided) == 0
+    parent = facts[(facts['category'] == 'Parent').to_numpy() & matched[facts['row'].to_numpy(dtype=int)]]
+    slots = parent['field'].astype(str).str.extract(r'^Parent (\d+)', expand=False).astype(int).to_numpy()
+
+    parts = []
+    for side, prefix in (('iSAMS', 'isams'), ('OA', 'oa')):
+        for i in np.unique(slots[(parent['side'] == side).to_numpy()]):
+            rows = parent.loc[(parent['side'] == side).to_numpy() & (slots == i), ['row', 'check']]
+            part = pd.DataFrame({'Side': side, 'row': rows['row'].to_numpy(dtype=int), 'check': rows['check'].astype(object).to_numpy()})
+            for field, template in zip(PARENT_CONTACT_FIELDS, CONTACT_TEMPLATES[prefix]):
+                part[field] = export_df_copy[f'{side} {template.format(i=i)}'].to_numpy(dtype=object)[part['row'].to_numpy()]
+            parts.append(part)
+    if not parts:
+        return pd.DataFrame({column: pd.Series(dtype=object) for column in columns})
+    contacts = pd.concat(parts, ignore_index=True)
+    contacts['contact'] = combine_codes(
+        pd.factorize(contacts['Side'])[0],
+        contact_codes(contacts['First Name'], contacts['Last Name'], contacts['Email']),
+    )
+
+    sheet = contacts.drop_duplicates('contact').set_index('contact')[['Side', *PARENT_CONTACT_FIELDS]]
+    students = contacts[['contact', 'row']].drop_duplicates()
+    ids = [
+        _student_id(isams_code, oa_id) for isams_code, oa_id in zip(
+            export_df_copy['iSAMS School Code'].to_numpy(dtype=object)[students['row'].to_numpy()],
+            export_df_copy['OA Student ID'].to_numpy(dtype=object)[students['row'].to_numpy()],
+        )
+    ]
+    sheet['Students'] = students.groupby('contact').size()
+    sheet['Student IDs'] = pd.Series(ids, index=students['contact'].to_numpy()).groupby(level=0).agg(', '.join)
+    # The checks of a parent in the order of CONFLICT_BITS, without the 'Parent ' of their label
+    checks = contacts[['contact', 'check']].drop_duplicates()
+    checks = checks.iloc[np.argsort(checks['check'].map(CONFLICT_BITS).to_numpy(), kind='stable')]
+    labels = checks['check'].map(CONFLICT_SUMMARY_COLUMNS).str.replace('Parent ', '', regex=False)
+    sheet['Conflicts'] = labels.groupby(checks['contact'].to_numpy()).agg(', '.join)
+    sheet = sheet.sort_values(['Students', 'Side', 'Last Name', 'First Name'], ascending=[False, True, True, True], kind='stable')
+    return sheet.reset_index(drop=True)[columns]
+
+
+def write_workbook(path, export_df_copy, conflict_sheets, max_i, possible_matches=None, summary=None, parent_contacts=None, profile=None):
+    """Writes the analysis workbook: All Comparison, the conflict sheets, the parents with
+    conflicts, the proposed matches between students found on one side only and the conflict
+    summary."""
+    oa_student_id_idx = export_df_copy.columns.get_loc('OA Student ID')  # Get the index of 'OA Student ID' column
+
+    # Write-only workbook: every sheet is streamed to disk as its rows are produced
+    workbook = openpyxl.Workbook(write_only=True)
+    write_sheet(
+        workbook, export_df_copy, 'All Comparison', max_i, profile=profile,
+        fills=header_fills(orange=range(2, oa_student_id_idx), blue=range(oa_student_id_idx, len(export_df_copy.columns) + 1)),
+        hidden_columns=export_df_copy.columns.get_indexer(hidden_export_columns(max_i)) + 1,  # +1 because Excel is 1-indexed
+        fill_rows=True, hide_empty_notes=True,
+    )
+    write_sheet(
+        workbook, conflict_sheets['ID Conflict'], 'ID Conflict', max_i, profile=profile,
+        fills=header_fills(orange=[2], blue=[3]), hidden_columns=[4],
+    )
+    write_sheet(
+        workbook, conflict_sheets['Email Conflict'], 'Email Conflict', max_i, profile=profile,
+        fills=header_fills(orange=[2], blue=[3]), hidden_columns=[4],
+    )
+    write_sheet(
+        workbook, conflict_sheets['DOB Conflict'], 'DOB Conflict', max_i, profile=profile,
+        fills=header_fills(orange=range(2, 5), blue=range(5, 8)), hidden_columns=[8],
+    )
+    write_sheet(
+        workbook, conflict_sheets['Name Conflict'], 'Name Conflict', max_i, profile=profile,
+        fills=header_fills(orange=range(2, 8), blue=range(8, 14)), hidden_columns=range(14, 18),
+    )
+    write_sheet(
+        workbook, conflict_sheets['Nationality Conflict'], 'Nationality Conflict', max_i, profile=profile,
+        fills=header_fills(orange=range(2, 8), blue=range(8, 14)), hidden_columns=range(14, 22),
+    )
+
+    # Calculate the number of columns to fill based on the formula and fill them
+    num_columns_to_fill = 2 + (max_i * 4) + 1
+    num_columns_to_fill1 = 2 + (4 * 4) + 1
+    write_sheet(
+        workbook, conflict_sheets['Parent Conflict'], 'Parent Conflict', max_i, profile=profile,
+        fills=header_fills(
+            orange=range(2, num_columns_to_fill + 1),
+            blue=range(num_columns_to_fill + 1, num_columns_to_fill + num_columns_to_fill1),
+        ),
+        hidden_columns=range(num_columns_to_fill + num_columns_to_fill1, len(conflict_sheets['Parent Conflict'].columns) + 1),
+    )
+    if parent_contacts is not None:
+        write_sheet(workbook, parent_contacts, 'Parent Contacts', max_i, profile=profile)
+    if possible_matches is not None:
+        oa_student_id_idx = possible_matches.columns.get_loc('OA Student ID') + 1
+        write_sheet(
+            workbook, possible_matches, 'Possible Matches', max_i, profile=profile,
+            fills=header_fills(orange=range(4, oa_student_id_idx), blue=range(oa_student_id_idx, len(possible_matches.columns) + 1)),
+        )
+    if summary is not None:
+        write_sheet(workbook, summary, 'Conflict Summary', max_i, profile=profile)
+    with stage(profile, 'save_workbook'):
+        workbook.save(path)
+
+
+def sync_school(school_name, nationality_mapping=None, data_dir='.', output_dir=None, cache_dir=CACHE_DIR, snapshot_dir=None, profile=False, deep_profile=False, formats=DEFAULT_FORMATS, match_keys=DEFAULT_MATCH_KEYS, oa_api=None, isams_feed=None, summary_only=False, snapshot_by_school=False):
+    """Runs the whole iSAMS-OA comparison for one school and returns the path of the analysis workbook.
+
+    nationality_mapping can be passed in when it is shared by several schools; it is loaded from the
+    current directory otherwise. With a snapshot_dir, only students that changed since the previous
+    run are compared again (see sync.incremental). With profile, the timing and memory of every
+    stage are written to <workbook>_profile.json (see sync.profiling); deep_profile adds cProfile
+    and tracemalloc output for the slowest stage. formats lists the outputs (see sync.formats): the
+    styled workbook and/or a directory of Parquet/CSV/JSON Lines tables; the workbook path is
+    returned when it is written, the directory otherwise. match_keys are the keys students are
+    matched on, in order of priority (see sync.matching.MATCH_KEYS). oa_api reads OA students from the
+    OpenApply API instead of the OA export, isams_feed iSAMS pupils from an XML feed instead of the
+    iSAMS export (see load_data). With summary_only, the run stops once the students are compared
+    and returns their conflict counts (see conflict_counts) instead: no possible matches, notes,
+    sheets or files are built, and no incremental snapshot is saved. snapshot_by_school keys the
+    snapshot on the school name alone instead of also on data_dir, for data directories that only
+    live for one run.
+    """
+    check_formats(formats)
+    run_profile = RunProfile(deep=deep_profile) if profile or deep_profile else None
+    print('Starting iSAMS-OA Sync. . .')
+    print('Loading all files. . .')
+    with stage(run_profile, 'ingest') as record:
+        if nationality_mapping is None:
+            nationality_mapping = load_nationality_mapping(cache_dir=cache_dir)
+        oa_df, isams_df, grade_year_mapping_dict = load_data(school_name, data_dir=data_dir, cache_dir=cache_dir, oa_api=oa_api, isams_feed=isams_feed)
+        record.update({'isams_rows': len(isams_df), 'oa_rows': len(oa_df)})
+
+    print('Preprocessing files. . .')
+    with stage(run_profile, 'preprocess_isams') as record:
+        isams_df_copy, max_i = preprocess_isams(isams_df, nationality_mapping)
+        isams_df_copy = isams_df_copy.add_prefix('isams_')
+        record.update(shape(isams_df_copy), max_i=int(max_i))
+    with stage(run_profile, 'preprocess_oa') as record:
+        oa_df_copy = preprocess_oa(oa_df, nationality_mapping, grade_year_mapping_dict)
+        oa_df_copy = oa_df_copy.add_prefix('oa_')
+        record.update(shape(oa_df_copy))
+    print('Starting merge sequence. . .')
+    merged_df, leftover_isams, leftover_oa = merge_students(isams_df_copy, oa_df_copy, profile=run_profile, match_keys=match_keys)
+    print('Merge sequence completed.')
+    if not summary_only:
+        with stage(run_profile, 'propose_matches') as record:
+            possible_matches = propose_matches(leftover_isams, leftover_oa)
+            record.update(shape(possible_matches))
+        print(f'Proposed {len(possible_matches)} possible matches for unmatched students.')
+
+    print('Comparing. . .')
+    #Analyse merged
+    if snapshot_dir is None:
+        with stage(run_profile, 'add_comparison_columns') as record:
+            merged_df_copy = add_comparison_columns(merged_df)
+            record.update(shape(merged_df_copy))
+        with stage(run_profile, 'add_parents_comparison_columns') as record:
+            merged_df_copy = add_parents_comparison_columns(merged_df_copy, max_i)
+            record.update(shape(merged_df_copy))
+        known_notes = None
+    else:
+        with stage(run_profile, 'compare_incrementally') as record:
+            context = snapshot_context(merged_df, max_i, nationality_mapping, grade_year_mapping_dict)
+            snapshot = snapshot_path(snapshot_dir, school_name, None if snapshot_by_school else data_dir)
+            merged_df_copy, known_notes, stats = compare_incrementally(merged_df, max_i, load_snapshot(snapshot, context))
+            record.update(shape(merged_df_copy), **stats)
+        print(f"Incremental: {stats['unchanged']} unchanged, {stats['modified']} modified, {stats['inserted']} inserted, {stats['deleted']} deleted.")
+    print('Comparison process done.')
+
+    base = os.path.join(output_dir or data_dir, f"isams_oa_analysis_{school_name}_{dt.now().strftime('%Y-%m-%d_%H-%M-%S')}")
+    if summary_only:
+        with stage(run_profile, 'conflict_counts') as record:
+            export_df_copy, facts = build_export_frame(merged_df_copy, leftover_isams, leftover_oa, max_i, notes=False)
+            counts = {'school': school_name, **conflict_counts(export_df_copy, len(merged_df_copy))}
+            record.update(shape(export_df_copy), facts=len(facts))
+        if run_profile is not None:
+            written = run_profile.write(f'{base}_profile.json')
+            print(f"Profile: {', '.join(written)}")
+        return counts
+
+    with stage(run_profile, 'build_notes') as record:
+        export_df_copy, facts = build_export_frame(merged_df_copy, leftover_isams, leftover_oa, max_i, known_notes=known_notes)
+        record.update(shape(export_df_copy), facts=len(facts))
+    if snapshot_dir is not None:
+        with stage(run_profile, 'save_snapshot'):
+            save_snapshot(snapshot, context, merged_df_copy, export_df_copy['Note'].to_numpy()[:len(merged_df_copy)])
+    with stage(run_profile, 'build_conflict_sheets') as record:
+        conflict_sheets = build_conflict_sheets(export_df_copy, facts, max_i)
+        record['sheet_rows'] = {name: len(sheet) for name, sheet in conflict_sheets.items()}
+    with stage(run_profile, 'build_parent_contacts') as record:
+        parent_contacts = build_parent_contacts(export_df_copy, facts)
+        record.update(shape(parent_contacts))
+    with stage(run_profile, 'build_conflict_summary') as record:
+        summary = build_conflict_summary(export_df_copy)
+        record.update(shape(summary))
+    print('Exporting. . .')
+
+    path = f'{base}.xlsx' if 'xlsx' in formats else base
+    if 'xlsx' in formats:
+        write_workbook(path, export_df_copy, conflict_sheets, max_i, possible_matches, summary, parent_contacts, profile=run_profile)
+    if any(fmt in MACHINE_FORMATS for fmt in formats):
+        with stage(run_profile, 'write_tables') as record:
+            tables = {'All Comparison': export_df_copy, **conflict_sheets, 'Parent Contacts': parent_contacts, 'Possible Matches': possible_matches, 'Conflict Summary': summary}
+            record['files'] = len(write_tables(base, tables, formats))
+    print('iSAMS-OA Synchronizing process is done.')
+    if run_profile is not None:
+        written = run_profile.write(f'{base}_profile.json')
+        print(f"Profile: {', '.join(written)}")
+    return path
@@ -0,0 +1,124 @@
+import contextlib
+import cProfile
+import json
+import os
+import platform
+import pstats
+import sys
+import time
+import tracemalloc
+from datetime import datetime as dt
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Allocation sites and functions listed in the summary of the slowest stage
+TRACEMALLOC_TOP = 25
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, None where the platform does not report it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def shape(df):
+    return {'rows': int(df.shape[0]), 'columns': int(df.shape[1])}
+
+
+class RunProfile:
+    """Records wall time, CPU time, peak RSS and the frame shape of every pipeline stage.
+
+    With deep, every stage also runs under its own cProfile and tracemalloc; only the statistics of
+    the slowest stage are kept, to be dumped next to the report.
+    """
+
+    def __init__(self, deep=False):
+        self.deep = deep
+        self.stages = []
+        self.started_at = dt.now()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._slowest = None
+        if deep:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measures the enclosed block. Yields the stage's record, to which the caller can add the
+        rows/columns of what the stage produced (see shape)."""
+        record = {'stage': name}
+        rss_before = peak_rss_mb()
+        profiler = cProfile.Profile() if self.deep else None
+        if self.deep:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record['wall_seconds'] = round(time.perf_counter() - wall, 4)
+            record['cpu_seconds'] = round(time.process_time() - cpu, 4)
+            record['peak_rss_mb'] = peak_rss_mb()
+            if rss_before is not None:
+                record['peak_rss_growth_mb'] = round(record['peak_rss_mb'] - rss_before, 1)
+            if self.deep:
+                traced_peak = tracemalloc.get_traced_memory()[1]
+                record['traced_peak_mb'] = round((traced_peak - traced_before) / 2**20, 2)
+                if self._slowest is None or record['wall_seconds'] > self._slowest[0]['wall_seconds']:
+                    self._slowest = (record, profiler, tracemalloc.take_snapshot())
+            self.stages.append(record)
+
+    def report(self):
+        stages = sorted(self.stages, key=lambda record: record['wall_seconds'], reverse=True)
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'wall_seconds': round(time.perf_counter() - self._wall, 4),
+            'cpu_seconds': round(time.process_time() - self._cpu, 4),
+            'peak_rss_mb': peak_rss_mb(),
+            'python': platform.python_version(),
+            'slowest_stage': stages[0]['stage'] if stages else None,
+            'stages': self.stages,
+        }
+
+    def write(self, path):
+        """Writes the JSON report to path and, for a deep profile, the slowest stage's cProfile
+        statistics (<base>_slowest_stage.prof, readable with pstats) and a text summary of its top
+        allocations and functions (<base>_slowest_stage.txt). Returns the written paths."""
+        report = self.report()
+        paths = [path]
+        if self.deep and self._slowest is not None:
+            record, profiler, snapshot = self._slowest
+            tracemalloc.stop()
+            base = os.path.splitext(path)[0] + '_slowest_stage'
+            profiler.dump_stats(f'{base}.prof')
+            with open(f'{base}.txt', 'w') as f:
+                f.write(f"Top allocations alive at the end of {record['stage']}\n")
+                for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP]:
+                    f.write(f'{stat}\n')
+                f.write(f"\ncProfile of {record['stage']}, by cumulative time\n")
+                pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(TRACEMALLOC_TOP)
+            report['deep_profile'] = {'stage': record['stage'], 'cprofile': f'{base}.prof', 'summary': f'{base}.txt'}
+            paths += [f'{base}.prof', f'{base}.txt']
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        return paths
+
+
+@contextlib.contextmanager
+def stage(profile, name):
+    """profile.stage(name), or a no-op when the run is not profiled."""
+    if profile is None:
+        yield {}
+    else:
+        with profile.stage(name) as record:
+            yield record
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+from sync.isams import CONTACT_FIELDS
+
+# Declarative schema of the iSAMS and OA inputs: the columns the analysis reads, the type each one
+# gets at load time, and the value of the optional columns an input may lack. The exports are read
+# through read_isams_export and read_oa_export, which skip every other column; the iSAMS feed and
+# the OpenApply API frames go through the same typed_frame, so the pipeline can rely on the types
+# and never parses or lowercases them again. The exports are cached typed: the columns, kinds and
+# defaults below are part of their cache key (see sync.cache.cache_key), but a change to how a kind
+# is typed needs a bump of sync.cache.CACHE_VERSION.
+#
+# Kinds:
+#   text      object column; blank cells are missing
+#   key       text that is compared between iSAMS and OA; also gets '<column>_key', its lowercased
+#             value (missing where the value is), which the comparisons use
+#   date      datetime64, parsed with the given format when the cells hold text
+#   number    kept as read_excel types it (int64, or float with missing values)
+#   category  low-cardinality text, held as a categorical
+ISAMS_COLUMNS = {
+    'Date of Birth': ('date', '%B %d,%Y'),
+    'Forename': 'key',
+    'Gender': 'category',
+    'Middle Names': 'key',
+    'Preferred Name': 'key',
+    'Surname': 'key',
+    'School Code': 'number',
+    'Year (NC)': 'number',
+    'Language': 'text',
+    'Nationality': 'text',
+    'Address Type': 'category',
+    'Country': 'category',
+    **{column: 'text' for column in CONTACT_FIELDS},
+    'Relation Type': 'category',
+}
+# Not read: the iSAMS pupil email has never been compared (the Email check only sees OA's), so
+# the column is always the missing default below
+ISAMS_UNREAD = {'Pupil Email Address': 'key'}
+OA_COLUMNS = {
+    'Student Status': 'category',
+    'OpenApply ID': 'number',
+    'OpenApply URL': 'text',
+    'Student ID': 'number',
+    'Email': 'key',
+    'First Name': 'key',
+    'Middle Name(s)': 'key',
+    'Last Name': 'key',
+    'Preferred Names': 'key',
+    'Gender': 'category',
+    'Birth Date': ('date', '%d/%m/%y'),
+    'Nationality': 'text',
+    'Second Nationality': 'text',
+    'Third Nationality': 'text',
+    'Grade': 'text',
+    **{
+        f'Parent/Guardian {i} - {field}': kind
+        for i in range(1, 5)
+        for field, kind in [('Parent OpenApply ID', 'number'), ('First Name', 'text'), ('Last Name', 'text'), ('Email', 'text'), ('Relationship', 'category')]
+    },
+}
+# Columns an input may lack -> their value then
+ISAMS_DEFAULTS = {'Middle Names': np.nan, 'Pupil Email Address': np.nan}
+OA_DEFAULTS = {'Preferred Names': np.nan}
+KEY_SUFFIX = '_key'
+
+
+def _kind(spec):
+    return spec[0] if isinstance(spec, tuple) else spec
+
+
+def comparison_key(values):
+    """The lowercased text of every present value, missing elsewhere."""
+    present = values.notna()
+    keys = pd.Series(np.nan, index=values.index, dtype=object)
+    keys[present] = values[present].astype(str).str.lower()
+    return keys
+
+
+def _typed(values, spec):
+    kind = _kind(spec)
+    if kind == 'date':
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values
+        return pd.to_datetime(values, format=spec[1])
+    if kind == 'number':
+        return values
+    if values.dtype == object:
+        blank = values.map(lambda value: isinstance(value, str) and not value.strip()).to_numpy(dtype=bool)
+        if blank.any():
+            values = values.mask(blank)
+    if kind == 'category' and values.dtype == object:
+        return values.astype('category')
+    return values
+
+
+def typed_frame(df, columns, defaults):
+    """Types the columns of df listed in columns (see the kinds above) in place, adds the missing
+    optional columns with their default and the '<column>_key' column of every key column."""
+    for column, spec in columns.items():
+        if column in df:
+            df[column] = _typed(df[column], spec)
+    for column, value in defaults.items():
+        if column not in df:
+            df[column] = value
+    for column, spec in columns.items():
+        if _kind(spec) == 'key' and column in df:
+            df[column + KEY_SUFFIX] = comparison_key(df[column])
+    return df
+
+
+def typed_isams(df):
+    return typed_frame(df, {**ISAMS_COLUMNS, **ISAMS_UNREAD}, ISAMS_DEFAULTS)
+
+
+def typed_oa(df):
+    return typed_frame(df, OA_COLUMNS, OA_DEFAULTS)
+
+
+def read_isams_export(path):
+    """The iSAMS export, read with only the columns of ISAMS_COLUMNS and typed."""
+    return typed_isams(pd.read_excel(path, usecols=lambda column: column in ISAMS_COLUMNS))
+
+
+def read_oa_export(path):
+    """The OA export, read with only the columns of OA_COLUMNS and typed."""
+    return typed_oa(pd.read_excel(path, usecols=lambda column: column in OA_COLUMNS))
+
+
+# What the cached frames of the exports depend on, read by sync.cache.cache_key
+read_isams_export.schema = (ISAMS_COLUMNS, ISAMS_UNREAD, ISAMS_DEFAULTS, KEY_SUFFIX)
+read_oa_export.schema = (OA_COLUMNS, OA_DEFAULTS, KEY_SUFFIX)
@@ -0,0 +1,278 @@
+import base64
+import concurrent.futures
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sync.batch import _sync_school_job
+from sync.cache import CACHE_DIR
+from sync.formats import DEFAULT_FORMATS, check_formats
+from sync.matching import DEFAULT_MATCH_KEYS, MATCH_KEYS
+from sync.pipeline import NATIONALITY_FILE, load_nationality_mapping
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Requests waiting for a worker beyond this are refused with 503
+DEFAULT_QUEUE_SIZE = 8
+MAX_REQUEST_MB = 100
+# Names under which uploaded files are written, so that load_data finds them
+UPLOAD_FILES = {
+    'isams': 'iSAMS ({school}).xlsx',
+    'oa': 'OA ({school}).xlsx',
+    'grade_mapping': 'grade_year_mapping ({school}).csv',
+}
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Set in every worker process by _warm_worker
+_nationality_mapping = None
+
+
+def _warm_worker(nationality_mapping):
+    """Keeps the nationality mapping in the worker process; the pipeline modules are already
+    imported through this module. Ctrl+C is left to the server, which shuts the pool down."""
+    global _nationality_mapping
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _nationality_mapping = nationality_mapping
+
+
+def _ping():
+    return os.getpid()
+
+
+def _service_job(school_name, data_dir, output_dir, cache_dir, snapshot_dir, profile, formats, match_keys, summary_only, snapshot_by_school):
+    return _sync_school_job(school_name, data_dir, _nationality_mapping, output_dir, cache_dir, snapshot_dir, profile, formats, match_keys, summary_only, snapshot_by_school)
+
+
+def _request_options(request):
+    """The formats, match keys and summary_only of a request, checked like the CLI checks them."""
+    formats = request.get('formats', list(DEFAULT_FORMATS))
+    match_keys = request.get('match_keys', list(DEFAULT_MATCH_KEYS))
+    summary_only = request.get('summary_only', False)
+    if not isinstance(formats, list) or not formats:
+        raise RequestError(400, "'formats' must be a list of formats.")
+    try:
+        check_formats(formats)
+    except ValueError as e:
+        raise RequestError(400, str(e))
+    if not isinstance(match_keys, list) or not match_keys or any(key not in MATCH_KEYS for key in match_keys):
+        raise RequestError(400, f"'match_keys' must be a list of {', '.join(MATCH_KEYS)}.")
+    if not isinstance(summary_only, bool):
+        raise RequestError(400, "'summary_only' must be true or false.")
+    return tuple(dict.fromkeys(formats)), tuple(dict.fromkeys(match_keys)), summary_only
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class SyncService:
+    """Runs sync_school for HTTP requests on a pool of warm worker processes.
+
+    Each worker loads the nationality mapping once and keeps pandas, numpy and openpyxl imported;
+    input files go through the ingest cache as usual. At most workers requests run at a time and
+    queue_size more wait for a worker; anything beyond that is refused rather than queued without
+    bound. A worker that dies (e.g. killed for running out of memory) breaks the pool: the requests
+    it took down get a 500 and the pool is started again.
+    """
+
+    def __init__(self, workers=None, queue_size=DEFAULT_QUEUE_SIZE, nationality_file=NATIONALITY_FILE, output_dir=None, cache_dir=CACHE_DIR, snapshot_dir=None):
+        self.workers = workers or os.cpu_count()
+        self.queue_size = queue_size
+        self.output_dir = output_dir
+        self.cache_dir = cache_dir
+        self.snapshot_dir = snapshot_dir
+        self.nationality_mapping = load_nationality_mapping(nationality_file, cache_dir=cache_dir)
+        self._slots = threading.BoundedSemaphore(self.workers + queue_size)
+        self._lock = threading.Lock()
+        self.running = 0
+        self.completed = 0
+        self.restarts = 0
+        self.pool = self._start_pool()
+
+    def _start_pool(self):
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_warm_worker, initargs=(self.nationality_mapping,),
+        )
+        # Start every worker now rather than on the first requests
+        concurrent.futures.wait([pool.submit(_ping) for _ in range(self.workers)])
+        return pool
+
+    def _pool_broken(self):
+        # Set by the executor as soon as it notices a dead worker, even between requests
+        return getattr(self.pool, '_broken', False)
+
+    def _restart_pool(self, broken_pool):
+        """Replaces broken_pool with a new pool of warm workers, unless another request already has."""
+        with self._lock:
+            if self.pool is broken_pool:
+                broken_pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = self._start_pool()
+                self.restarts += 1
+
+    def status(self):
+        with self._lock:
+            return {
+                'status': 'broken' if self._pool_broken() else 'ok', 'workers': self.workers, 'queue_size': self.queue_size,
+                'in_progress': self.running, 'completed': self.completed, 'restarts': self.restarts,
+            }
+
+    def run(self, request):
+        """Runs one request ({'school': ..., 'data_dir': ...} or {'school': ..., 'files': {...}}) and
+        returns (result, workbook bytes or None). The workbook is only read back when the request
+        asks for it with 'response': 'workbook'. 'formats', 'match_keys' and 'summary_only' are
+        passed on to sync_school; with 'summary_only', the result holds the conflict counts.
+
+        Uploads are written to a new directory every time, so their incremental snapshot is keyed
+        on the school name alone."""
+        school_name = request.get('school')
+        if not isinstance(school_name, str) or not school_name or os.sep in school_name:
+            raise RequestError(400, "'school' must be a school name.")
+        formats, match_keys, summary_only = _request_options(request)
+        want_workbook = request.get('response', 'summary') == 'workbook'
+        if want_workbook and (summary_only or 'xlsx' not in formats):
+            raise RequestError(400, "'response': 'workbook' needs the xlsx format and no 'summary_only'.")
+        if not self._slots.acquire(blocking=False):
+            raise RequestError(503, 'Too many requests in progress, try again later.')
+        upload_dir = None
+        try:
+            with self._lock:
+                self.running += 1
+            if 'files' in request:
+                upload_dir = tempfile.mkdtemp(prefix='isams-oa-sync-')
+                self._write_uploads(upload_dir, school_name, request['files'])
+                data_dir = upload_dir
+                output_dir = self.output_dir if self.output_dir is not None else upload_dir
+            elif 'data_dir' in request:
+                data_dir = request['data_dir']
+                if not os.path.isdir(data_dir):
+                    raise RequestError(400, f"'data_dir' {data_dir} is not a directory.")
+                output_dir = self.output_dir
+            else:
+                raise RequestError(400, "Pass either 'data_dir' or 'files'.")
+
+            pool = self.pool
+            if self._pool_broken():
+                # A worker died between requests
+                self._restart_pool(pool)
+                pool = self.pool
+            try:
+                future = pool.submit(
+                    _service_job, school_name, data_dir, output_dir, self.cache_dir, self.snapshot_dir,
+                    bool(request.get('profile', False)), formats, match_keys, summary_only, upload_dir is not None,
+                )
+                result = future.result()
+            except BrokenProcessPool:
+                self._restart_pool(pool)
+                raise RequestError(500, 'A worker process died while running the request; the workers were restarted.')
+            workbook = None
+            if result['status'] == 'ok' and want_workbook:
+                with open(result['output'], 'rb') as f:
+                    workbook = f.read()
+            if upload_dir is not None and output_dir == upload_dir and 'output' in result:
+                # The workbook goes away with the uploaded files
+                result['output'] = None
+            return result, workbook
+        finally:
+            if upload_dir is not None:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+            self._slots.release()
+
+    @staticmethod
+    def _write_uploads(upload_dir, school_name, files):
+        missing = [key for key in UPLOAD_FILES if key not in files]
+        if missing:
+            raise RequestError(400, f"Missing files: {', '.join(missing)}.")
+        for key, pattern in UPLOAD_FILES.items():
+            try:
+                content = base64.b64decode(files[key], validate=True)
+            except (TypeError, ValueError):
+                raise RequestError(400, f"File '{key}' is not valid base64.")
+            with open(os.path.join(upload_dir, pattern.format(school=school_name)), 'wb') as f:
+                f.write(content)
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+class SyncRequestHandler(BaseHTTPRequestHandler):
+    """GET /health reports the pool; POST /sync runs a school (see SyncService.run)."""
+
+    service = None
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/health':
+            status = self.service.status()
+            self._send_json(200 if status['status'] == 'ok' else 503, status)
+        else:
+            self._send_json(404, {'error': f'Unknown path {self.path}.'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/sync':
+            self._send_json(404, {'error': f'Unknown path {self.path}.'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_REQUEST_MB * 2**20:
+                raise RequestError(413, f'Requests are limited to {MAX_REQUEST_MB} MB.')
+            try:
+                request = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                raise RequestError(400, 'The request body must be JSON.')
+            if not isinstance(request, dict):
+                raise RequestError(400, 'The request body must be a JSON object.')
+            result, workbook = self.service.run(request)
+        except RequestError as e:
+            self._send_json(e.status, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {'error': f'{type(e).__name__}: {e}'})
+            return
+
+        if result['status'] != 'ok':
+            result.pop('traceback', None)
+            self._send_json(500, result)
+        elif workbook is not None:
+            self.send_response(200)
+            self.send_header('Content-Type', XLSX_CONTENT_TYPE)
+            self.send_header('Content-Disposition', f'attachment; filename="isams_oa_analysis_{result["school"]}.xlsx"')
+            self.send_header('Content-Length', str(len(workbook)))
+            self.send_header('X-Sync-Seconds', str(result['seconds']))
+            self.end_headers()
+            self.wfile.write(workbook)
+        else:
+            self._send_json(200, result)
+
+    def _send_json(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        if status == 503:
+            self.send_header('Retry-After', '5')
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, **service_options):
+    """Serves SyncService(**service_options) over HTTP until interrupted."""
+    service = SyncService(**service_options)
+    handler = type('Handler', (SyncRequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f'Serving iSAMS-OA Sync on http://{host}:{server.server_address[1]} with {service.workers} workers. . .')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+# Largest vocabulary whose membership tests use one uint64 bitmask per distinct set
+MAX_BITMASK_VALUES = 64
+
+
+def set_column(tuples, index=None):
+    """Set-valued column from an array of tuples: a categorical whose categories are the distinct
+    sets. Every row only holds an integer code, and siblings or students with the same
+    nationalities share one category."""
+    codes, uniques = pd.factorize(np.asarray(tuples, dtype=object))
+    categories = pd.Index(uniques, dtype=object, tupleize_cols=False)
+    return pd.Series(pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(categories)), index=index)
+
+
+def sets_from_long(rows, values, n_rows, index=None):
+    """Set-valued column from a long (row, value) table, row being a position below n_rows. Values
+    keep the order of their first appearance; rows without values get the empty set."""
+    long = pd.DataFrame({'row': rows, 'value': values}).drop_duplicates()
+    long = long.iloc[np.argsort(long['row'].to_numpy(), kind='stable')]
+    rows, values = long['row'].to_numpy(dtype=int), long['value'].tolist()
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]) if len(rows) else np.array([], dtype=int)
+    bounds = np.r_[starts, len(rows)].tolist()
+    tuples = np.fromiter((() for _ in range(n_rows)), dtype=object, count=n_rows)
+    tuples[rows[starts]] = np.fromiter((tuple(values[a:b]) for a, b in zip(bounds[:-1], bounds[1:])), dtype=object, count=len(starts))
+    return set_column(tuples, index=index)
+
+
+def _vocabulary(categories):
+    """(category position, value code) of every element of the categories, and the vocabulary the
+    codes refer to."""
+    lengths = np.fromiter((len(c) for c in categories), dtype=int, count=len(categories))
+    elements = pd.Series([v for c in categories for v in c], dtype=object)
+    codes, vocabulary = pd.factorize(elements)
+    return np.repeat(np.arange(len(categories)), lengths), codes, pd.Index(vocabulary, dtype=object)
+
+
+def set_contains(sets, values):
+    """True where the value of a row is an element of the row's set. Missing values and sets are
+    never contained.
+
+    The test runs on the codes: each distinct set becomes a bitmask over the vocabulary of its
+    column when that has at most MAX_BITMASK_VALUES values (nationalities, relationships), and a
+    lookup of (set, value) code pairs otherwise (names, emails).
+    """
+    sets = sets if isinstance(sets.dtype, pd.CategoricalDtype) else set_column(sets.to_numpy())
+    set_codes = sets.cat.codes.to_numpy()
+    owners, element_codes, vocabulary = _vocabulary(sets.cat.categories)
+    value_codes = vocabulary.get_indexer(pd.Series(values, dtype=object).to_numpy()) if len(vocabulary) else np.full(len(set_codes), -1)
+    known = (set_codes >= 0) & (value_codes >= 0)
+    if len(vocabulary) <= MAX_BITMASK_VALUES:
+        masks = np.zeros(len(sets.cat.categories), dtype=np.uint64)
+        np.bitwise_or.at(masks, owners, np.left_shift(np.uint64(1), element_codes.astype(np.uint64)))
+        bits = np.right_shift(masks[np.where(known, set_codes, 0)], np.where(known, value_codes, 0).astype(np.uint64))
+        return known & (bits & np.uint64(1)).astype(bool)
+    pairs = pd.MultiIndex.from_arrays([owners, element_codes])
+    return known & pd.MultiIndex.from_arrays([set_codes, value_codes]).isin(pairs)
+
+
+def set_lists(sets):
+    """The sets as lists, the way the workbook shows them. Rows with the same set share one list."""
+    if isinstance(sets.dtype, pd.CategoricalDtype):
+        lists = np.empty(len(sets.cat.categories) + 1, dtype=object)
+        lists[:-1] = [list(c) for c in sets.cat.categories]
+        lists[-1] = np.nan
+        # The code -1 of a missing set picks the trailing NaN
+        return pd.Series(lists[sets.cat.codes.to_numpy()], index=sets.index, dtype=object)
+    return sets.map(lambda s: list(s) if isinstance(s, tuple) else s)
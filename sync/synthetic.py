@@ -0,0 +1,235 @@
+import os
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from sync.export import excel_value
+from sync.pipeline import NATIONALITY_FILE
+
+# Synthetic iSAMS / OA exports in the column layouts the pipeline reads, for benchmarking at
+# sizes the sample school does not reach. Everything is drawn from one seeded generator, so the
+# same parameters always produce the same files.
+ISAMS_COLUMNS = [
+    'Date of Birth', 'Forename', 'Gender', 'Middle Names', 'Preferred Name', 'Surname', 'School Code',
+    'Year (NC)', 'Language', 'Nationality', 'Address Type', 'Country', 'Primary Contact Email',
+    'Primary Contact Forename', 'Primary Contact Surname', 'Primary Contact Title', 'Relation Type',
+    'Secondary Contact Email', 'Secondary Contact Forename', 'Secondary Contact Surname', 'Secondary Contact Title',
+]
+OA_PARENT_FIELDS = ['Parent ID', 'Parent OpenApply ID', 'First Name', 'Last Name', 'Email', 'Relationship']
+OA_COLUMNS = [
+    'Student Status', 'OpenApply ID', 'OpenApply URL', 'Student ID', 'Email', 'First Name', 'Middle Name(s)',
+    'Last Name', 'Gender', 'Birth Date', 'Language', 'Second Language', 'Other Languages Spoken',
+    'Language at Home', 'Nationality', 'Second Nationality', 'Third Nationality', 'Home Address - Country', 'Grade',
+] + [f'Parent/Guardian {i} - {field}' for i in range(1, 5) for field in OA_PARENT_FIELDS]
+OA_PARENT_SLOTS = 4
+OA_NATIONALITY_COLUMNS = ['Nationality', 'Second Nationality', 'Third Nationality']
+# Excel's row limit, header included
+MAX_EXCEL_ROWS = 1048576
+
+FIRST_NAMES = [
+    'Anna', 'Ben', 'Chiara', 'Daan', 'Emil', 'Finn', 'Greta', 'Hugo', 'Ida', 'Jonas', 'Karim', 'Lena', 'Mia',
+    'Noah', 'Olivia', 'Paul', 'Rania', 'Sara', 'Tim', 'Una', 'Viktor', 'Wen', 'Yusuf', 'Zoe', 'Amir', 'Bella',
+    'Carlos', 'Dana', 'Elif', 'Felix', 'Hana', 'Ivan', 'Julia', 'Kenji', 'Leon', 'Maya', 'Nils', 'Omar',
+    'Priya', 'Rafael', 'Sofia', 'Theo', 'Valentina', 'William', 'Yara', 'Zeynep',
+]
+SURNAME_SYLLABLES = [
+    'ber', 'mann', 'schm', 'idt', 'wa', 'gner', 'ko', 'ch', 'ri', 'ter', 'kl', 'ein', 'hof', 'fer', 'al',
+    'mo', 'ra', 'tan', 'li', 'ng', 'sa', 'to', 'van', 'der', 'zu', 'ha', 'ne', 'lo', 'pe', 'dro',
+]
+# (nationality title as exported, ISO code)
+NATIONALITIES = [
+    ('German', 'DE'), ('British', 'GB'), ('American', 'US'), ('French', 'FR'), ('Dutch', 'NL'),
+    ('Italian', 'IT'), ('Spanish', 'ES'), ('Turkish', 'TR'), ('Polish', 'PL'), ('Indian', 'IN'),
+    ('Chinese', 'CN'), ('Japanese', 'JP'), ('Korean', 'KR'), ('Brazilian', 'BR'), ('Canadian', 'CA'),
+    ('Australian', 'AU'), ('Swiss', 'CH'), ('Austrian', 'AT'), ('Swedish', 'SE'), ('Egyptian', 'EG'),
+]
+RELATIONS = ['Mother', 'Father', 'Guardian', 'Grandmother', 'Grandfather', 'Other']
+LEFT_STATUSES = ['Withdrawn', 'Graduated', 'Pending', 'Applied']
+GRADES = range(1, 13)
+REFERENCE_YEAR = 2024
+
+
+def _surnames(rng, n):
+    syllables = np.array(SURNAME_SYLLABLES, dtype=object)
+    return np.char.capitalize(
+        (syllables[rng.integers(0, len(syllables), n)] + syllables[rng.integers(0, len(syllables), n)]
+         + syllables[rng.integers(0, len(syllables), n)]).astype(str)
+    ).astype(object)
+
+
+def _students(rng, n):
+    """n students with distinct Forename + Surname, since iSAMS rows are grouped by that Id."""
+    names = pd.DataFrame(columns=['forename', 'surname'])
+    while len(names) < n:
+        more = pd.DataFrame({
+            'forename': rng.choice(FIRST_NAMES, 2 * n),
+            'surname': _surnames(rng, 2 * n),
+        })
+        names = pd.concat([names, more], ignore_index=True)
+        names = names[~(names['forename'] + names['surname']).duplicated()]
+    students = names.iloc[:n].reset_index(drop=True)
+    students['id'] = np.arange(1, n + 1)
+    students['year'] = rng.choice(GRADES, n)
+    days = rng.integers(0, 365, n)
+    students['dob'] = pd.to_datetime((REFERENCE_YEAR - 6 - students['year']).astype(str) + '-09-01') + pd.to_timedelta(days, unit='D')
+    students['gender'] = rng.choice(['M', 'F'], n)
+    return students
+
+
+def _nationalities(rng, n, max_nationalities):
+    """(n x max_nationalities) titles, NaN past each student's own count."""
+    titles = np.array([title for title, _ in NATIONALITIES], dtype=object)
+    counts = rng.integers(1, max_nationalities + 1, n)
+    picked = titles[rng.integers(0, len(titles), (n, max_nationalities))]
+    picked[np.arange(max_nationalities) >= counts[:, None]] = np.nan
+    return picked
+
+
+def _contacts(rng, students, max_contacts):
+    """One row per contact: student position, slot, names, email and relation."""
+    n = len(students)
+    counts = np.minimum(rng.integers(1, max_contacts + 2, n), max_contacts)
+    student = np.repeat(np.arange(n), counts)
+    slot = pd.Series(student).groupby(student).cumcount().to_numpy() + 1
+    forename = rng.choice(FIRST_NAMES, len(student))
+    surname = np.where(rng.random(len(student)) < 0.8, students['surname'].to_numpy()[student], _surnames(rng, len(student)))
+    email = pd.Series(forename).str.lower() + '.' + pd.Series(surname).str.lower() + pd.Series(student + 1).astype(str) + '@example.com'
+    return pd.DataFrame({
+        'student': student, 'slot': slot, 'forename': forename, 'surname': surname,
+        'email': email, 'relation': np.array(RELATIONS, dtype=object)[np.minimum(slot, len(RELATIONS)) - 1],
+    })
+
+
+def _perturb(rng, values, rate, change):
+    """Applies change to a random rate share of values (a copy)."""
+    values = np.array(values, dtype=object)
+    hit = rng.random(len(values)) < rate
+    values[hit] = change(values[hit])
+    return values
+
+
+def write_xlsx(path, df):
+    """Writes df as a plain sheet with a write-only workbook, which keeps large exports fast."""
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Sheet1')
+    worksheet.append(list(df.columns))
+    for values in df.itertuples(index=False, name=None):
+        worksheet.append([excel_value(value) for value in values])
+    workbook.save(path)
+
+
+def generate_school(data_dir, school_name='Synthetic School', students=1000, contacts=2, nationalities=2,
+                    id_mismatch_rate=0.02, conflict_rate=0.05, left_rate=0.2, seed=0):
+    """Writes iSAMS, OA, grade mapping and nationality mapping files for a synthetic school.
+
+    contacts and nationalities are the most contacts / nationalities a student can have. A
+    id_mismatch_rate share of students cannot be matched by ID (missing iSAMS School Code or a
+    mistyped OA Student ID), and every compared field differs between the two exports for a
+    conflict_rate share of students. OA additionally lists left_rate * students former students.
+    Returns the paths of the written files.
+    """
+    if not 1 <= nationalities <= len(OA_NATIONALITY_COLUMNS):
+        raise ValueError(f'nationalities must be between 1 and {len(OA_NATIONALITY_COLUMNS)}')
+    rng = np.random.default_rng(seed)
+    roster = _students(rng, students)
+    contact_rows = _contacts(rng, roster, contacts)
+    if len(contact_rows) + 1 > MAX_EXCEL_ROWS:
+        raise ValueError(f'{len(contact_rows)} iSAMS contact rows do not fit in one Excel sheet')
+    nationality = _nationalities(rng, students, nationalities)
+
+    # iSAMS: one row per contact, student columns repeated
+    on = contact_rows['student'].to_numpy()
+    school_code = _perturb(rng, roster['id'].astype(float), id_mismatch_rate / 2, lambda v: np.full(len(v), np.nan))
+    isams = pd.DataFrame({
+        'Date of Birth': roster['dob'].to_numpy()[on],
+        'Forename': roster['forename'].to_numpy()[on],
+        'Gender': roster['gender'].to_numpy()[on],
+        'Middle Names': np.nan,
+        'Preferred Name': np.nan,
+        'Surname': roster['surname'].to_numpy()[on],
+        'School Code': school_code[on],
+        'Year (NC)': roster['year'].to_numpy()[on],
+        'Language': 'English',
+        'Nationality': pd.DataFrame(nationality).stack().groupby(level=0).agg(', '.join).reindex(range(students)).to_numpy()[on],
+        'Address Type': 'Home',
+        'Country': 'Germany',
+        'Primary Contact Email': contact_rows['email'],
+        'Primary Contact Forename': contact_rows['forename'],
+        'Primary Contact Surname': contact_rows['surname'],
+        'Primary Contact Title': ' ',
+        'Relation Type': contact_rows['relation'],
+        'Secondary Contact Email': np.nan,
+        'Secondary Contact Forename': np.nan,
+        'Secondary Contact Surname': np.nan,
+        'Secondary Contact Title': np.nan,
+    })[ISAMS_COLUMNS]
+
+    # OA: one row per student, with conflicts and mistyped IDs applied to the OA side
+    student_id = _perturb(rng, roster['id'].astype(float), id_mismatch_rate / 2, lambda v: v + 10 * students)
+    dob = _perturb(rng, roster['dob'], conflict_rate, lambda v: v + pd.Timedelta(days=1))
+    year = _perturb(rng, roster['year'], conflict_rate, lambda v: np.where(v > 1, v - 1, v + 1))
+    oa = pd.DataFrame({
+        'Student Status': 'Enrolled',
+        'OpenApply ID': 5000000 + roster['id'],
+        'OpenApply URL': 'https://synthetic.openapply.com/admin/students/' + (5000000 + roster['id']).astype(str),
+        'Student ID': student_id.astype(float),
+        'Email': (roster['forename'].str.lower() + '.' + roster['surname'].str.lower() + '@student.example.com'),
+        'First Name': _perturb(rng, roster['forename'], conflict_rate, lambda v: v + 'a'),
+        'Middle Name(s)': np.nan,
+        'Last Name': _perturb(rng, roster['surname'], conflict_rate, lambda v: v + 'e'),
+        'Gender': np.where(roster['gender'] == 'M', 'Male', 'Female'),
+        'Birth Date': pd.to_datetime(pd.Series(dob)).dt.strftime('%d/%m/%y'),
+        'Language': 'English',
+        'Second Language': np.nan,
+        'Other Languages Spoken': np.nan,
+        'Language at Home': 'English',
+        'Home Address - Country': 'Germany',
+        'Grade': 'Grade ' + pd.Series(year).astype(str),
+    })
+    oa_nationality = nationality.copy()
+    oa_nationality[:, 0] = _perturb(rng, oa_nationality[:, 0], conflict_rate, lambda v: np.full(len(v), 'Swiss'))
+    for k, column in enumerate(OA_NATIONALITY_COLUMNS):
+        oa[column] = oa_nationality[:, k] if k < nationalities else np.nan
+
+    oa_contacts = contact_rows[contact_rows['slot'] <= OA_PARENT_SLOTS]
+    oa_email = _perturb(rng, oa_contacts['email'], conflict_rate, lambda v: 'changed.' + v)
+    for i in range(1, OA_PARENT_SLOTS + 1):
+        slot = (oa_contacts['slot'] == i).to_numpy()
+        rows = oa_contacts['student'].to_numpy()[slot]
+        values = {
+            'Parent ID': oa_contacts.index.to_numpy()[slot] + 1.0,
+            'Parent OpenApply ID': oa_contacts.index.to_numpy()[slot] + 2000000.0,
+            'First Name': oa_contacts['forename'].to_numpy()[slot],
+            'Last Name': oa_contacts['surname'].to_numpy()[slot],
+            'Email': oa_email[slot],
+            'Relationship': oa_contacts['relation'].to_numpy()[slot],
+        }
+        for field, value in values.items():
+            column = np.full(students, np.nan, dtype=object)
+            column[rows] = value
+            oa[f'Parent/Guardian {i} - {field}'] = column
+
+    # Former students only exist in OA
+    left = int(students * left_rate)
+    if left:
+        former = oa.sample(left, replace=left > students, random_state=seed).copy()
+        former['Student Status'] = rng.choice(LEFT_STATUSES, left)
+        former['Student ID'] = np.arange(left) + 20.0 * students + 1
+        former['OpenApply ID'] = np.arange(left) + 6000000
+        former['First Name'] = former['First Name'] + 'o'
+        oa = pd.concat([oa, former], ignore_index=True)
+    oa = oa[OA_COLUMNS]
+
+    os.makedirs(data_dir, exist_ok=True)
+    paths = {
+        'isams': os.path.join(data_dir, f'iSAMS ({school_name}).xlsx'),
+        'oa': os.path.join(data_dir, f'OA ({school_name}).xlsx'),
+        'grade_year_mapping': os.path.join(data_dir, f'grade_year_mapping ({school_name}).csv'),
+        'nationality': os.path.join(data_dir, NATIONALITY_FILE),
+    }
+    write_xlsx(paths['isams'], isams)
+    write_xlsx(paths['oa'], oa)
+    pd.DataFrame({'Year (NC)': list(GRADES), 'Grade': [f'Grade {year}' for year in GRADES]}).to_csv(paths['grade_year_mapping'], index=False)
+    pd.DataFrame(NATIONALITIES, columns=['Title', 'ISO'])[['ISO', 'Title']].to_csv(paths['nationality'], index=False)
+    return paths
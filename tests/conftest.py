@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from sync.comparison import add_comparison_columns, add_parents_comparison_columns
+from sync.pipeline import NATIONALITY_FILE, load_data, load_nationality_mapping, merge_students, preprocess_isams, preprocess_oa
+from sync.synthetic import generate_school
+
+SCHOOL_NAME = 'Synthetic School'
+
+
+@pytest.fixture(scope='session')
+def synthetic_school(tmp_path_factory):
+    """Data directory of a small synthetic school with students on one side only on both sides."""
+    data_dir = tmp_path_factory.mktemp('school')
+    generate_school(str(data_dir), SCHOOL_NAME, students=200, contacts=3, id_mismatch_rate=0.1, conflict_rate=0.1, seed=1)
+    return str(data_dir)
+
+
+@pytest.fixture(scope='session')
+def nationality_mapping(synthetic_school):
+    return load_nationality_mapping(os.path.join(synthetic_school, NATIONALITY_FILE), cache_dir=None)
+
+
+@pytest.fixture(scope='session')
+def compared_school(synthetic_school, nationality_mapping):
+    """(merged and compared students, iSAMS students only, OA students only, max_i) of the
+    synthetic school, as sync_school builds them."""
+    oa_df, isams_df, grade_mapping = load_data(SCHOOL_NAME, data_dir=synthetic_school, cache_dir=None)
+    isams_df_copy, max_i = preprocess_isams(isams_df, nationality_mapping)
+    oa_df_copy = preprocess_oa(oa_df, nationality_mapping, grade_mapping)
+    merged_df, leftover_isams, leftover_oa = merge_students(isams_df_copy.add_prefix('isams_'), oa_df_copy.add_prefix('oa_'))
+    merged_df_copy = add_parents_comparison_columns(add_comparison_columns(merged_df), max_i)
+    return merged_df_copy, leftover_isams, leftover_oa, max_i
@@ -0,0 +1,104 @@
+import json
+import math
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenApply v3 API: serves the given student and parent records page by
+# page, exchanges client credentials for a token and fails the requests it is told to.
+TOKEN = 'stub-token'
+CLIENT_SECRET = 'stub-secret'
+
+
+class StubOpenApply:
+    """Runs the stub on a free port of 127.0.0.1 while used as a context manager.
+
+    failures maps a page number to the statuses its first requests get, e.g. {2: [429, 503]};
+    latency delays every student request. The served pages, the number of requests and the most
+    requests in flight at once are recorded.
+    """
+
+    def __init__(self, students, parents, failures=None, latency=0.0):
+        self.students = students
+        self.parents = {parent['id']: parent for parent in parents}
+        self.failures = {page: list(statuses) for page, statuses in (failures or {}).items()}
+        self.latency = latency
+        self.served_pages = []
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def page(self, number, per_page):
+        chunk = self.students[(number - 1) * per_page:number * per_page]
+        ids = [link['id'] if isinstance(link, dict) else link for student in chunk for link in student.get('parent_ids', [])]
+        return {
+            'students': chunk,
+            'linked': {'parents': [self.parents[i] for i in dict.fromkeys(ids) if i in self.parents]},
+            'meta': {'page': number, 'per_page': per_page, 'pages': max(1, math.ceil(len(self.students) / per_page))},
+        }
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                if status in (429, 503):
+                    self.send_header('Retry-After', '0')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = urllib.parse.parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+                if body.get('grant_type') == ['client_credentials'] and body.get('client_secret') == [CLIENT_SECRET]:
+                    self._send(200, {'access_token': TOKEN})
+                else:
+                    self._send(401, {'error': 'invalid_client'})
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.requests += 1
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    time.sleep(stub.latency)
+                    url = urllib.parse.urlsplit(self.path)
+                    if url.path != '/api/v3/students':
+                        return self._send(404, {})
+                    if self.headers.get('Authorization') != f'Bearer {TOKEN}':
+                        return self._send(401, {})
+                    query = urllib.parse.parse_qs(url.query)
+                    number, per_page = int(query['page'][0]), int(query['per_page'][0])
+                    with stub.lock:
+                        statuses = stub.failures.get(number)
+                        status = statuses.pop(0) if statuses else 200
+                        if status == 200:
+                            stub.served_pages.append(number)
+                    if status != 200:
+                        return self._send(status, {})
+                    self._send(200, stub.page(number, per_page))
+                finally:
+                    with stub.lock:
+                        stub.in_flight -= 1
+
+        return Handler
@@ -0,0 +1,31 @@
+import os
+import time
+
+import sync.batch
+from sync.batch import run_batch
+from sync.pipeline import NATIONALITY_FILE
+
+CRASHING_SCHOOL = 'Crashing School'
+
+
+def crashing_job(school_name, data_dir, *args):
+    """Stands in for _sync_school_job: the crashing school kills its worker, like an out-of-memory
+    kill would, while the others are still queued."""
+    if school_name == CRASHING_SCHOOL:
+        os._exit(1)
+    time.sleep(0.1)
+    return {'school': school_name, 'data_dir': data_dir, 'status': 'ok', 'output': None}
+
+
+def test_dead_worker_only_fails_its_school(synthetic_school, monkeypatch):
+    monkeypatch.setattr(sync.batch, '_sync_school_job', crashing_job)
+    schools = [(f'School {k}', synthetic_school) for k in range(3)] + [(CRASHING_SCHOOL, synthetic_school)] + [(f'School {k}', synthetic_school) for k in range(3, 6)]
+    reported = []
+    summary = run_batch(schools, workers=2, nationality_file=os.path.join(synthetic_school, NATIONALITY_FILE), cache_dir=None, on_result=reported.append)
+
+    assert [result['school'] for result in summary['schools']] == [school_name for school_name, _ in schools]
+    assert summary['succeeded'] == 6 and summary['failed'] == 1
+    failed, = [result for result in summary['schools'] if result['status'] != 'ok']
+    assert failed['school'] == CRASHING_SCHOOL
+    assert failed['error'].startswith('BrokenProcessPool')
+    assert sorted(result['school'] for result in reported) == sorted(school_name for school_name, _ in schools)
@@ -0,0 +1,15 @@
+import os
+
+from sync.cache import cached_read
+from sync.schema import OA_COLUMNS, read_oa_export
+from tests.conftest import SCHOOL_NAME
+
+
+def test_schema_change_misses_the_cache(synthetic_school, tmp_path, monkeypatch):
+    path = os.path.join(synthetic_school, f'OA ({SCHOOL_NAME}).xlsx')
+    assert cached_read(path, read_oa_export, cache_dir=str(tmp_path))['Grade'].dtype == object
+    assert len(os.listdir(tmp_path)) == 1
+
+    monkeypatch.setitem(OA_COLUMNS, 'Grade', 'category')
+    assert cached_read(path, read_oa_export, cache_dir=str(tmp_path))['Grade'].dtype == 'category'
+    assert len(os.listdir(tmp_path)) == 2
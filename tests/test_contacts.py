@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+from sync.contacts import FAMILY_COLUMN, add_family_index
+
+
+def test_only_identical_parent_slots_share_a_family():
+    isams = pd.DataFrame({
+        'Primary Contact Forename 1': ['Anna', 'anna', 'Anna', 'Anna'],
+        'Primary Contact Surname 1': ['Meyer', 'MEYER', 'Meyer', 'Meyer'],
+        'Primary Contact Email 1': ['anna@example.com'] * 4,
+        'Relation Type 1': ['Mother'] * 4,
+        # The third student is a half-sibling: same mother, another father
+        'Primary Contact Forename 2': ['Jan', 'Jan', 'Tom', np.nan],
+        'Primary Contact Surname 2': ['Meyer', 'Meyer', 'Berg', np.nan],
+        'Primary Contact Email 2': ['jan@example.com', 'jan@example.com', 'tom@example.com', np.nan],
+        'Relation Type 2': ['Father', 'Father', 'Father', np.nan],
+    })
+    families = add_family_index(isams, 'isams', 2)[FAMILY_COLUMN].to_numpy()
+    assert families[0] == families[1]
+    assert len({families[0], families[2], families[3]}) == 3
@@ -0,0 +1,70 @@
+import os
+
+import pandas as pd
+
+from sync.isams import CONTACT_FIELDS, PARENT_SET_COLUMNS, iter_pupils, pupils_frame, read_isams_feed
+from sync.nationality import nationality_lookup
+from sync.pipeline import preprocess_isams
+from sync.schema import read_isams_export, typed_isams
+
+FEED = os.path.join(os.path.dirname(__file__), 'fixtures', 'isams_feed.xml')
+PUPILS = {
+    448: {'Forename': 'Anna', 'Middle Names': 'Maria', 'Surname': 'Schmidt', 'Preferred Name': 'Anni', 'Gender': 'F', 'Date of Birth': 'September 12,2010',
+          'Year (NC)': 9, 'Address Type': 'Home', 'Country': 'Germany', 'Language': 'German, English', 'Nationality': 'German, British'},
+    449: {'Forename': 'Ben', 'Surname': 'Okafor', 'Gender': 'M', 'Date of Birth': 'March 01,2012',
+          'Year (NC)': 7, 'Address Type': 'Home', 'Country': 'Germany', 'Language': 'English', 'Nationality': 'Nigerian'},
+    450: {'Forename': 'Chen', 'Surname': 'Li', 'Gender': 'M', 'Date of Birth': 'December 24,2011',
+          'Year (NC)': 8, 'Address Type': 'Home', 'Country': 'China', 'Language': 'Mandarin', 'Nationality': 'Chinese'},
+}
+# (School Code, Title, Forename, Surname, Email, Relation Type): the export's one row per contact
+CONTACTS = [
+    (448, 'Mrs', 'Julia', 'Schmidt', 'Julia.Schmidt@example.com', 'Mother'),
+    (448, 'Mr', 'Peter', 'Schmidt ', 'peter@example.com', 'Father'),
+    (448, 'Mrs', 'Grete', 'Schmidt', None, 'Grandmother'),
+    (449, 'Ms', 'Ada', 'Okafor', 'ada@example.com', 'Mother'),
+    (450, None, None, None, None, None),
+]
+NATIONALITIES = pd.DataFrame({'ISO': ['DE', 'GB', 'NG', 'CN'], 'Title': ['German', 'British', 'Nigerian', 'Chinese']})
+
+
+def export_rows():
+    rows = []
+    for code, title, forename, surname, email, relation in CONTACTS:
+        rows.append({
+            'School Code': code, **PUPILS[code],
+            'Primary Contact Title': title, 'Primary Contact Forename': forename, 'Primary Contact Surname': surname,
+            'Primary Contact Email': email, 'Relation Type': relation,
+        })
+    return pd.DataFrame(rows)
+
+
+def test_iter_pupils_reads_every_pupil_and_contact():
+    pupils = list(iter_pupils(FEED))
+    assert [len(contacts) for _, contacts in pupils] == [3, 1, 0]
+    # Blank elements are missing; texts keep their spaces, as export cells do
+    assert pupils[0][1][2][list(CONTACT_FIELDS).index('Primary Contact Email')] is None
+    assert pupils[0][1][1][list(CONTACT_FIELDS).index('Primary Contact Surname')] == 'Schmidt '
+
+
+def test_feed_and_export_give_the_same_students(tmp_path):
+    path = tmp_path / 'iSAMS (Fixture School).xlsx'
+    export_rows().to_excel(path, index=False)
+    mapping = nationality_lookup(NATIONALITIES)
+    from_export, export_max_i = preprocess_isams(read_isams_export(path), mapping)
+    from_feed, feed_max_i = preprocess_isams(typed_isams(read_isams_feed(FEED, cache_dir=None)), mapping)
+
+    assert export_max_i == feed_max_i == 3
+    assert from_feed['School Code'].tolist() == from_export['School Code'].tolist() == [448, 449, 450]
+    columns = [f'{column} {i}' for column in CONTACT_FIELDS for i in range(1, 4)]
+    columns += [*PARENT_SET_COLUMNS, 'Date of Birth', 'Forename', 'Middle Names', 'Surname', 'Preferred Name', 'Year (NC)', 'Nationality_mapped']
+    for column in columns:
+        pd.testing.assert_series_equal(from_feed[column].astype(object), from_export[column].astype(object), check_names=False, obj=column)
+    assert list(from_feed.loc[0, 'Parent_email_mapped']) == ['julia.schmidt@example.com', 'peter@example.com']
+    assert list(from_feed.loc[2, 'Parent_first_name_mapped']) == []
+
+
+def test_pupils_frame_numbers_contacts_in_feed_order():
+    df = pupils_frame(iter_pupils(FEED))
+    assert df['Primary Contact Forename 1'].tolist()[:2] == ['Julia', 'Ada']
+    assert df['Relation Type 3'].tolist()[0] == 'Grandmother'
+    assert df['Relation Type 2'].isna().tolist() == [False, True, True]
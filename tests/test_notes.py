@@ -0,0 +1,31 @@
+import numpy as np
+
+from sync.notes import CONFLICT_BITS
+from sync.pipeline import build_export_frame
+
+PARENT_MISSING = CONFLICT_BITS['parent_missing_in_isams'] | CONFLICT_BITS['parent_missing_in_oa']
+
+
+def test_one_sided_students_have_no_parent_missing_bits(compared_school):
+    merged_df_copy, leftover_isams, leftover_oa, max_i = compared_school
+    assert len(leftover_isams) and len(leftover_oa)
+    export_df, facts = build_export_frame(merged_df_copy, leftover_isams, leftover_oa, max_i)
+    conflicts = export_df['Conflicts'].to_numpy()
+    matched = len(merged_df_copy)
+
+    assert not (conflicts[matched:] & PARENT_MISSING).any()
+    assert (conflicts[matched:matched + len(leftover_isams)] == CONFLICT_BITS['not_in_oa']).all()
+    assert (conflicts[matched + len(leftover_isams):] == CONFLICT_BITS['not_in_isams']).all()
+
+    # Matched students keep the bit of every parent-missing fact
+    for check in ('parent_missing_in_isams', 'parent_missing_in_oa'):
+        rows = facts.loc[(facts['check'] == check).to_numpy() & (facts['row'].to_numpy() < matched), 'row'].unique()
+        assert np.count_nonzero(conflicts & CONFLICT_BITS[check]) == len(rows)
+
+
+def test_one_sided_notes_still_list_missing_parents(compared_school):
+    merged_df_copy, leftover_isams, leftover_oa, max_i = compared_school
+    export_df, _ = build_export_frame(merged_df_copy, leftover_isams, leftover_oa, max_i)
+    notes = export_df['Note'].iloc[len(merged_df_copy) + len(leftover_isams):]
+    assert notes.str.startswith('Student not in iSAMS').all()
+    assert notes.str.contains('from OA is missing in iSAMS', regex=False).any()
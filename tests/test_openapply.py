@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sync import openapply
+from sync.nationality import nationality_lookup
+from sync.openapply import OpenApplyClient, OpenApplyError, fetch_oa
+from sync.pipeline import preprocess_oa
+from sync.schema import typed_oa
+from tests.openapply_stub import CLIENT_SECRET, TOKEN, StubOpenApply
+
+STUDENTS = 23
+PER_PAGE = 5
+
+
+def records(n=STUDENTS):
+    """n enrolled students; every student has a mother, and every other one a father linked with
+    a relationship of its own."""
+    students, parents = [], []
+    for k in range(n):
+        mother, father = 1000 + k, 2000 + k
+        parents.append({'id': mother, 'parent_id': f'P{mother}', 'first_name': f'Mum{k}', 'last_name': 'Doe', 'email': f'mum{k}@example.com', 'relationship': 'Mother'})
+        links = [mother]
+        if k % 2:
+            parents.append({'id': father, 'parent_id': None, 'first_name': f'Dad{k}', 'last_name': 'Doe', 'email': '', 'relationship': 'Father'})
+            links.append({'id': father, 'relationship': 'Stepfather'})
+        students.append({
+            'id': 500 + k, 'student_id': str(100 + k), 'status': 'enrolled', 'email': f's{k}@school.org',
+            'first_name': f'Kid{k}', 'other_name': None, 'last_name': 'Doe', 'gender': 'Female',
+            'birth_date': f'2010-01-{k % 28 + 1:02d}', 'nationality': 'British', 'second_nationality': '',
+            'third_nationality': None, 'grade': 'Grade 7', 'parent_ids': links,
+        })
+    return students, parents
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(openapply, 'BACKOFF_SECONDS', 0.0)
+
+
+def test_every_page_is_fetched():
+    students, parents = records()
+    with StubOpenApply(students, parents) as stub:
+        fetched, linked = OpenApplyClient(stub.url, token=TOKEN, per_page=PER_PAGE).fetch()
+    assert sorted(stub.served_pages) == [1, 2, 3, 4, 5]
+    assert sorted(s['id'] for s in fetched) == sorted(s['id'] for s in students)
+    assert len({p['id'] for p in linked}) == len(parents)
+
+
+def test_failed_requests_are_retried():
+    students, parents = records()
+    with StubOpenApply(students, parents, failures={1: [503], 2: [429, 429], 4: [502, 500, 504]}) as stub:
+        fetched, _ = OpenApplyClient(stub.url, token=TOKEN, per_page=PER_PAGE).fetch()
+    assert len(fetched) == STUDENTS
+    assert sorted(stub.served_pages) == [1, 2, 3, 4, 5]
+    assert stub.requests == 5 + 1 + 2 + 3
+
+
+def test_gives_up_after_max_retries():
+    students, parents = records()
+    with StubOpenApply(students, parents, failures={3: [503] * (openapply.MAX_RETRIES + 1)}) as stub:
+        with pytest.raises(OpenApplyError, match='HTTP 503'):
+            OpenApplyClient(stub.url, token=TOKEN, per_page=PER_PAGE).fetch()
+
+
+def test_other_errors_are_not_retried():
+    students, parents = records()
+    with StubOpenApply(students, parents) as stub:
+        with pytest.raises(OpenApplyError, match='HTTP 401'):
+            OpenApplyClient(stub.url, token='wrong', per_page=PER_PAGE).fetch()
+        assert stub.requests == 1
+        with pytest.raises(OpenApplyError, match='HTTP 401'):
+            OpenApplyClient(stub.url, client_id='id', client_secret='wrong').fetch()
+
+
+def test_requests_in_flight_are_bounded():
+    students, parents = records(40)
+    with StubOpenApply(students, parents, latency=0.05) as stub:
+        OpenApplyClient(stub.url, token=TOKEN, connections=3, per_page=2).fetch()
+    assert len(stub.served_pages) == 20
+    assert 1 < stub.max_in_flight <= 3
+
+
+def test_oa_frame_has_the_export_columns_preprocess_oa_reads():
+    students, parents = records()
+    with StubOpenApply(students, parents) as stub:
+        oa = fetch_oa(stub.url, client_id='id', client_secret=CLIENT_SECRET, per_page=PER_PAGE)
+
+    assert len(oa) == STUDENTS
+    assert oa['Student ID'].dtype == np.int64
+    assert oa['Student ID'].tolist() == list(range(100, 100 + STUDENTS))
+    assert pd.api.types.is_datetime64_any_dtype(oa['Birth Date'])
+    assert oa.loc[0, 'Birth Date'] == pd.Timestamp('2010-01-01')
+    assert (oa['Student Status'] == 'Enrolled').all()
+    assert oa.loc[0, 'OpenApply URL'] == f'{stub.url}/admin/students/500'
+    assert oa['Nationality'].eq('British').all() and oa['Second Nationality'].isna().all()
+    assert oa.loc[0, 'Parent/Guardian 1 - Email'] == 'mum0@example.com'
+    assert oa.loc[0, 'Parent/Guardian 1 - Relationship'] == 'Mother'
+    assert pd.isna(oa.loc[0, 'Parent/Guardian 2 - First Name'])
+    # A relationship given with the link wins over the parent's own; empty fields are missing
+    assert oa.loc[1, 'Parent/Guardian 2 - Relationship'] == 'Stepfather'
+    assert pd.isna(oa.loc[1, 'Parent/Guardian 2 - Email'])
+    assert oa.loc[1, 'Parent/Guardian 2 - Parent OpenApply ID'] == 2001
+    for i in range(1, openapply.PARENT_SLOTS + 1):
+        for field in openapply.PARENT_FIELDS:
+            assert f'Parent/Guardian {i} - {field}' in oa
+
+    mapping = nationality_lookup(pd.DataFrame({'ISO': ['GB'], 'Title': ['British']}))
+    preprocessed = preprocess_oa(typed_oa(oa), mapping, {'Grade 7': 7})
+    assert list(preprocessed.loc[1, 'Parent_email_mapped']) == ['mum1@example.com']
+    assert list(preprocessed.loc[1, 'Parent_relationship_mapped']) == ['mother', 'stepfather']
+    assert list(preprocessed.loc[0, 'Grade_mapped']) == [7]
+    assert preprocessed.loc[0, 'Nationality 1_mapped'] == 'GB'
@@ -0,0 +1,27 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from sync.notes import CONFLICT_BITS
+from sync.pipeline import CONFLICT_SUMMARY_COLUMNS, sync_school
+from tests.conftest import SCHOOL_NAME
+
+
+def test_summary_only_counts_match_full_run(synthetic_school, nationality_mapping, tmp_path):
+    counts = sync_school(SCHOOL_NAME, nationality_mapping=nationality_mapping, data_dir=synthetic_school, output_dir=str(tmp_path), cache_dir=None, summary_only=True)
+    assert not list(tmp_path.iterdir())
+    json.dumps(counts)
+
+    output = sync_school(SCHOOL_NAME, nationality_mapping=nationality_mapping, data_dir=synthetic_school, output_dir=str(tmp_path), cache_dir=None, formats=('csv',))
+    conflicts = pd.read_csv(f'{output}/all_comparison.csv')['Conflicts'].to_numpy()
+    one_sided = (conflicts & (CONFLICT_BITS['not_in_oa'] | CONFLICT_BITS['not_in_isams'])) != 0
+
+    assert counts['students'] == len(conflicts)
+    assert counts['matched'] == np.count_nonzero(~one_sided)
+    assert counts['not_in_oa'] == np.count_nonzero(conflicts & CONFLICT_BITS['not_in_oa'])
+    assert counts['not_in_isams'] == np.count_nonzero(conflicts & CONFLICT_BITS['not_in_isams'])
+    assert counts['with_conflicts'] == np.count_nonzero(conflicts)
+    checks = [check for check in CONFLICT_SUMMARY_COLUMNS if check not in ('not_in_isams', 'not_in_oa')]
+    assert counts['conflicts'] == {check: np.count_nonzero(conflicts[~one_sided] & CONFLICT_BITS[check]) for check in checks}
+    assert counts['conflicts']['parent_missing_in_isams'] or counts['conflicts']['parent_missing_in_oa']
@@ -0,0 +1,122 @@
+import base64
+import json
+import os
+import signal
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import sync.service
+from sync.pipeline import NATIONALITY_FILE
+from sync.service import UPLOAD_FILES, RequestError, SyncRequestHandler, SyncService
+from tests.conftest import SCHOOL_NAME
+
+
+@pytest.fixture(scope='module')
+def service(synthetic_school, tmp_path_factory):
+    service = SyncService(
+        workers=1, nationality_file=os.path.join(synthetic_school, NATIONALITY_FILE),
+        output_dir=str(tmp_path_factory.mktemp('output')), cache_dir=None,
+        snapshot_dir=str(tmp_path_factory.mktemp('snapshots')),
+    )
+    yield service
+    service.shutdown()
+
+
+def upload_request(data_dir, **options):
+    files = {}
+    for key, pattern in UPLOAD_FILES.items():
+        with open(os.path.join(data_dir, pattern.format(school=SCHOOL_NAME)), 'rb') as f:
+            files[key] = base64.b64encode(f.read()).decode('ascii')
+    return {'school': SCHOOL_NAME, 'files': files, **options}
+
+
+def test_uploads_share_one_snapshot(service, synthetic_school):
+    for _ in range(2):
+        result, workbook = service.run(upload_request(synthetic_school, formats=['csv']))
+        assert result['status'] == 'ok', result.get('traceback')
+        assert workbook is None
+    assert os.listdir(service.snapshot_dir) == [f'{SCHOOL_NAME}.pkl']
+
+
+def test_summary_only_returns_counts(service, synthetic_school):
+    result, workbook = service.run({'school': SCHOOL_NAME, 'data_dir': synthetic_school, 'summary_only': True, 'match_keys': ['id', 'name_dob']})
+    assert result['status'] == 'ok', result.get('traceback')
+    assert 'output' not in result and workbook is None
+    assert result['counts']['students'] == result['counts']['matched'] + result['counts']['not_in_oa'] + result['counts']['not_in_isams']
+
+
+@pytest.mark.parametrize('options', [
+    {'formats': ['docx']},
+    {'formats': 'csv'},
+    {'match_keys': ['shoe_size']},
+    {'summary_only': 'yes'},
+    {'summary_only': True, 'response': 'workbook'},
+    {'formats': ['csv'], 'response': 'workbook'},
+])
+def test_bad_options_are_refused(service, synthetic_school, options):
+    with pytest.raises(RequestError) as excinfo:
+        service.run({'school': SCHOOL_NAME, 'data_dir': synthetic_school, **options})
+    assert excinfo.value.status == 400
+    assert service.running == 0
+
+
+CRASHING_SCHOOL = 'Crashing School'
+_service_job = sync.service._service_job
+
+
+def crashing_job(school_name, *args):
+    """Stands in for _service_job: the crashing school kills its worker, like an out-of-memory kill
+    would. Workers started while it is patched in run the other schools as usual."""
+    if school_name == CRASHING_SCHOOL:
+        os._exit(1)
+    return _service_job(school_name, *args)
+
+
+def test_service_recovers_from_a_dead_worker(service, synthetic_school, monkeypatch):
+    restarts = service.status()['restarts']
+    monkeypatch.setattr(sync.service, '_service_job', crashing_job)
+    with pytest.raises(RequestError) as excinfo:
+        service.run({'school': CRASHING_SCHOOL, 'data_dir': synthetic_school, 'summary_only': True})
+    assert excinfo.value.status == 500
+    status = service.status()
+    assert status['status'] == 'ok' and status['restarts'] == restarts + 1 and status['in_progress'] == 0
+
+    result, _ = service.run({'school': SCHOOL_NAME, 'data_dir': synthetic_school, 'summary_only': True})
+    assert result['status'] == 'ok', result.get('traceback')
+
+
+def test_health_reports_a_worker_killed_between_requests(service, synthetic_school):
+    restarts = service.status()['restarts']
+    os.kill(service.pool.submit(sync.service._ping).result(), signal.SIGKILL)
+    deadline = time.monotonic() + 10
+    while service.status()['status'] == 'ok' and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert service.status()['status'] == 'broken'
+
+    result, _ = service.run({'school': SCHOOL_NAME, 'data_dir': synthetic_school, 'summary_only': True})
+    assert result['status'] == 'ok', result.get('traceback')
+    assert service.status()['status'] == 'ok' and service.status()['restarts'] == restarts + 1
+
+
+def test_unexpected_errors_are_answered_with_500(service, monkeypatch):
+    def fail(request):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(service, 'run', fail)
+    handler = type('Handler', (SyncRequestHandler,), {'service': service, 'log_message': lambda *args: None})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        request = urllib.request.Request(f'http://127.0.0.1:{server.server_address[1]}/sync', data=json.dumps({'school': SCHOOL_NAME}).encode(), method='POST')
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            urllib.request.urlopen(request, timeout=10)
+        assert excinfo.value.code == 500
+        assert json.loads(excinfo.value.read()) == {'error': 'OSError: disk full'}
+    finally:
+        server.shutdown()
+        server.server_close()